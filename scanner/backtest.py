@@ -0,0 +1,238 @@
+"""
+Historical scan replay
+Evaluates every scan at every date of a price panel in one pass over the
+date x ticker arrays, instead of rebuilding the scan dataset day by day,
+and summarizes the forward returns of each date's hits.
+
+Usage (from scanner/):
+    python backtest.py                      # replay the local history store
+    python backtest.py --set eod --days 252
+    python backtest.py --synthetic 3000     # seeded synthetic market
+"""
+import argparse
+import os
+import time
+from pathlib import Path
+from typing import Dict, Hashable, List, Optional, Tuple
+import numpy as np
+import pandas as pd
+
+from history_store import HistoryStore
+from indicators import align_panel, compute_indicators, unalign
+from panel import FIELDS, bars_to_panel
+from relative_strength import relative_strength
+from strategies.dsl import PanelEvaluator, as_condition
+from strategies.expressions import MaskCache, trace
+from strategies.scans import get_scan_set, prepare_derived_columns
+
+# Forward return horizons in bars
+HORIZONS = [1, 5, 20]
+
+
+def top_k_rows(values: np.ndarray, mask: np.ndarray, k: int, ascending: bool = False) -> np.ndarray:
+    """
+    Mask of the first k hits of each row in sorted order, NaN last and ties
+    in column order, as ScanEngine.select picks them from one day's dataset
+    """
+    selected = mask.copy()
+    crowded = np.flatnonzero(mask.sum(axis=1) > k)
+    if len(crowded) == 0:
+        return selected
+
+    keys = values[crowded] if ascending else -values[crowded]
+    hits = mask[crowded]
+    # Hits with a value first, then hits without one, then everything else
+    group = np.where(hits, np.isnan(keys).astype(np.int8), 2)
+    keys = np.where(group == 0, keys, 0.0)
+    order = np.lexsort((keys, group), axis=1)
+
+    rows = np.zeros(hits.shape, dtype=bool)
+    np.put_along_axis(rows, order[:, :k], True, axis=1)
+    selected[crowded] = rows & hits
+    return selected
+
+
+class ScanReplay:
+    """
+    Every scan evaluated at every date of one price panel
+
+    Indicators are computed once on the bottom-aligned panel and moved back
+    to their dates, so each date sees the values the scan dataset would
+    have held that day. A ticker is in a date's dataset once it has
+    min_bars bars, as in latest_indicator_rows, and only on dates it has
+    a bar (a halted ticker is not scanned on its stale close).
+    Relative strength fields are ranked over the panel's tickers, with the
+    RS line against `benchmark` closes if given (group ranks stay empty).
+    """
+
+    def __init__(self, panel: Dict[str, pd.DataFrame], min_bars: int = 50,
+                 benchmark: Optional[pd.Series] = None):
+        close = panel['close']
+        self.dates = close.index
+        self.tickers = close.columns
+        self.valid = close.notna().to_numpy()
+        self.eligible = self.valid & (np.cumsum(self.valid, axis=0) >= min_bars)
+
+        ranked = relative_strength(panel, benchmark)
+        self.aligned = align_panel({**panel, **ranked})
+        bars = {field: self.aligned[field] for field in FIELDS}
+        columns = dict(bars)
+        columns.update(compute_indicators(bars))
+        columns = {name: self.unalign(frame.to_numpy(dtype='float64')) for name, frame in columns.items()}
+        columns.update({name: frame.to_numpy(dtype='float64') for name, frame in ranked.items()})
+        with np.errstate(divide='ignore', invalid='ignore'):
+            self.columns = prepare_derived_columns(columns)
+
+        # Predicates shared between scans are evaluated once over all dates
+        self.masks = MaskCache(self.columns)
+        self.panel = PanelEvaluator(self.aligned)
+        self._forward: Dict[int, np.ndarray] = {}
+
+    def unalign(self, values: np.ndarray) -> np.ndarray:
+        """Move bottom-aligned rows back to their dates; dates without a bar get NaN"""
+        return unalign(values, self.valid)
+
+    def _frames(self) -> Dict[str, pd.DataFrame]:
+        """Columns as date x ticker DataFrames, for queries that cannot be traced"""
+        return {name: pd.DataFrame(values, index=self.dates, columns=self.tickers)
+                for name, values in self.columns.items()}
+
+    def _dsl(self, text: str) -> np.ndarray:
+        return self.unalign(self.panel.array(text))
+
+    def hits(self, query_func, order_by: str, limit: int = 100, ascending: bool = False) -> np.ndarray:
+        """date x ticker mask of each date's scan results"""
+        if isinstance(query_func, str):
+            mask = as_condition(self._dsl(query_func))
+        else:
+            expr = trace(query_func)
+            mask = self.masks.mask(expr) if expr is not None else query_func(self._frames())
+            if isinstance(mask, pd.DataFrame):
+                mask = mask.to_numpy(dtype=bool, na_value=False)
+        mask = mask & self.eligible
+
+        if order_by in self.columns:
+            values = self.columns[order_by]
+        else:
+            values = self._dsl(order_by)
+        return top_k_rows(np.asarray(values, dtype='float64'), mask, limit, ascending)
+
+    def run(self, all_scans: Dict) -> Tuple[Dict[Hashable, np.ndarray], Dict[Hashable, str]]:
+        """
+        Hits of every scan in a get_all_scans-style dict, keyed by
+        (guru, scan), and the error of each scan that failed
+        """
+        results = {}
+        errors = {}
+        for guru_name, guru_info in all_scans.items():
+            for scan_name, scan_config in guru_info['scans'].items():
+                key = (guru_name, scan_name)
+                try:
+                    with np.errstate(divide='ignore', invalid='ignore'):
+                        results[key] = self.hits(scan_config['query'], scan_config['order_by'], scan_config['limit'])
+                except Exception as e:
+                    errors[key] = str(e)
+        return results, errors
+
+    def forward_returns(self, horizon: int) -> np.ndarray:
+        """Percent return from each bar's close to the close `horizon` bars later"""
+        if horizon not in self._forward:
+            close = self.aligned['close'].to_numpy(dtype='float64')
+            future = np.full(close.shape, np.nan)
+            future[:-horizon] = close[horizon:]
+            self._forward[horizon] = self.unalign((future / close - 1) * 100)
+        return self._forward[horizon]
+
+    def statistics(self, results: Dict[Hashable, np.ndarray], horizons: List[int] = HORIZONS,
+                   start: int = 0) -> pd.DataFrame:
+        """
+        Forward return statistics of each scan's hits from date row `start` on
+
+        universe_return is the average return of every ticker in the dataset
+        on the hit dates, so excess_return is what the scan added over
+        holding the whole market those days.
+        """
+        rows = []
+        eligible = self.eligible[start:]
+        for horizon in horizons:
+            forward = self.forward_returns(horizon)[start:]
+            known = eligible & ~np.isnan(forward)
+            counts = known.sum(axis=1)
+            totals = np.where(known, forward, 0.0).sum(axis=1)
+            universe = np.divide(totals, counts, out=np.full(len(counts), np.nan), where=counts > 0)
+
+            for (guru_name, scan_name), hits in results.items():
+                hits = hits[start:]
+                scored = hits & known
+                returns = forward[scored]
+                date_rows = np.nonzero(scored)[0]
+                mean = returns.mean() if len(returns) else np.nan
+                benchmark = universe[date_rows].mean() if len(returns) else np.nan
+                rows.append({
+                    'guru': guru_name,
+                    'scan': scan_name,
+                    'horizon': horizon,
+                    'signal_days': int(hits.any(axis=1).sum()),
+                    'hits': int(hits.sum()),
+                    'scored_hits': len(returns),
+                    'mean_return': mean,
+                    'median_return': np.median(returns) if len(returns) else np.nan,
+                    'win_rate': (returns > 0).mean() * 100 if len(returns) else np.nan,
+                    'universe_return': benchmark,
+                    'excess_return': mean - benchmark,
+                })
+        return pd.DataFrame(rows)
+
+
+def load_history_panel(days: Optional[int] = None) -> Dict[str, pd.DataFrame]:
+    """Price panel of everything in the local history store"""
+    bars = HistoryStore(Path("cache") / "history").bars()
+    if days is not None and not bars.empty:
+        bars = bars[bars['date'].isin(sorted(bars['date'].unique())[-days:])]
+    return bars_to_panel(bars)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay scans over historical dates")
+    parser.add_argument('--set', default=os.getenv("SCAN_SET", "guru"), help="Scan set: guru or eod")
+    parser.add_argument('--days', type=int, default=None,
+                        help="Report the last N dates (default: every date with enough history)")
+    parser.add_argument('--horizons', default=','.join(map(str, HORIZONS)),
+                        help="Forward return horizons in bars, comma separated")
+    parser.add_argument('--synthetic', type=int, default=None, metavar='TICKERS',
+                        help="Replay a seeded synthetic market instead of the history store")
+    parser.add_argument('--output', default=None, help="Write the statistics to this CSV file")
+    args = parser.parse_args()
+
+    horizons = [int(h) for h in args.horizons.split(',')]
+    if args.synthetic:
+        from synthetic import synthetic_panel
+        panel = synthetic_panel(args.synthetic, (args.days or 252) + max(horizons) + 252)
+    else:
+        panel = load_history_panel()
+    if panel['close'].empty:
+        print("No price history to replay (run the scanner with the history store first)")
+        return
+
+    started = time.perf_counter()
+    benchmark = os.getenv("RS_BENCHMARK", "SPY")
+    replay = ScanReplay(panel, benchmark=panel['close'][benchmark] if benchmark in panel['close'] else None)
+    results, errors = replay.run(get_scan_set(args.set))
+    start = max(len(replay.dates) - args.days, 0) if args.days else 0
+    stats = replay.statistics(results, horizons, start=start)
+    elapsed = time.perf_counter() - started
+
+    print(f"Replayed {len(results)} scans over {len(replay.dates) - start} dates x "
+          f"{len(replay.tickers)} tickers in {elapsed:.1f}s")
+    for (guru_name, scan_name), error in errors.items():
+        print(f"  {guru_name} - {scan_name}: ERROR: {error}")
+
+    with pd.option_context('display.max_rows', None, 'display.width', 200, 'display.float_format', '{:.2f}'.format):
+        print(stats.drop(columns='guru').to_string(index=False))
+    if args.output:
+        stats.to_csv(args.output, index=False)
+        print(f"Wrote {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,8 @@
+"""
+Benchmark suite for the EOD scanner
+Times indicator, scan and page generation code on seeded synthetic markets
+of configurable size. Run from the scanner directory:
+
+    python -m benchmarks run --tickers 100 1000 5000 --days 252
+    python -m benchmarks compare
+"""
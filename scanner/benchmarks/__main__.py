@@ -0,0 +1,87 @@
+"""
+Command line entry point: python -m benchmarks {run,compare}
+"""
+import argparse
+import os
+import sys
+import tempfile
+from pathlib import Path
+
+# Scanner modules use flat imports, so make the scanner directory importable
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+os.environ.setdefault("POLYGON_API_KEY", "benchmark")
+
+from benchmarks.cases import benchmark_cases, build_market  # noqa: E402
+from benchmarks.harness import compare, environment, load_results, measure, new_run_id, write_results  # noqa: E402
+
+DEFAULT_OUTPUT = Path(__file__).resolve().parent / "results.jsonl"
+
+# Sizes covered by --full
+FULL_TICKERS = [100, 1000, 5000, 20000]
+FULL_DAYS = [252, 1260, 2520]
+
+
+def run(args):
+    tickers = FULL_TICKERS if args.full else args.tickers
+    days = FULL_DAYS if args.full else args.days
+    run_id = new_run_id()
+    env = environment()
+    print(f"Benchmark run {run_id} at commit {env['commit'] or 'unknown'}")
+
+    records = []
+    for n_days in days:
+        for n_tickers in tickers:
+            print(f"\n{n_tickers} tickers x {n_days} days")
+            market = build_market(n_tickers, n_days, seed=args.seed)
+
+            with tempfile.TemporaryDirectory() as output_dir:
+                for name, func, items in benchmark_cases(market, output_dir):
+                    if args.only and not any(name.startswith(prefix) for prefix in args.only):
+                        continue
+                    timing = measure(func, repeat=args.repeat)
+                    per_item_us = timing['median_s'] / items * 1e6 if items else None
+                    records.append({
+                        'run_id': run_id, **env,
+                        'name': name, 'tickers': n_tickers, 'days': n_days, 'seed': args.seed,
+                        'items': items, **timing, 'per_item_us': per_item_us,
+                    })
+                    print(f"  {name:<60} {timing['median_s'] * 1000:10.2f} ms")
+
+    write_results(records, Path(args.output))
+    print(f"\nWrote {len(records)} results to {args.output}")
+
+
+def compare_runs(args):
+    table = compare(load_results(Path(args.output)), args.before, args.after)
+    for row in table.itertuples(index=False):
+        print(f"{row.name:<60} {row.tickers:>6} x {row.days:<5} "
+              f"{row.before_s * 1000:10.2f} ms -> {row.after_s * 1000:10.2f} ms  {row.speedup:6.2f}x")
+
+
+def main():
+    parser = argparse.ArgumentParser(prog="python -m benchmarks", description="EOD scanner benchmarks")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = commands.add_parser("run", help="run benchmarks and append results")
+    run_parser.add_argument("--tickers", type=int, nargs="+", default=[100, 1000, 5000])
+    run_parser.add_argument("--days", type=int, nargs="+", default=[252])
+    run_parser.add_argument("--full", action="store_true",
+                            help=f"all sizes: {FULL_TICKERS} tickers x {FULL_DAYS} days")
+    run_parser.add_argument("--repeat", type=int, default=3)
+    run_parser.add_argument("--seed", type=int, default=0)
+    run_parser.add_argument("--only", nargs="+", help="only run benchmarks whose names start with these")
+    run_parser.add_argument("--output", default=str(DEFAULT_OUTPUT))
+    run_parser.set_defaults(func=run)
+
+    compare_parser = commands.add_parser("compare", help="compare two runs (default: the last two)")
+    compare_parser.add_argument("--before", help="run id")
+    compare_parser.add_argument("--after", help="run id")
+    compare_parser.add_argument("--output", default=str(DEFAULT_OUTPUT))
+    compare_parser.set_defaults(func=compare_runs)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,98 @@
+"""
+Benchmark cases on a synthetic market of a given size
+"""
+import contextlib
+import io
+from datetime import datetime
+from typing import Callable, Dict, List, Tuple
+import pandas as pd
+
+from backtest import ScanReplay
+from generate_site import SiteGenerator
+from indicators import latest_indicator_rows
+from panel import ticker_history
+from relative_strength import relative_strength
+from strategies.scans import ScanEngine, get_all_scans, prepare_derived_columns
+from synthetic import synthetic_panel, synthetic_universe
+
+# Tickers run one by one through calculate_technical_indicators
+SINGLE_TICKER_SAMPLE = 20
+
+# (name, function, items processed per call)
+Case = Tuple[str, Callable, int]
+
+
+def quiet(func: Callable) -> Callable:
+    """Wrap func to discard its progress prints"""
+    def run(*args, **kwargs):
+        with contextlib.redirect_stdout(io.StringIO()):
+            return func(*args, **kwargs)
+    return run
+
+
+def build_market(n_tickers: int, n_days: int, seed: int = 0) -> Dict:
+    """Synthetic panel and the scan dataset built from it"""
+    panel = synthetic_panel(n_tickers, n_days, seed=seed)
+    dataset = latest_indicator_rows(panel, min_bars=50, tail_only=True)
+    names = synthetic_universe(panel['close'].columns.tolist(), seed=seed).set_index('ticker')['name']
+    dataset['name'] = dataset['ticker'].map(names)
+    return {'panel': panel, 'dataset': dataset}
+
+
+def benchmark_cases(market: Dict, output_dir: str) -> List[Case]:
+    panel = market['panel']
+    dataset = market['dataset']
+    n_tickers = len(panel['close'].columns)
+
+    generator = SiteGenerator(output_dir=output_dir)
+    fetcher = generator.fetcher
+    sample = [ticker_history(panel, ticker) for ticker in dataset['ticker'][:SINGLE_TICKER_SAMPLE]]
+
+    derived = prepare_derived_columns(dataset)
+    scans = [
+        (guru_name, scan_name, scan_config)
+        for guru_name, guru_info in get_all_scans().items()
+        for scan_name, scan_config in guru_info['scans'].items()
+    ]
+
+    def run_scan(config, engine=None):
+        # A fresh engine per call, so cached masks do not carry over between repeats
+        engine = engine or ScanEngine(derived)
+        return engine.run_scan(config['query'], config['order_by'], config['limit'])
+
+    def run_all_scans():
+        engine = ScanEngine(derived)
+        return [run_scan(config, engine) for _, _, config in scans]
+
+    cases = [
+        ('calculate_technical_indicators',
+         lambda: [fetcher.calculate_technical_indicators(hist) for hist in sample], len(sample)),
+        ('latest_indicator_rows.full', lambda: latest_indicator_rows(panel), n_tickers),
+        ('latest_indicator_rows.tail', lambda: latest_indicator_rows(panel, tail_only=True), n_tickers),
+        ('prepare_derived_columns', lambda: prepare_derived_columns(dataset), len(dataset)),
+        ('relative_strength', lambda: relative_strength(panel), n_tickers),
+        ('run_scan.all', run_all_scans, len(scans)),
+        ('replay_scans', lambda: ScanReplay(panel).run(get_all_scans()), len(panel['close'])),
+    ]
+    for guru_name, scan_name, config in scans:
+        slug = generator.get_scan_filename(guru_name, scan_name)[:-len('.html')]
+        cases.append((f'run_scan.{slug}', lambda config=config: run_scan(config), len(derived)))
+
+    # Pages for today's results, with charts sliced from the panel
+    scan_results = quiet(generator.run_all_scans)(dataset)
+    tickers = sorted({
+        ticker
+        for guru_data in scan_results.values()
+        for scan_data in guru_data['scans'].values()
+        for ticker in scan_data['data'].get('ticker', pd.Series(dtype=str))
+    })
+    fetcher.scan_panel = panel
+    chart_data = quiet(generator.fetch_chart_data)(tickers)
+    scan_date = datetime.now().strftime('%Y-%m-%d')
+    rows = sum(scan_data['count'] for guru_data in scan_results.values() for scan_data in guru_data['scans'].values())
+    cases.append((
+        'generate_scan_pages',
+        quiet(lambda: generator.generate_scan_pages(scan_results, chart_data, scan_date)),
+        rows,
+    ))
+    return cases
@@ -0,0 +1,89 @@
+"""
+Timing harness and result files for the benchmark suite
+Results are appended as JSON lines, one record per benchmark and size,
+so runs from different commits can be compared
+"""
+import json
+import os
+import platform
+import statistics
+import subprocess
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Callable, Dict, List, Optional
+import numpy as np
+import pandas as pd
+
+
+def measure(func: Callable, repeat: int = 3, warmup: int = 1) -> Dict[str, float]:
+    """Wall time of func() over `repeat` runs after `warmup` untimed runs"""
+    for _ in range(warmup):
+        func()
+
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+
+    return {
+        'min_s': min(times),
+        'median_s': statistics.median(times),
+        'mean_s': statistics.fmean(times),
+        'repeat': repeat,
+    }
+
+
+def environment() -> Dict[str, str]:
+    """Where and on what code a run happened"""
+    try:
+        commit = subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except Exception:
+        commit = ''
+
+    return {
+        'commit': commit,
+        'python': platform.python_version(),
+        'pandas': pd.__version__,
+        'numpy': np.__version__,
+        'machine': platform.machine(),
+        'cpus': os.cpu_count(),
+    }
+
+
+def new_run_id() -> str:
+    return datetime.now(timezone.utc).strftime('%Y%m%dT%H%M%SZ')
+
+
+def write_results(records: List[Dict], path: Path):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with open(path, 'a') as f:
+        for record in records:
+            f.write(json.dumps(record) + "\n")
+
+
+def load_results(path: Path) -> pd.DataFrame:
+    with open(path, 'r') as f:
+        return pd.DataFrame([json.loads(line) for line in f if line.strip()])
+
+
+def compare(results: pd.DataFrame, before: Optional[str] = None, after: Optional[str] = None) -> pd.DataFrame:
+    """
+    Median times of two runs side by side (default: the last two run ids)
+    speedup > 1 means `after` is faster
+    """
+    runs = list(dict.fromkeys(results['run_id']))
+    if len(runs) < 2 and (before is None or after is None):
+        raise ValueError("Need at least two runs to compare")
+    before = before or runs[-2]
+    after = after or runs[-1]
+
+    keys = ['name', 'tickers', 'days']
+    old = results[results['run_id'] == before].set_index(keys)['median_s']
+    new = results[results['run_id'] == after].set_index(keys)['median_s']
+    table = pd.DataFrame({'before_s': old, 'after_s': new}).dropna()
+    table['speedup'] = table['before_s'] / table['after_s']
+    return table.reset_index()
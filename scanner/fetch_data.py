@@ -1,27 +1,106 @@
 """
 Polygon.io data fetcher for EOD market scanner
 """
-import os
+import contextvars
 import json
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime, timedelta
-from typing import Dict, List, Optional
+from itertools import takewhile
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+from urllib.parse import urlparse
 import pandas as pd
 import numpy as np
 from polygon import RESTClient
+from polygon.rest.models import Ticker
+from urllib3.util import Retry
 from pathlib import Path
 
+from history_store import HistoryStore
+from indicator_state import IndicatorStateStore
+from indicators import MAX_HISTORY_DAYS, compute_indicators, history_days, latest_indicator_rows, required_indicators
+from memory import compact_dataset, memory_report
+from panel import FIELDS, bars_to_panel, histories_to_panel, panel_tickers, select_tickers, tail_bars, ticker_history
+from rate_limit import PLAN_PROFILES, RateController, api_stage
+from relative_strength import GROUP_FIELDS, RS_LOOKBACK, relative_strength, sic_sector
+from run_report import RunReport
+from universe_store import UniverseStore, to_universe_frame
+
+# HTTP statuses the client retries on its own (the client's list without 429)
+SERVER_ERROR_STATUSES = [413, 499, 500, 502, 503, 504]
+
+# Split points for listing the ticker universe as concurrent ticker ranges
+UNIVERSE_SPLITS = ['C', 'F', 'J', 'M', 'P', 'S', 'V']
+
 
 class PolygonDataFetcher:
     """Fetches and processes market data from Polygon.io"""
 
-    def __init__(self, api_key: Optional[str] = None):
+    def __init__(self, api_key: Optional[str] = None, max_workers: Optional[int] = None,
+                 use_store: Optional[bool] = None, plan: Optional[str] = None,
+                 indicator_mode: Optional[str] = None):
         self.api_key = api_key or os.getenv("POLYGON_API_KEY")
         if not self.api_key:
             raise ValueError("POLYGON_API_KEY environment variable or api_key parameter required")
 
-        self.client = RESTClient(self.api_key)
+        # Plan profile sets the request rate, default concurrency and universe size
+        self.plan = plan or os.getenv("POLYGON_PLAN", "paid")
+        if self.plan not in PLAN_PROFILES:
+            raise ValueError(f"Unknown Polygon plan: {self.plan} (expected one of {', '.join(PLAN_PROFILES)})")
+        profile = PLAN_PROFILES[self.plan]
+        self.max_tickers = profile['max_tickers']
+
+        # Number of requests kept in flight at once (1 = sequential)
+        self.max_workers = max(1, int(max_workers or os.getenv("POLYGON_MAX_WORKERS", profile['max_workers'])))
+        self.rate = RateController(self.plan, max_workers=self.max_workers)
+        # Per-stage timings, memory and API calls of the current run
+        self.report = RunReport(self.rate)
+
+        # POLYGON_BASE_URL points the client at another server, e.g. mock_polygon.py
+        self.client = RESTClient(self.api_key, base=os.getenv("POLYGON_BASE_URL", "https://api.polygon.io"))
+        # urllib3 keeps a single connection per host by default, so size the
+        # pool to the worker count to reuse connections across threads
+        self.client.client.connection_pool_kw['maxsize'] = self.max_workers
+        # The client retries 429s itself, outside the token bucket and the
+        # adaptive concurrency limit; leave throttling to self.rate and keep
+        # its retries for server errors only
+        self.client.client.connection_pool_kw['retries'] = Retry(
+            total=self.client.retries, status_forcelist=SERVER_ERROR_STATUSES, backoff_factor=0.1,
+        )
         self.cache_dir = Path("cache")
         self.cache_dir.mkdir(exist_ok=True)
+        self.universe_store = UniverseStore(self.cache_dir / "ticker_universe.parquet")
+        self.universe_refresh: Optional[threading.Thread] = None
+
+        # Price panel of the last scan dataset, reused for chart data
+        self.scan_panel: Optional[Dict[str, pd.DataFrame]] = None
+
+        # Local bar history so runs only fetch bars added since the last run
+        if use_store is None:
+            use_store = os.getenv("POLYGON_HISTORY_STORE", "1") != "0"
+        self.store = HistoryStore(self.cache_dir / "history") if use_store else None
+
+        # How latest indicator values are computed for the scan dataset:
+        #   full        - full time series on the panel, keep the last row
+        #   tail        - reduce each indicator's window at the last bar only
+        #   incremental - fold new bars into state carried between runs
+        self.indicator_mode = indicator_mode or os.getenv("INDICATOR_MODE", "full")
+        if self.indicator_mode not in ("full", "tail", "incremental"):
+            raise ValueError(f"Unknown indicator mode: {self.indicator_mode}")
+        self.indicator_state = (
+            IndicatorStateStore(self.cache_dir / "indicator_state.npz")
+            if self.indicator_mode == "incremental" else None
+        )
+
+        # Processes sharing the full/tail indicator computation (1 = in process)
+        self.indicator_workers = max(1, int(os.getenv("INDICATOR_WORKERS", 1)))
+
+        # Relative strength: the RS line's benchmark, and sector/industry
+        # labels from ticker details, fetched for at most this many new tickers a run
+        self.rs_benchmark = os.getenv("RS_BENCHMARK", "SPY")
+        self.details_per_run = int(os.getenv("TICKER_DETAILS_PER_RUN", profile['details_per_run']))
+        self.groups_path = self.cache_dir / "ticker_groups.parquet"
 
     def get_trading_days(self, days_back: int = 100) -> List[str]:
         """Get list of recent trading days"""
@@ -39,47 +118,139 @@ class PolygonDataFetcher:
 
         return trading_days[-days_back:]
 
-    def fetch_ticker_universe(self, market: str = "stocks", use_cache: bool = True) -> pd.DataFrame:
+    @staticmethod
+    def _ticker_record(ticker) -> dict:
+        active = getattr(ticker, 'active', None)
+        return {
+            'ticker': ticker.ticker,
+            'name': ticker.name,
+            'market': getattr(ticker, 'market', 'stocks'),
+            'locale': getattr(ticker, 'locale', 'us'),
+            'type': getattr(ticker, 'type', ''),
+            'primary_exchange': getattr(ticker, 'primary_exchange', None),
+            'active': True if active is None else active,
+            'last_updated_utc': getattr(ticker, 'last_updated_utc', None),
+        }
+
+    def _iter_tickers(self, **kwargs) -> Iterator[Ticker]:
         """
-        Fetch all available tickers
-        Cache for 7 days to minimize API calls
+        list_tickers results, requesting one page at a time through the rate
+        controller so every page takes a token and a throttled page is
+        retried alone (raises on API errors)
         """
-        cache_file = self.cache_dir / "ticker_universe.json"
-
-        if use_cache and cache_file.exists():
-            # Check if cache is less than 7 days old
-            mtime = datetime.fromtimestamp(cache_file.stat().st_mtime)
-            if datetime.now() - mtime < timedelta(days=7):
-                with open(cache_file, 'r') as f:
-                    data = json.load(f)
-                return pd.DataFrame(data)
-
-        # Fetch from Polygon
-        print("Fetching ticker universe from Polygon.io...")
-        tickers = []
-
-        for ticker in self.client.list_tickers(
+        page = self.rate.call(lambda: self.client.list_tickers(raw=True, **kwargs))
+        while True:
+            body = json.loads(page.data)
+            for result in body.get('results', []):
+                yield Ticker.from_dict(result)
+            next_url = body.get('next_url')
+            if not next_url:
+                return
+            page = self.rate.call(self._get_next_page, next_url)
+
+    def _get_next_page(self, next_url: str):
+        """
+        Raw response for a listing's next_url (raises on API errors)
+        The client only follows next_url inside its own paginator, which
+        fetches every page within one rate-limited call, so this is the one
+        place that uses its private _get, the same way that paginator does.
+        """
+        parsed = urlparse(next_url)
+        path = parsed.path + (f"?{parsed.query}" if parsed.query else "")
+        return self.client._get(path=path, params={}, raw=True)
+
+    def _list_ticker_range(self, market: str, bounds: Tuple[Optional[str], Optional[str]]) -> list:
+        """List active tickers in [lower, upper) (raises on API errors)"""
+        lower, upper = bounds
+        listing = self._iter_tickers(market=market, active=True, ticker_gte=lower, ticker_lt=upper, limit=1000)
+        return [self._ticker_record(ticker) for ticker in listing]
+
+    def _fetch_universe_full(self, market: str) -> pd.DataFrame:
+        """List every active ticker, fetching ticker ranges concurrently"""
+        bounds = list(zip([None] + UNIVERSE_SPLITS, UNIVERSE_SPLITS + [None]))
+        records = [None] * len(bounds)
+        for idx, _, listing, error in self._iter_concurrent(
+            lambda b: self._list_ticker_range(market, b), bounds
+        ):
+            if error is not None:
+                raise error
+            records[idx] = listing
+        return to_universe_frame([record for listing in records for record in listing])
+
+    def _list_changed_tickers(self, market: str, active: bool, since: pd.Timestamp) -> list:
+        """Tickers updated at or after `since`, newest first (raises on API errors)"""
+        def changed(ticker):
+            updated = pd.to_datetime(getattr(ticker, 'last_updated_utc', None), utc=True, errors='coerce')
+            return pd.notna(updated) and updated >= since
+
+        # Stops paging at the first ticker older than the watermark
+        listing = takewhile(changed, self._iter_tickers(
             market=market,
-            active=True,
+            active=active,
+            sort='last_updated_utc',
+            order='desc',
             limit=1000
+        ))
+        return [self._ticker_record(ticker) for ticker in listing]
+
+    def _fetch_universe_changes(self, market: str, since: pd.Timestamp) -> pd.DataFrame:
+        """Tickers listed, changed or delisted since the watermark"""
+        records = []
+        for _, active, listing, error in self._iter_concurrent(
+            lambda active: self._list_changed_tickers(market, active, since), [True, False]
         ):
-            tickers.append({
-                'ticker': ticker.ticker,
-                'name': ticker.name,
-                'market': getattr(ticker, 'market', 'stocks'),
-                'locale': getattr(ticker, 'locale', 'us'),
-                'type': getattr(ticker, 'type', ''),
-                'active': True
-            })
+            if error is not None:
+                raise error
+            records.extend(listing)
+        return to_universe_frame(records)
+
+    def _refresh_universe(self, market: str, cached: Optional[pd.DataFrame]) -> pd.DataFrame:
+        """Bring the universe cache up to date and return the new universe"""
+        since = self.universe_store.watermark(cached) if cached is not None else None
+        age = self.universe_store.age()
+
+        if since is None or age is None or age > self.universe_store.full_refresh_after:
+            universe = self._fetch_universe_full(market)
+            print(f"Found {len(universe)} active tickers")
+        else:
+            changes = self._fetch_universe_changes(market, since)
+            universe = self.universe_store.merge(cached, changes)
+            print(f"Universe refresh: {len(changes)} tickers changed, {len(universe)} active")
+
+        self.universe_store.save(universe)
+        return universe
+
+    def _refresh_universe_in_background(self, market: str, cached: pd.DataFrame):
+        def refresh():
+            # Counted apart from whatever stage the main thread is in meanwhile
+            api_stage.set("universe_refresh")
+            try:
+                self._refresh_universe(market, cached)
+            except Exception as e:
+                print(f"Error refreshing ticker universe: {e}")
 
-        df = pd.DataFrame(tickers)
+        if self.universe_refresh is None or not self.universe_refresh.is_alive():
+            # Not a daemon thread, so the refreshed cache is written before exit
+            self.universe_refresh = threading.Thread(target=refresh, name="universe-refresh")
+            self.universe_refresh.start()
 
-        # Cache the results
-        with open(cache_file, 'w') as f:
-            json.dump(df.to_dict(orient='records'), f)
+    def fetch_ticker_universe(self, market: str = "stocks", use_cache: bool = True) -> pd.DataFrame:
+        """
+        Fetch all available tickers
+        Served from the local Parquet cache; a cache older than a day is
+        returned as is while changed tickers are merged in on a background
+        thread for the next run
+        """
+        cached = self.universe_store.load() if use_cache else None
 
-        print(f"Found {len(df)} active tickers")
-        return df
+        if cached is not None:
+            if self.universe_store.age() > self.universe_store.refresh_after:
+                self._refresh_universe_in_background(market, cached)
+            return cached
+
+        # Fetch from Polygon
+        print("Fetching ticker universe from Polygon.io...")
+        return self._refresh_universe(market, None)
 
     def fetch_snapshot_all_tickers(self) -> pd.DataFrame:
         """
@@ -90,7 +261,7 @@ class PolygonDataFetcher:
 
         try:
             # Get all tickers snapshot
-            snapshots = self.client.get_snapshot_all("stocks")
+            snapshots = self.rate.call(self.client.get_snapshot_all, "stocks")
 
             data = []
             for snapshot in snapshots:
@@ -107,6 +278,8 @@ class PolygonDataFetcher:
                         'low': getattr(day_bar, 'l', getattr(day_bar, 'low', None)) if day_bar else None,
                         'volume': getattr(day_bar, 'v', getattr(day_bar, 'volume', None)) if day_bar else None,
                         'prev_close': getattr(prev_day_bar, 'c', getattr(prev_day_bar, 'close', None)) if prev_day_bar else None,
+                        'prev_volume': getattr(prev_day_bar, 'v', getattr(prev_day_bar, 'volume', None)) if prev_day_bar else None,
+                        'updated': getattr(snapshot, 'updated', None),
                     }
                     data.append(ticker_data)
                 except Exception as e:
@@ -114,6 +287,10 @@ class PolygonDataFetcher:
                     continue
 
             df = pd.DataFrame(data)
+            if not df.empty:
+                # Trading date of the day bar, from the last update in exchange time
+                updated = pd.to_datetime(df.pop('updated'), unit='ns', utc=True)
+                df['date'] = updated.dt.tz_convert('America/New_York').dt.normalize().dt.tz_localize(None)
             print(f"Fetched snapshots for {len(df)} tickers")
             return df
 
@@ -123,35 +300,100 @@ class PolygonDataFetcher:
             traceback.print_exc()
             return pd.DataFrame()
 
+    def select_liquid_tickers(self, tickers: List[str], limit: int, min_price: float = 1.0,
+                              min_dollar_volume: float = 100_000,
+                              snapshot: Optional[pd.DataFrame] = None) -> List[str]:
+        """
+        Pick the `limit` most liquid tickers using one market-wide snapshot
+
+        Tickers are ranked by dollar volume (close x volume, falling back to
+        the previous day's bar before the open) after dropping those below
+        min_price or min_dollar_volume. Falls back to the given order when
+        no snapshot is available (e.g. on plans without snapshot access).
+        Pass `snapshot` to reuse one already fetched.
+        """
+        if snapshot is None:
+            snapshot = self.fetch_snapshot_all_tickers()
+        if snapshot.empty or 'close' not in snapshot.columns:
+            print("No snapshot available, selecting tickers in universe order")
+            return list(tickers[:limit])
+
+        snapshot = snapshot.drop_duplicates('ticker').set_index('ticker')
+        snapshot = snapshot.reindex(pd.Index(tickers).unique())
+        close = snapshot['close'].where(snapshot['close'] > 0, snapshot['prev_close'])
+        volume = snapshot['volume'].where(snapshot['volume'] > 0, snapshot['prev_volume'])
+        dollar_volume = (close * volume).astype('float64')
+
+        liquid = dollar_volume[(close >= min_price) & (dollar_volume >= min_dollar_volume)]
+        selected = liquid.sort_values(ascending=False, kind='stable').head(limit)
+        print(f"Selected {len(selected)} of {len(tickers)} tickers by dollar volume "
+              f"({len(liquid)} passed price >= ${min_price:g} and dollar volume >= ${min_dollar_volume:,.0f})")
+        return selected.index.tolist()
+
+    def _request_aggregates(self, ticker: str, start_date, end_date) -> pd.DataFrame:
+        """Fetch daily bars for a ticker between two dates (raises on API errors)"""
+        aggs = self.rate.call(
+            self.client.get_aggs,
+            ticker=ticker,
+            multiplier=1,
+            timespan="day",
+            from_=start_date.strftime("%Y-%m-%d"),
+            to=end_date.strftime("%Y-%m-%d"),
+            limit=50000
+        )
+
+        data = []
+        for agg in aggs:
+            data.append({
+                # Daily bars are stamped at midnight ET; keep the calendar date
+                'date': pd.to_datetime(agg.timestamp, unit='ms').normalize(),
+                'open': agg.open,
+                'high': agg.high,
+                'low': agg.low,
+                'close': agg.close,
+                'volume': agg.volume,
+            })
+
+        return pd.DataFrame(data)
+
+    def _fetch_with_store(self, ticker: str, start_date, end_date) -> pd.DataFrame:
+        """
+        Read a ticker's history from the local store, fetching only the
+        bars after the last stored date. Falls back to a full fetch when
+        the store does not cover start_date or the history was restated.
+        """
+        cached = self.store.history(ticker, since=start_date)
+
+        if cached is not None:
+            last_date = cached['date'].iloc[-1].date()
+            latest_weekday = end_date - timedelta(days=max(0, end_date.weekday() - 4))
+            if last_date >= latest_weekday:
+                return cached
+
+            # Overlap the last stored bar so restatements can be detected
+            new_bars = self._request_aggregates(ticker, last_date, end_date)
+            if self.store.extend(ticker, new_bars):
+                return self.store.history(ticker, since=start_date)
+
+        df = self._request_aggregates(ticker, start_date, end_date)
+        if not df.empty:
+            self.store.put(ticker, df, covered_from=start_date)
+        return df
+
     def fetch_aggregates(self, ticker: str, days: int = 90) -> pd.DataFrame:
         """
         Fetch historical OHLCV data for a single ticker
+        Reads from the local history store first when it is enabled
         """
         end_date = datetime.now().date()
         start_date = end_date - timedelta(days=days * 1.5)  # Buffer for weekends
 
         try:
-            aggs = self.client.get_aggs(
-                ticker=ticker,
-                multiplier=1,
-                timespan="day",
-                from_=start_date.strftime("%Y-%m-%d"),
-                to=end_date.strftime("%Y-%m-%d"),
-                limit=50000
-            )
-
-            data = []
-            for agg in aggs:
-                data.append({
-                    'date': pd.to_datetime(agg.timestamp, unit='ms'),
-                    'open': agg.open,
-                    'high': agg.high,
-                    'low': agg.low,
-                    'close': agg.close,
-                    'volume': agg.volume,
-                })
+            if self.store is not None:
+                df = self._fetch_with_store(ticker, start_date, end_date)
+            else:
+                df = self._request_aggregates(ticker, start_date, end_date)
 
-            df = pd.DataFrame(data)
             if not df.empty:
                 df = df.sort_values('date').tail(days)
             return df
@@ -160,16 +402,145 @@ class PolygonDataFetcher:
             print(f"Error fetching aggregates for {ticker}: {e}")
             return pd.DataFrame()
 
+    def join_snapshot(self, snapshot: pd.DataFrame, tickers: List[str], days: int = 252,
+                      rtol: float = 1e-6) -> Tuple[Dict[str, pd.DataFrame], List[str]]:
+        """
+        Append each ticker's snapshot day bar to its stored history
+
+        A bar is only joined when the stored history ends right before it,
+        checked by its last close matching the snapshot's previous close.
+        Joined bars are saved to the store.
+
+        Returns (histories, missing), where missing lists the tickers that
+        need a regular fetch: absent from the snapshot or store, or with a
+        stored history that is behind or restated.
+        """
+        end_date = datetime.now().date()
+        start_date = end_date - timedelta(days=days * 1.5)  # Buffer for weekends
+
+        if snapshot.empty or 'date' not in snapshot.columns:
+            return {}, list(tickers)
+        snapshot = snapshot[snapshot['close'] > 0].drop_duplicates('ticker').set_index('ticker')
+
+        histories = {}
+        missing = []
+        for ticker in tickers:
+            cached = self.store.history(ticker, since=start_date) if ticker in snapshot.index else None
+            if cached is None:
+                missing.append(ticker)
+                continue
+
+            snap = snapshot.loc[ticker]
+            last = cached.iloc[-1]
+            if last['date'] < snap['date']:
+                if not abs(last['close'] - snap['prev_close']) <= rtol * abs(last['close']):
+                    missing.append(ticker)
+                    continue
+                bar = pd.DataFrame([{'date': snap['date'], **{field: snap[field] for field in FIELDS}}])
+                self.store.extend(ticker, bar)
+                cached = self.store.history(ticker, since=start_date)
+
+            histories[ticker] = cached.tail(days).reset_index(drop=True)
+
+        return histories, missing
+
+    def chart_history(self, ticker: str, days: int = 90) -> pd.DataFrame:
+        """
+        Last `days` bars for a chart, sliced from the scan panel when the
+        ticker was part of the last scan dataset and the panel covers
+        `days` dates, otherwise fetched
+        """
+        panel = self.scan_panel
+        if panel is not None and ticker in panel['close'].columns and len(panel['close']) >= days:
+            return ticker_history(self.scan_panel, ticker, days)
+        return self.fetch_aggregates(ticker, days=days)
+
+    def _request_grouped_daily(self, date: str) -> pd.DataFrame:
+        """Fetch one date's bars for every ticker (raises on API errors)"""
+        aggs = self.rate.call(self.client.get_grouped_daily_aggs, date)
+
+        data = []
+        for agg in aggs:
+            data.append({
+                'ticker': agg.ticker,
+                'open': agg.open,
+                'high': agg.high,
+                'low': agg.low,
+                'close': agg.close,
+                'volume': agg.volume,
+            })
+
+        df = pd.DataFrame(data)
+        if not df.empty:
+            df.insert(0, 'date', pd.Timestamp(date))
+        return df
+
+    def fetch_grouped_daily(self, date: str) -> pd.DataFrame:
+        """
+        Fetch one day's OHLCV bar for every ticker in a single call
+        Returns an empty DataFrame for non-trading days
+        """
+        try:
+            return self._request_grouped_daily(date)
+        except Exception as e:
+            print(f"Error fetching grouped daily bars for {date}: {e}")
+            return pd.DataFrame()
+
+    def build_price_panel(self, days: int = 252, max_workers: Optional[int] = None) -> Dict[str, pd.DataFrame]:
+        """
+        Build a date x ticker OHLCV panel for the whole market
+        Uses one grouped-daily call per trading date instead of one call per ticker,
+        skipping dates already in the local history store
+        """
+        # Weekday calendar includes holidays, which come back empty
+        dates = self.get_trading_days(days + days // 20 + 5)
+        today = datetime.now().date().strftime("%Y-%m-%d")
+
+        stored = self.store.market_dates() if self.store is not None else set()
+        missing = [d for d in dates if d not in stored]
+
+        print(f"Fetching grouped daily bars for {len(missing)} of {len(dates)} dates...")
+
+        frames = [None] * len(missing)
+        fetched = []
+        for idx, date, bars, error in self._iter_concurrent(self._request_grouped_daily, missing, max_workers):
+            if error is not None:
+                print(f"Error fetching grouped daily bars for {date}: {error}")
+                continue
+            frames[idx] = bars
+            # An empty past date is a holiday; an empty today may just be early
+            if not bars.empty or date < today:
+                fetched.append(date)
+
+        new_bars = [bars for bars in frames if bars is not None and not bars.empty]
+        new_bars = pd.concat(new_bars, ignore_index=True) if new_bars else pd.DataFrame()
+
+        if self.store is not None:
+            self.store.put_market_days(new_bars, fetched)
+            self.store.flush()
+            bars = self.store.bars(dates)
+        else:
+            bars = new_bars
+
+        if bars.empty:
+            return bars_to_panel(pd.DataFrame())
+
+        keep = sorted(bars['date'].unique())[-days:]
+        panel = bars_to_panel(bars[bars['date'].isin(keep)])
+        print(f"Built price panel: {len(panel['close'])} dates x {len(panel['close'].columns)} tickers")
+        return panel
+
     def fetch_ticker_details(self, ticker: str) -> Dict:
         """Fetch detailed ticker information"""
         try:
-            details = self.client.get_ticker_details(ticker)
+            details = self.rate.call(self.client.get_ticker_details, ticker)
             return {
                 'ticker': ticker,
                 'name': getattr(details, 'name', ''),
                 'market_cap': getattr(details, 'market_cap', None),
                 'shares_outstanding': getattr(details, 'share_class_shares_outstanding', None),
                 'description': getattr(details, 'description', ''),
+                'sic_code': getattr(details, 'sic_code', None),
                 'sic_description': getattr(details, 'sic_description', ''),
                 'homepage_url': getattr(details, 'homepage_url', ''),
             }
@@ -177,145 +548,291 @@ class PolygonDataFetcher:
             print(f"Error fetching details for {ticker}: {e}")
             return {'ticker': ticker}
 
-    def calculate_technical_indicators(self, df: pd.DataFrame) -> pd.DataFrame:
+    def fetch_ticker_groups(self, tickers: List[str]) -> pd.DataFrame:
         """
-        Calculate technical indicators needed for scans
-        Input: DataFrame with OHLCV data (multiple tickers with MultiIndex)
-        Output: Same DataFrame with additional indicator columns
+        Sector (SIC division) and industry (SIC description) of each ticker
+        Cached in cache/ticker_groups.parquet; tickers not cached yet are
+        fetched in the given order, at most self.details_per_run a run, so
+        a large universe fills the cache over a few runs.
         """
+        if self.groups_path.exists():
+            cached = pd.read_parquet(self.groups_path)
+        else:
+            cached = pd.DataFrame({'ticker': [], 'sector': [], 'industry': []}, dtype=object)
+
+        known = set(cached['ticker'])
+        missing = [t for t in tickers if t not in known][:self.details_per_run]
+        if missing:
+            rows = []
+            for _, ticker, details, error in self._iter_concurrent(self.fetch_ticker_details, missing):
+                # Failed requests return only the ticker; leave them for the next run
+                if error is None and 'sic_description' in details:
+                    rows.append({
+                        'ticker': ticker,
+                        'sector': sic_sector(details['sic_code']),
+                        'industry': details['sic_description'] or None,
+                    })
+            if rows:
+                cached = pd.concat([cached, pd.DataFrame(rows, dtype=object)], ignore_index=True)
+                cached.to_parquet(self.groups_path, index=False)
+            print(f"Fetched sector/industry for {len(rows)} of {len(missing)} uncached tickers")
+
+        return cached.drop_duplicates('ticker', keep='last').set_index('ticker').reindex(tickers)
+
+    def benchmark_history(self, panel: Dict[str, pd.DataFrame], days: int) -> Optional[pd.Series]:
+        """Closes of the RS benchmark by date, from the panel if it has them"""
+        if self.rs_benchmark in panel['close'].columns:
+            return panel['close'][self.rs_benchmark].dropna()
+        history = self.fetch_aggregates(self.rs_benchmark, days=days)
+        if history.empty:
+            print(f"No history for RS benchmark {self.rs_benchmark}, rs will be empty")
+            return None
+        return history.set_index(pd.to_datetime(history['date']))['close']
+
+    def _iter_concurrent(self, func: Callable, items: List, max_workers: Optional[int] = None) -> Iterator[Tuple[int, object, object, Optional[Exception]]]:
+        """
+        Call func on every item with at most max_workers calls in flight
+        Yields (index, item, result, error) as each call completes
+        """
+        max_workers = max_workers or self.max_workers
 
-        def calc_sma(series, period):
-            return series.rolling(window=period, min_periods=period).mean()
-
-        def calc_ema(series, period):
-            return series.ewm(span=period, adjust=False, min_periods=period).mean()
-
-        def calc_roc(series, period=1):
-            """Rate of Change as percentage"""
-            return ((series / series.shift(period)) - 1) * 100
-
-        def calc_adr(df, period=20):
-            """Average Daily Range as percentage"""
-            daily_range = ((df['high'] - df['low']) / df['close']) * 100
-            return daily_range.rolling(window=period, min_periods=period).mean()
-
-        def calc_trend_intensity(series, period=20):
-            """
-            Trend Intensity indicator
-            Measures consistency of trend direction
-            """
-            roi = series / series.shift(period) - 1
-            # Simplified TI: ratio of close to period average
-            sma = series.rolling(window=period, min_periods=period).mean()
-            return series / sma
-
-        # Work on copy
-        df = df.copy()
-
-        # Price-based SMAs
-        for period in [20, 50, 100, 150, 200]:
-            df[f'sma_{period}'] = calc_sma(df['close'], period)
-
-        # EMAs
-        for period in [9, 10, 21, 50, 200]:
-            df[f'ema_{period}'] = calc_ema(df['close'], period)
-
-        # Volume indicators
-        df['sma_50_volume'] = calc_sma(df['volume'], 50)
-        df['volume_ratio'] = df['volume'] / df['sma_50_volume']
-
-        # Price changes
-        df['roc'] = calc_roc(df['close'])
-        df['close_prev'] = df['close'].shift(1)
-        df['daily_change'] = (df['close'] / df['close_prev'] - 1) * 100
+        if max_workers <= 1:
+            for idx, item in enumerate(items):
+                try:
+                    yield idx, item, func(item), None
+                except Exception as e:
+                    yield idx, item, None, e
+            return
+
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            # Each call runs in a copy of the caller's context, keeping its api_stage
+            futures = {
+                executor.submit(contextvars.copy_context().run, func, item): (idx, item)
+                for idx, item in enumerate(items)
+            }
+            for future in as_completed(futures):
+                idx, item = futures[future]
+                try:
+                    yield idx, item, future.result(), None
+                except Exception as e:
+                    yield idx, item, None, e
 
-        # Range indicators
-        df['adr_20'] = calc_adr(df, 20)
-        df['trend_intensity'] = calc_trend_intensity(df['close'], 20)
+    def _fetch_histories(self, tickers: List[str], days: int, max_workers: Optional[int] = None,
+                         bars: Optional[Dict[str, int]] = None) -> Dict[str, pd.DataFrame]:
+        """
+        Fetch histories concurrently, keeping tickers with at least 50 bars
+        bars overrides days per ticker; those tickers are kept with any bars
+        """
+        histories = {}
+        failed = 0
+        bars = bars or {}
 
-        # Min/Max over periods
-        for period in [5, 21, 63, 126, 252]:
-            df[f'min_{period}'] = df['close'].rolling(window=period, min_periods=period).min()
-            df[f'max_{period}'] = df['close'].rolling(window=period, min_periods=period).max()
+        fetch = lambda ticker: self.fetch_aggregates(ticker, days=bars.get(ticker, days))
+        for done, (idx, ticker, hist, error) in enumerate(
+            self._iter_concurrent(fetch, tickers, max_workers), start=1
+        ):
+            if error is not None:
+                failed += 1
+                if failed % 50 == 0:
+                    print(f"  {failed} failures so far (latest: {ticker}: {str(error)[:50]})")
+            elif len(hist) < (1 if ticker in bars else 50):  # Need at least 50 days for indicators
+                failed += 1
+            else:
+                histories[ticker] = hist
 
-        # Dollar volume
-        df['dollar_volume'] = df['volume'] * df['close']
-        df['avg_dollar_volume_50'] = calc_sma(df['dollar_volume'], 50)
+            # Progress every 100 tickers
+            if done % 100 == 0:
+                pct = (done / len(tickers)) * 100
+                print(f"Progress: {done}/{len(tickers)} ({pct:.1f}%) - {len(histories)} valid, {failed} failed")
 
-        # Market cap (will need to join with ticker details)
-        # For now, approximate using shares outstanding if available
+        if self.store is not None:
+            self.store.flush()
+        return histories
 
-        return df
+    def _fetch_state_histories(self, tickers: List[str], days: int, min_history: int,
+                               max_workers: Optional[int] = None) -> Dict[str, pd.DataFrame]:
+        """
+        Histories for incremental indicator mode: tickers with indicator
+        state need only the bars since it, plus the min_history bars scans
+        and charts read from the panel. Tickers without state, and those
+        whose state does not match the new bars, get `days` bars.
+        """
+        since = self.indicator_state.bars_since(tickers)
+        bars = {ticker: max(min_history, count) for ticker, count in since.items()}
+        short = [ticker for ticker in tickers if bars.get(ticker, days) < days]
+        histories = self._fetch_histories(short, days, max_workers, bars=bars) if short else {}
+
+        resumable = set(self.indicator_state.resumable(histories_to_panel(histories))) if histories else set()
+        full = [ticker for ticker in tickers if ticker not in resumable]
+        print(f"Indicator state covers {len(resumable)} tickers, fetching {len(full)} with {days} days of history")
+        histories = {ticker: histories[ticker] for ticker in resumable}
+        histories.update(self._fetch_histories(full, days, max_workers))
+        return histories
+
+    def calculate_technical_indicators(self, df: pd.DataFrame, columns: Optional[Iterable[str]] = None) -> pd.DataFrame:
+        """
+        Calculate technical indicators needed for scans
+        Input: DataFrame with OHLCV data for a single ticker
+        Output: Same DataFrame with additional indicator columns
+        (all of them, or only those `columns` need)
+        """
+        indicators = compute_indicators(df, columns)
+        return pd.concat([df, pd.DataFrame(indicators, index=df.index)], axis=1)
 
-    def build_scan_dataset(self, date: Optional[str] = None) -> pd.DataFrame:
+    def build_scan_dataset(self, date: Optional[str] = None, max_workers: Optional[int] = None,
+                           source: Optional[str] = None, columns: Optional[Iterable[str]] = None,
+                           ranks: Iterable[str] = (), min_history: int = 0) -> pd.DataFrame:
         """
         Build complete dataset for scanning
-        Uses aggregates API for reliability
+
+        source="aggregates" fetches one history per ticker (up to max_workers
+        concurrently, defaults to self.max_workers) for the self.max_tickers
+        most liquid tickers, as set by the plan profile.
+        source="grouped" builds a whole-market panel from grouped daily bars
+        and scans every ticker in the universe.
+        source="snapshot" selects tickers like "aggregates", then appends
+        one market-wide snapshot's bars to the stored histories; only
+        tickers the snapshot cannot extend are fetched one by one.
+        Defaults to the SCAN_DATA_SOURCE environment variable, else "aggregates".
+
+        columns limits the indicators computed to those the scans read
+        (see strategies.scans.scan_requirements; None computes all), and
+        history is fetched only as far back as they and min_history need.
+        ranks lists the relative strength fields the scans read; they are
+        computed, with the benchmark and ticker details they need, only if
+        it is not empty.
         """
+        source = source or os.getenv("SCAN_DATA_SOURCE", "aggregates")
+        if source not in ("aggregates", "grouped", "snapshot"):
+            raise ValueError(f"Unknown dataset source: {source}")
+        if source == "snapshot" and self.store is None:
+            raise ValueError("The snapshot source needs the history store (POLYGON_HISTORY_STORE)")
+
         if date is None:
             date = datetime.now().date().strftime("%Y-%m-%d")
 
+        # Incremental state carries every indicator, so it always gets the full set
+        if self.indicator_state is not None:
+            columns = None
+        columns = list(columns) if columns is not None else None
+        ranks = set(ranks)
+        days = min(max(history_days(columns), min_history), MAX_HISTORY_DAYS)
+        # A year of returns reads one bar more than a year of indicators; that
+        # bar is fetched only for the ranks, and the indicators still see `days`
+        fetch_days = max(days, RS_LOOKBACK) if ranks else days
+
         print(f"Building scan dataset for {date}...")
+        print(f"Computing {len(required_indicators(columns))} indicators from {days} days of history")
 
         # Get ticker universe
-        universe = self.fetch_ticker_universe()
+        with self.report.stage("universe"):
+            universe = self.fetch_ticker_universe()
+
+            if not universe.empty:
+                # Filter to US stocks only and common stock types
+                universe = universe[universe['locale'] == 'us']
+                # Filter to common stocks (exclude warrants, units, ETFs, etc.)
+                if 'type' in universe.columns:
+                    universe = universe[universe['type'].isin(['CS', 'COMMON STOCK', ''])]
+
+                # Index metadata by ticker for constant-time lookups
+                universe = universe.drop_duplicates('ticker').set_index('ticker', drop=False)
 
         if universe.empty:
             print("No ticker universe available")
             return pd.DataFrame()
 
-        # Filter to US stocks only and common stock types
-        universe = universe[universe['locale'] == 'us']
-        # Filter to common stocks (exclude warrants, units, ETFs, etc.)
-        if 'type' in universe.columns:
-            universe = universe[universe['type'].isin(['CS', 'COMMON STOCK', ''])]
-
         print(f"Found {len(universe)} US common stocks")
 
-        # With paid Polygon plan: scan top 3000 most liquid stocks
-        # Sort by market cap or volume if available, otherwise just take first N
-        tickers_to_scan = universe['ticker'].head(3000).tolist()
-
-        print(f"Scanning {len(tickers_to_scan)} tickers (paid plan - unlimited API)...")
-
-        results = []
-        failed = 0
-
-        for idx, ticker in enumerate(tickers_to_scan):
-            try:
-                # Fetch 252 days (1 year) of historical data for indicators
-                hist = self.fetch_aggregates(ticker, days=252)
-
-                if len(hist) < 50:  # Need at least 50 days for indicators
-                    failed += 1
-                    continue
-
-                # Calculate indicators
-                hist = self.calculate_technical_indicators(hist)
-
-                # Get most recent row (today's data)
-                latest = hist.iloc[-1].to_dict()
-                latest['ticker'] = ticker
-
-                # Get name from universe
-                ticker_info = universe[universe['ticker'] == ticker]
-                latest['name'] = ticker_info['name'].iloc[0] if not ticker_info.empty else ticker
-
-                results.append(latest)
-
-                # Progress every 100 tickers
-                if (idx + 1) % 100 == 0:
-                    pct = ((idx + 1) / len(tickers_to_scan)) * 100
-                    print(f"Progress: {idx + 1}/{len(tickers_to_scan)} ({pct:.1f}%) - {len(results)} valid, {failed} failed")
-
-            except Exception as e:
-                failed += 1
-                if failed % 50 == 0:
-                    print(f"  {failed} failures so far (latest: {ticker}: {str(e)[:50]})")
-                continue
-
-        df = pd.DataFrame(results)
+        with self.report.stage("fetch"):
+            if source == "grouped":
+                # One call per date covers every ticker, so scan the full universe
+                panel = self.build_price_panel(days=fetch_days, max_workers=max_workers)
+                in_panel = universe.index.intersection(panel_tickers(panel), sort=False)
+                tickers_to_scan = in_panel.tolist()
+                print(f"Scanning {len(tickers_to_scan)} tickers from the price panel...")
+            elif source == "snapshot":
+                # One snapshot call gives today's bar for every ticker; join it onto
+                # the stored histories and fetch only tickers that cannot be joined
+                snapshot = self.fetch_snapshot_all_tickers()
+                tickers_to_scan = self.select_liquid_tickers(universe.index.tolist(), self.max_tickers, snapshot=snapshot)
+                histories, missing = self.join_snapshot(snapshot, tickers_to_scan, days=fetch_days)
+                workers = max_workers or self.max_workers
+                print(f"Joined snapshot bars for {len(histories)} tickers, fetching {len(missing)} with {workers} workers...")
+
+                if self.indicator_state is not None and not ranks:
+                    histories.update(self._fetch_state_histories(missing, days, min_history, workers))
+                else:
+                    histories.update(self._fetch_histories(missing, fetch_days, workers))
+                panel = histories_to_panel(histories)
+            else:
+                # Plan profile caps the universe (3000 on paid plans, 500 on free),
+                # so spend history requests on the most liquid names
+                tickers_to_scan = self.select_liquid_tickers(universe.index.tolist(), self.max_tickers)
+                workers = max_workers or self.max_workers
+                print(f"Scanning {len(tickers_to_scan)} tickers with {workers} workers...")
+
+                if self.indicator_state is not None and not ranks:
+                    histories = self._fetch_state_histories(tickers_to_scan, days, min_history, workers)
+                else:
+                    histories = self._fetch_histories(tickers_to_scan, fetch_days, workers)
+                panel = histories_to_panel(histories)
+
+        # Calculate indicators for all tickers at once, keeping each ticker's latest bar
+        with self.report.stage("indicators"):
+            market = panel
+            ranked_panel = select_tickers(panel, tickers_to_scan)
+            panel = ranked_panel
+            if fetch_days > days:
+                # Grouped panels hold the last dates, histories each ticker's last bars
+                panel = (
+                    {field: frame.iloc[-days:] for field, frame in panel.items()} if source == "grouped"
+                    else tail_bars(panel, days)
+                )
+            if self.indicator_state is not None:
+                df = self.indicator_state.latest_rows(panel, min_bars=50)
+            else:
+                df = latest_indicator_rows(
+                    panel, min_bars=50, tail_only=self.indicator_mode == "tail", workers=self.indicator_workers,
+                    columns=columns,
+                )
+            failed = len(tickers_to_scan) - len(df)
+
+        # Rank every ticker against the scanned universe
+        if ranks:
+            with self.report.stage("relative_strength"):
+                benchmark = self.benchmark_history(market, fetch_days) if 'rs' in ranks else None
+                groups = self.fetch_ticker_groups(tickers_to_scan) if ranks & set(GROUP_FIELDS) else None
+                ranked = relative_strength(ranked_panel, benchmark, groups)
+                # Back onto the indicators' bars
+                valid = panel['close'].notna()
+                ranked = {name: frame.reindex(valid.index).where(valid) for name, frame in ranked.items()}
+                panel = {**panel, **ranked}
+                if not df.empty:
+                    for name, frame in ranked.items():
+                        # Value at each ticker's latest bar, like the indicators
+                        df[name] = df['ticker'].map(frame.ffill().iloc[-1])
+        self.scan_panel = panel
+
+        if not df.empty:
+            # Get names from universe
+            df['name'] = df['ticker'].map(universe['name']).fillna(df['ticker'])
+            df = compact_dataset(df)
+
+        self.report.info.update({
+            'source': source, 'plan': self.plan, 'indicator_mode': self.indicator_mode,
+            'history_days': days, 'indicators': len(required_indicators(columns)),
+            'tickers_requested': len(tickers_to_scan), 'tickers_scanned': len(df),
+        })
         print(f"Built dataset with {len(df)} tickers ({failed} failed)")
+        print(f"API calls: {self.rate.calls} ({self.rate.throttled} throttled, {self.plan} plan)")
+        print(memory_report(
+            len(df),
+            dataset=df,
+            panel=panel,
+            history_store=self.store.nbytes() if self.store is not None else 0,
+            universe=universe,
+        ))
 
         return df
 
@@ -2,6 +2,8 @@
 Static site generator for EOD market scanner
 """
 import json
+import os
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from pathlib import Path
 from typing import Dict, List
@@ -9,7 +11,16 @@ import pandas as pd
 from jinja2 import Environment, FileSystemLoader
 
 from fetch_data import PolygonDataFetcher
-from strategies.scans import get_all_scans, ScanEngine, prepare_derived_columns
+from result_store import ResultStore
+from strategies.scans import get_scan_set, scan_requirements, ScanEngine, prepare_derived_columns
+from strategies.sql_backend import SQLScanBackend
+
+
+# Dataset columns shown on every scan page, whichever scans run
+PAGE_COLUMNS = ['daily_change', 'roc', 'volume_ratio']
+
+# Bars of price history behind each chart
+CHART_DAYS = 90
 
 
 class SiteGenerator:
@@ -25,6 +36,11 @@ class SiteGenerator:
         self.env = Environment(loader=FileSystemLoader(str(template_dir)))
 
         self.fetcher = PolygonDataFetcher()
+        self.report = self.fetcher.report
+        # Each trading day's hits, compared with the previous day's
+        self.result_store = ResultStore(self.fetcher.cache_dir / "results")
+        # Threads running scans concurrently in run_all_scans (1 = in sequence)
+        self.scan_workers = max(1, int(os.getenv("SCAN_WORKERS", min(8, os.cpu_count() or 1))))
 
     def run_all_scans(self, market_data: pd.DataFrame) -> Dict:
         """
@@ -37,51 +53,134 @@ class SiteGenerator:
 
         # Prepare data
         market_data = prepare_derived_columns(market_data)
-        engine = ScanEngine(market_data)
+        engine = ScanEngine(market_data, panel=self.fetcher.scan_panel)
+
+        # SCAN_SET=eod runs the string queries of src/scans.py instead
+        all_scans = get_scan_set(os.getenv("SCAN_SET", "guru"))
+        selections = self.select_with_sql(market_data, all_scans)
+        jobs = [
+            (guru_name, scan_name, scan_config)
+            for guru_name, guru_info in all_scans.items()
+            for scan_name, scan_config in guru_info['scans'].items()
+        ]
+
+        # Scans only read the dataset and the engine's shared caches, so they
+        # run side by side; map returns entries in catalog order
+        run = lambda job: self.run_scan(engine, market_data, selections, *job)
+        workers = min(self.scan_workers, len(jobs))
+        if workers > 1:
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                entries = list(executor.map(run, jobs))
+        else:
+            entries = [run(job) for job in jobs]
 
-        all_scans = get_all_scans()
         results = {}
+        for (guru_name, scan_name, _), entry in zip(jobs, entries):
+            if guru_name not in results:
+                print(f"\n{guru_name}")
+                results[guru_name] = {
+                    'link': all_scans[guru_name]['link'],
+                    'scans': {}
+                }
+            results[guru_name]['scans'][scan_name] = entry
+            if 'error' in entry:
+                print(f"  Running: {scan_name}... ERROR: {entry['error']}")
+            else:
+                print(f"  Running: {scan_name}... {entry['count']} results")
+
+        print(f"\nEvaluated {engine.masks.evaluated} distinct predicate terms, reused {engine.masks.reused}")
+        if engine.panel is not None and engine.panel.values:
+            print(f"Evaluated {len(engine.panel.values)} distinct query expressions over the price panel")
+        return results
 
-        for guru_name, guru_info in all_scans.items():
-            print(f"\n{guru_name}")
-            results[guru_name] = {
-                'link': guru_info['link'],
-                'scans': {}
-            }
-
-            for scan_name, scan_config in guru_info['scans'].items():
-                print(f"  Running: {scan_name}...", end=" ")
-
-                try:
-                    scan_results = engine.run_scan(
-                        query_func=scan_config['query'],
-                        order_by=scan_config['order_by'],
-                        limit=scan_config['limit'],
-                        ascending=False
-                    )
+    def run_scan(self, engine: ScanEngine, market_data: pd.DataFrame, selections: Dict,
+                 guru_name: str, scan_name: str, scan_config: Dict) -> Dict:
+        """Run one scan; errors are returned in the entry instead of raised"""
+        try:
+            if (guru_name, scan_name) in selections:
+                scan_results = market_data.iloc[selections[(guru_name, scan_name)]]
+            else:
+                scan_results = engine.run_scan(
+                    query_func=scan_config['query'],
+                    order_by=scan_config['order_by'],
+                    limit=scan_config['limit'],
+                    ascending=False
+                )
 
-                    results[guru_name]['scans'][scan_name] = {
-                        'description': scan_config.get('description', ''),
-                        'data': scan_results,
-                        'count': len(scan_results)
-                    }
+            return {
+                'description': scan_config.get('description', ''),
+                'data': scan_results,
+                'count': len(scan_results)
+            }
 
-                    print(f"{len(scan_results)} results")
+        except Exception as e:
+            return {
+                'description': scan_config.get('description', ''),
+                'data': pd.DataFrame(),
+                'count': 0,
+                'error': str(e)
+            }
 
-                except Exception as e:
-                    print(f"ERROR: {e}")
-                    results[guru_name]['scans'][scan_name] = {
-                        'description': scan_config.get('description', ''),
-                        'data': pd.DataFrame(),
-                        'count': 0,
-                        'error': str(e)
-                    }
+    def record_scan_changes(self, scan_results: Dict, market_data: pd.DataFrame):
+        """
+        Store the hits under the dataset's trading date and add each scan's
+        entries, exits and rank changes since the previous stored date as
+        scan_data['changes']
+        """
+        if 'date' in market_data.columns:
+            trading_date = pd.Timestamp(market_data['date'].max()).strftime('%Y-%m-%d')
+        else:
+            trading_date = datetime.now().strftime('%Y-%m-%d')
+
+        # Failed scans are left out, so they do not show every ticker as dropped
+        hits = {
+            (guru_name, scan_name): scan_data['data'].get('ticker', pd.Series(dtype=str)).tolist()
+            for guru_name, guru_data in scan_results.items()
+            for scan_name, scan_data in guru_data['scans'].items()
+            if 'error' not in scan_data
+        }
+        try:
+            changes = self.result_store.changes(trading_date, hits)
+        except Exception as e:
+            print(f"Error comparing with previous scan results: {e}")
+            return
+
+        for (guru_name, scan_name), change in changes.items():
+            scan_results[guru_name]['scans'][scan_name]['changes'] = change
+        if changes:
+            previous_date = next(iter(changes.values()))['previous_date']
+            new = sum(len(change['new']) for change in changes.values())
+            dropped = sum(len(change['dropped']) for change in changes.values())
+            print(f"Since {previous_date}: {new} new and {dropped} dropped hits across {len(changes)} scans")
+
+    def select_with_sql(self, market_data: pd.DataFrame, all_scans: Dict) -> Dict:
+        """
+        With SCAN_BACKEND=duckdb, row positions of every scan that translates
+        to SQL, selected in one DuckDB query. The rest run on ScanEngine.
+        """
+        if os.getenv("SCAN_BACKEND", "pandas") != "duckdb":
+            return {}
+
+        scans = {
+            (guru_name, scan_name): (scan_config['query'], scan_config['order_by'], scan_config['limit'], False)
+            for guru_name, guru_info in all_scans.items()
+            for scan_name, scan_config in guru_info['scans'].items()
+        }
+        try:
+            backend = SQLScanBackend(market_data, panel=self.fetcher.scan_panel)
+            selections = backend.select_all(scans)
+        except Exception as e:
+            print(f"SQL backend failed, running scans on pandas: {e}")
+            return {}
 
-        return results
+        print(f"Selected {len(selections)} of {len(scans)} scans with DuckDB")
+        return selections
 
-    def fetch_chart_data(self, tickers: List[str], days: int = 90) -> Dict:
+    def fetch_chart_data(self, tickers: List[str], days: int = CHART_DAYS) -> Dict:
         """
         Fetch 90-day OHLCV data for tickers
+        Scanned tickers are sliced from the scan dataset's histories;
+        only tickers outside it are requested from Polygon
 
         Returns:
             Dict: {ticker: [{date, open, high, low, close, volume}, ...]}
@@ -92,7 +191,7 @@ class SiteGenerator:
 
         for idx, ticker in enumerate(tickers):
             try:
-                df = self.fetcher.fetch_aggregates(ticker, days=days)
+                df = self.fetcher.chart_history(ticker, days=days)
 
                 if not df.empty:
                     # Convert to list of dicts for JSON embedding
@@ -111,6 +210,9 @@ class SiteGenerator:
                 print(f"  Error fetching {ticker}: {e}")
                 chart_data[ticker] = []
 
+        if self.fetcher.store is not None:
+            self.fetcher.store.flush()
+
         print(f"Fetched chart data for {len(chart_data)} tickers")
         return chart_data
 
@@ -122,8 +224,7 @@ class SiteGenerator:
 
         # If no results, show available scans structure
         if not scan_results:
-            from strategies.scans import get_all_scans
-            all_scans = get_all_scans()
+            all_scans = get_scan_set(os.getenv("SCAN_SET", "guru"))
             summary = []
             for guru_name, guru_info in all_scans.items():
                 guru_summary = {
@@ -150,23 +251,27 @@ class SiteGenerator:
                 }
 
                 for scan_name, scan_data in guru_data['scans'].items():
+                    changes = scan_data.get('changes')
                     guru_summary['scans'].append({
                         'name': scan_name,
                         'description': scan_data['description'],
                         'count': scan_data['count'],
+                        'new': len(changes['new']) if changes else None,
+                        'dropped': len(changes['dropped']) if changes else None,
                         'url': self.get_scan_url(guru_name, scan_name)
                     })
 
                 summary.append(guru_summary)
 
-        html = template.render(
-            gurus=summary,
-            scan_date=scan_date,
-            generated_at=datetime.now().strftime('%Y-%m-%d %H:%M:%S UTC')
-        )
+        with self.report.stage("render"):
+            html = template.render(
+                gurus=summary,
+                scan_date=scan_date,
+                generated_at=datetime.now().strftime('%Y-%m-%d %H:%M:%S UTC')
+            )
 
         output_file = self.output_dir / "index.html"
-        with open(output_file, 'w') as f:
+        with self.report.stage("write"), open(output_file, 'w') as f:
             f.write(html)
 
         print(f"  Saved to {output_file}")
@@ -187,48 +292,86 @@ class SiteGenerator:
                     print("No results, skipping")
                     continue
 
-                # Prepare stock data with charts
-                stocks = []
-                for _, row in df.iterrows():
-                    ticker = row['ticker']
-
-                    stock_data = {
-                        'ticker': ticker,
-                        'name': row.get('name', ticker),
-                        'close': row.get('close', 0),
-                        'volume': row.get('volume', 0),
-                        'daily_change': row.get('daily_change', 0),
-                        'roc': row.get('roc', 0),
-                        'volume_ratio': row.get('volume_ratio', 0),
-                        'chart_data': chart_data.get(ticker, [])
-                    }
-
-                    # Add any other relevant metrics
-                    for col in df.columns:
-                        if col not in stock_data:
-                            stock_data[col] = row.get(col)
-
-                    stocks.append(stock_data)
-
-                html = template.render(
-                    guru_name=guru_name,
-                    guru_link=guru_data['link'],
-                    scan_name=scan_name,
-                    description=scan_data['description'],
-                    stocks=stocks,
-                    scan_date=scan_date,
-                    generated_at=datetime.now().strftime('%Y-%m-%d %H:%M:%S UTC')
-                )
+                changes = scan_data.get('changes')
+                new = set(changes['new']) if changes else set()
+
+                with self.report.stage("render"):
+                    # Prepare stock data with charts
+                    stocks = []
+                    for _, row in df.iterrows():
+                        ticker = row['ticker']
+
+                        stock_data = {
+                            'ticker': ticker,
+                            'name': row.get('name', ticker),
+                            'close': row.get('close', 0),
+                            'volume': row.get('volume', 0),
+                            'daily_change': row.get('daily_change', 0),
+                            'roc': row.get('roc', 0),
+                            'volume_ratio': row.get('volume_ratio', 0),
+                            'chart_data': chart_data.get(ticker, []),
+                            # None when there is no previous day to compare with
+                            'is_new': ticker in new if changes else None,
+                            'rank_change': changes['rank_change'].get(ticker) if changes else None,
+                        }
+
+                        # Add any other relevant metrics
+                        for col in df.columns:
+                            if col not in stock_data:
+                                stock_data[col] = row.get(col)
+
+                        stocks.append(stock_data)
+
+                    html = template.render(
+                        guru_name=guru_name,
+                        guru_link=guru_data['link'],
+                        scan_name=scan_name,
+                        description=scan_data['description'],
+                        stocks=stocks,
+                        changes=changes,
+                        scan_date=scan_date,
+                        generated_at=datetime.now().strftime('%Y-%m-%d %H:%M:%S UTC')
+                    )
 
                 # Save to file
-                output_file = self.output_dir / self.get_scan_filename(guru_name, scan_name)
-                output_file.parent.mkdir(parents=True, exist_ok=True)
+                with self.report.stage("write"):
+                    output_file = self.output_dir / self.get_scan_filename(guru_name, scan_name)
+                    output_file.parent.mkdir(parents=True, exist_ok=True)
 
-                with open(output_file, 'w') as f:
-                    f.write(html)
+                    with open(output_file, 'w') as f:
+                        f.write(html)
 
                 print(f"{len(stocks)} stocks")
 
+    def write_run_report(self, scan_date: str, scan_results: Dict):
+        """
+        Save the run's per-stage report as run_report.json in the site
+        With RUN_REPORT_PAGE=1 it is also rendered as run_report.html
+        """
+        self.report.info.update({
+            'scan_date': scan_date,
+            'scans': sum(len(guru_data['scans']) for guru_data in scan_results.values()),
+            'chart_tickers': len({
+                ticker
+                for guru_data in scan_results.values()
+                for scan_data in guru_data['scans'].values()
+                for ticker in scan_data['data'].get('ticker', [])
+            }),
+        })
+
+        print("\nRun report:")
+        print(self.report.summary())
+        self.report.write(self.output_dir / "run_report.json")
+
+        if os.getenv("RUN_REPORT_PAGE", "0") == "1":
+            template = self.env.get_template('run_report.html')
+            html = template.render(
+                report=self.report.to_dict(),
+                generated_at=datetime.now().strftime('%Y-%m-%d %H:%M:%S UTC')
+            )
+            with open(self.output_dir / "run_report.html", 'w') as f:
+                f.write(html)
+
     def get_scan_url(self, guru_name: str, scan_name: str) -> str:
         """Generate URL for scan page"""
         return self.get_scan_filename(guru_name, scan_name)
@@ -251,7 +394,14 @@ class SiteGenerator:
         # Step 1: Fetch market data
         print("\n[1/5] Fetching market data from Polygon.io...")
         try:
-            market_data = self.fetcher.build_scan_dataset()
+            # Only the indicators and history the enabled scans need
+            columns, ranks, min_history = scan_requirements(get_scan_set(os.getenv("SCAN_SET", "guru")))
+            if columns is not None:
+                columns |= set(PAGE_COLUMNS)
+            # Charts are sliced from the same history, so fetch at least their window
+            market_data = self.fetcher.build_scan_dataset(
+                columns=columns, ranks=ranks, min_history=max(min_history, CHART_DAYS),
+            )
         except Exception as e:
             print(f"ERROR fetching data: {e}")
             import traceback
@@ -269,26 +419,30 @@ class SiteGenerator:
 
             # Step 2: Run all scans
             print("\n[2/5] Running scans...")
-            scan_results = self.run_all_scans(market_data)
-
-            # Step 3: Collect all qualifying tickers
-            print("\n[3/5] Collecting qualifying tickers...")
-            all_tickers = set()
-            for guru_data in scan_results.values():
-                for scan_data in guru_data['scans'].values():
-                    if not scan_data['data'].empty:
-                        all_tickers.update(scan_data['data']['ticker'].tolist())
+            with self.report.stage("scans"):
+                scan_results = self.run_all_scans(market_data)
+                self.record_scan_changes(scan_results, market_data)
+
+                # Step 3: Collect all qualifying tickers
+                print("\n[3/5] Collecting qualifying tickers...")
+                all_tickers = set()
+                for guru_data in scan_results.values():
+                    for scan_data in guru_data['scans'].values():
+                        if not scan_data['data'].empty:
+                            all_tickers.update(scan_data['data']['ticker'].tolist())
 
             print(f"  Found {len(all_tickers)} unique qualifying tickers")
 
             # Step 4: Fetch chart data
             print("\n[4/5] Fetching chart data...")
-            chart_data = self.fetch_chart_data(list(all_tickers), days=90)
+            with self.report.stage("charts"):
+                chart_data = self.fetch_chart_data(list(all_tickers), days=CHART_DAYS)
 
         # Step 5: Generate HTML pages (always, even if empty)
         print("\n[5/5] Generating HTML pages...")
         self.generate_index_page(scan_results, scan_date)
         self.generate_scan_pages(scan_results, chart_data, scan_date)
+        self.write_run_report(scan_date, scan_results)
 
         print("\n" + "=" * 60)
         print("COMPLETE!")
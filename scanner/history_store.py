@@ -0,0 +1,339 @@
+"""
+Persistent local OHLCV history store
+Bars are kept in Parquet files sharded by ticker, so a daily run only
+has to fetch and append the bars that are missing since the last run
+"""
+import hashlib
+import json
+import os
+import threading
+import uuid
+import zlib
+from datetime import date, datetime
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional
+import pandas as pd
+
+from panel import FIELDS
+
+COLUMNS = ['date', 'ticker'] + FIELDS
+
+
+class HistoryStore:
+    """
+    On-disk columnar store of daily bars
+
+    Layout:
+        root/manifest.json                  coverage, market dates, checksums
+        root/shard=NN/data.parquet          compacted bars
+        root/shard=NN/part-*.parquet        appended bars since last compaction
+
+    The whole store is loaded into memory on first use; new bars are
+    buffered and written by flush(), which also compacts shards once
+    they collect too many part files.
+    """
+
+    def __init__(self, root: Path, n_shards: int = 16, max_days: int = 756, max_parts: int = 20):
+        self.root = Path(root)
+        self.n_shards = n_shards
+        self.max_days = max_days
+        self.max_parts = max_parts
+
+        self._lock = threading.Lock()
+        self._loaded = False
+        self._frames: Dict[str, pd.DataFrame] = {}
+        # ticker -> first date the stored history is known to be complete from
+        self._coverage: Dict[str, str] = {}
+        # dates whose whole-market (grouped daily) bars have been stored
+        self._market_dates: set = set()
+        self._checksums: Dict[str, str] = {}
+        self._appended: Dict[int, List[pd.DataFrame]] = {}
+        self._rewrite: set = set()
+
+    # ------------------------------------------------------------------
+    # Loading and integrity
+    # ------------------------------------------------------------------
+
+    @property
+    def manifest_path(self) -> Path:
+        return self.root / "manifest.json"
+
+    def shard_of(self, ticker: str) -> int:
+        """Stable shard number for a ticker"""
+        return zlib.crc32(ticker.encode("utf-8")) % self.n_shards
+
+    def _shard_dir(self, shard: int) -> Path:
+        return self.root / f"shard={shard:02d}"
+
+    @staticmethod
+    def _sha256(path: Path) -> str:
+        digest = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1 << 20), b''):
+                digest.update(chunk)
+        return digest.hexdigest()
+
+    def _ensure_loaded(self):
+        if self._loaded:
+            return
+        with self._lock:
+            if not self._loaded:
+                self._load()
+                self._loaded = True
+
+    def _load(self):
+        """Read every shard, dropping files that fail their integrity checks"""
+        if not self.manifest_path.exists():
+            return
+
+        with open(self.manifest_path, 'r') as f:
+            manifest = json.load(f)
+
+        self._coverage = manifest.get('coverage', {})
+        self._market_dates = set(manifest.get('market_dates', []))
+        checksums = manifest.get('checksums', {})
+
+        frames = []
+        bad_shards = set()
+        for rel_path, checksum in checksums.items():
+            path = self.root / rel_path
+            shard = int(Path(rel_path).parent.name.split('=')[1])
+            try:
+                if self._sha256(path) != checksum:
+                    raise ValueError("checksum mismatch")
+                frames.append(pd.read_parquet(path, columns=COLUMNS))
+                self._checksums[rel_path] = checksum
+            except Exception as e:
+                print(f"History store: dropping shard {shard} ({rel_path}: {e})")
+                bad_shards.add(shard)
+
+        bars = pd.concat(frames, ignore_index=True) if frames else pd.DataFrame(columns=COLUMNS)
+
+        if bad_shards:
+            # Forget everything that lived in a damaged shard so it is refetched
+            bars = bars[~bars['ticker'].map(self.shard_of).isin(bad_shards)]
+            self._coverage = {t: d for t, d in self._coverage.items() if self.shard_of(t) not in bad_shards}
+            self._market_dates = set()
+            self._rewrite.update(bad_shards)
+
+        bars = self._clean(bars)
+        self._frames = {
+            ticker: hist.drop(columns='ticker').reset_index(drop=True)
+            for ticker, hist in bars.groupby('ticker', sort=False)
+        }
+
+    @staticmethod
+    def _clean(bars: pd.DataFrame) -> pd.DataFrame:
+        """Drop invalid and duplicate bars, keeping the latest copy of each (ticker, date)"""
+        if bars.empty:
+            return bars
+        bars = bars[bars['close'].notna() & (bars['close'] > 0) & (bars['high'] >= bars['low'])]
+        bars = bars.drop_duplicates(subset=['ticker', 'date'], keep='last')
+        return bars.sort_values(['ticker', 'date'], kind='stable')
+
+    def verify(self) -> List[str]:
+        """Check files on disk against the manifest, returning a list of problems"""
+        problems = []
+        if not self.manifest_path.exists():
+            return problems
+
+        with open(self.manifest_path, 'r') as f:
+            checksums = json.load(f).get('checksums', {})
+
+        for rel_path, checksum in checksums.items():
+            path = self.root / rel_path
+            if not path.exists():
+                problems.append(f"{rel_path}: missing")
+            elif self._sha256(path) != checksum:
+                problems.append(f"{rel_path}: checksum mismatch")
+        return problems
+
+    # ------------------------------------------------------------------
+    # Reading
+    # ------------------------------------------------------------------
+
+    def tickers(self) -> List[str]:
+        self._ensure_loaded()
+        return list(self._frames)
+
+    def history(self, ticker: str, since: Optional[date] = None) -> Optional[pd.DataFrame]:
+        """
+        Stored bars for a ticker from `since` onwards
+        Returns None when the store does not cover that range
+        """
+        self._ensure_loaded()
+        hist = self._frames.get(ticker)
+        covered_from = self._coverage.get(ticker)
+        if hist is None or hist.empty or covered_from is None:
+            return None
+        if since is not None and pd.Timestamp(covered_from) > pd.Timestamp(since):
+            return None
+        if since is not None:
+            hist = hist[hist['date'] >= pd.Timestamp(since)]
+        return hist.reset_index(drop=True)
+
+    def nbytes(self) -> int:
+        """Memory held by the loaded bars"""
+        return int(sum(hist.memory_usage(deep=True).sum() for hist in self._frames.values()))
+
+    def market_dates(self) -> set:
+        """Dates whose whole-market bars are stored"""
+        self._ensure_loaded()
+        return set(self._market_dates)
+
+    def bars(self, dates: Optional[Iterable[str]] = None) -> pd.DataFrame:
+        """All stored bars in long format, optionally restricted to some dates"""
+        self._ensure_loaded()
+        bars = self._all_bars()
+        if dates is not None:
+            bars = bars[bars['date'].isin(pd.to_datetime(list(dates)))]
+        return bars.reset_index(drop=True)
+
+    def _all_bars(self) -> pd.DataFrame:
+        frames = [hist.assign(ticker=ticker) for ticker, hist in self._frames.items()]
+        if not frames:
+            return pd.DataFrame(columns=COLUMNS)
+        return pd.concat(frames, ignore_index=True)[COLUMNS]
+
+    # ------------------------------------------------------------------
+    # Writing
+    # ------------------------------------------------------------------
+
+    def put(self, ticker: str, hist: pd.DataFrame, covered_from: date):
+        """Replace a ticker's stored history with a freshly fetched one"""
+        self._ensure_loaded()
+        hist = self._clean(hist.assign(ticker=ticker))[COLUMNS]
+        with self._lock:
+            self._frames[ticker] = hist.drop(columns='ticker').reset_index(drop=True)
+            self._coverage[ticker] = str(covered_from)
+            self._rewrite.add(self.shard_of(ticker))
+
+    def extend(self, ticker: str, new_bars: pd.DataFrame, rtol: float = 1e-6) -> bool:
+        """
+        Append newly fetched bars to a ticker's history
+
+        new_bars is expected to start at the last stored date; if that
+        overlapping bar no longer matches (split or other restatement)
+        nothing is stored and False is returned so the caller can refetch.
+        """
+        self._ensure_loaded()
+        if new_bars.empty:
+            return True
+
+        with self._lock:
+            hist = self._frames[ticker]
+            last = hist.iloc[-1]
+            overlap = new_bars[new_bars['date'] == last['date']]
+            if not overlap.empty:
+                new_close = overlap['close'].iloc[-1]
+                if abs(new_close - last['close']) > rtol * abs(last['close']):
+                    return False
+
+            appended = new_bars[new_bars['date'] > last['date']]
+            if appended.empty:
+                return True
+
+            appended = self._clean(appended.assign(ticker=ticker))[COLUMNS]
+            self._frames[ticker] = pd.concat(
+                [hist, appended.drop(columns='ticker')], ignore_index=True
+            )
+            self._appended.setdefault(self.shard_of(ticker), []).append(appended)
+            return True
+
+    def put_market_days(self, bars: pd.DataFrame, days: Iterable[str]):
+        """
+        Store grouped (whole-market) bars for a set of dates
+        Every date in `days` is remembered, including empty ones such as
+        holidays, so it is not fetched again
+        """
+        self._ensure_loaded()
+        with self._lock:
+            if not bars.empty:
+                bars = self._clean(bars)[COLUMNS]
+                merged = self._clean(pd.concat([self._all_bars(), bars], ignore_index=True))
+                self._frames = {
+                    ticker: hist.drop(columns='ticker').reset_index(drop=True)
+                    for ticker, hist in merged.groupby('ticker', sort=False)
+                }
+                for shard, rows in bars.groupby(bars['ticker'].map(self.shard_of)):
+                    self._appended.setdefault(shard, []).append(rows)
+            self._market_dates.update(days)
+
+    def _write(self, shard: int, name: str, bars: pd.DataFrame) -> str:
+        """Atomically write a Parquet file and record its checksum"""
+        shard_dir = self._shard_dir(shard)
+        shard_dir.mkdir(parents=True, exist_ok=True)
+        path = shard_dir / name
+        tmp = path.with_suffix('.tmp')
+        bars.to_parquet(tmp, index=False)
+        os.replace(tmp, path)
+
+        rel_path = str(path.relative_to(self.root))
+        self._checksums[rel_path] = self._sha256(path)
+        return rel_path
+
+    def _shard_files(self, shard: int) -> List[str]:
+        prefix = f"shard={shard:02d}/"
+        return [p for p in self._checksums if p.startswith(prefix)]
+
+    def _compact_shard(self, shard: int):
+        """Rewrite a shard as a single file trimmed to max_days per ticker"""
+        frames = [
+            hist.tail(self.max_days).assign(ticker=ticker)
+            for ticker, hist in self._frames.items()
+            if self.shard_of(ticker) == shard and not hist.empty
+        ]
+        for rel_path in self._shard_files(shard):
+            del self._checksums[rel_path]
+
+        if frames:
+            bars = pd.concat(frames, ignore_index=True)[COLUMNS]
+            self._write(shard, "data.parquet", bars)
+
+        # Also clears files left behind by interrupted or concurrent writers
+        for path in self._shard_dir(shard).glob("*"):
+            if str(path.relative_to(self.root)) not in self._checksums:
+                path.unlink(missing_ok=True)
+
+    def _write_manifest(self):
+        manifest = {
+            'version': 1,
+            'updated_at': datetime.now().isoformat(timespec='seconds'),
+            'coverage': self._coverage,
+            'market_dates': sorted(self._market_dates),
+            'checksums': self._checksums,
+        }
+        self.root.mkdir(parents=True, exist_ok=True)
+        tmp = self.manifest_path.with_suffix('.tmp')
+        with open(tmp, 'w') as f:
+            json.dump(manifest, f)
+        os.replace(tmp, self.manifest_path)
+
+    def flush(self):
+        """Write buffered bars to disk, compacting shards that need it"""
+        with self._lock:
+            if not self._appended and not self._rewrite:
+                return
+
+            stamp = datetime.now().strftime('%Y%m%dT%H%M%S')
+            for shard, frames in self._appended.items():
+                if shard in self._rewrite:
+                    continue
+                bars = pd.concat(frames, ignore_index=True)
+                self._write(shard, f"part-{stamp}-{uuid.uuid4().hex[:8]}.parquet", bars)
+                if len(self._shard_files(shard)) > self.max_parts:
+                    self._rewrite.add(shard)
+
+            for shard in sorted(self._rewrite):
+                self._compact_shard(shard)
+
+            self._appended = {}
+            self._rewrite = set()
+            self._write_manifest()
+
+    def compact(self):
+        """Rewrite every shard as a single trimmed file"""
+        self._ensure_loaded()
+        with self._lock:
+            self._rewrite.update(range(self.n_shards))
+        self.flush()
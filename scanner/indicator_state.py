@@ -0,0 +1,396 @@
+"""
+Incremental indicator state carried between runs
+Each ticker keeps the running state of every indicator (rolling sums,
+EMA weights, current window extremes and a ring buffer of recent inputs),
+so a new daily bar is folded in with O(1) work per ticker instead of
+recomputing 252 bars. State is columnar across tickers and every update
+is vectorized over all tickers that received a bar.
+"""
+import os
+from pathlib import Path
+from typing import Dict, List, Optional
+import numpy as np
+import pandas as pd
+
+from indicators import EMA_PERIODS, MINMAX_PERIODS, SMA_PERIODS, align_panel
+from panel import FIELDS
+
+STATE_VERSION = 1
+
+# Rolling means: name -> (input series, period)
+MEANS = {f'sma_{period}': ('close', period) for period in SMA_PERIODS}
+MEANS.update({
+    'sma_50_volume': ('volume', 50),
+    'adr_20': ('range', 20),
+    'avg_dollar_volume_50': ('dollar_volume', 50),
+})
+RING_INPUTS = ['close', 'volume', 'range', 'dollar_volume']
+WINDOW = max([period for _, period in MEANS.values()] + MINMAX_PERIODS)
+
+_MEAN_FIELDS = {'sum': np.float64, 'comp_add': np.float64, 'comp_remove': np.float64,
+                'nobs': np.int64, 'neg_ct': np.int64, 'same_ct': np.int64, 'prev': np.float64}
+
+
+class IndicatorState:
+    """
+    Running indicator state for a set of tickers
+    Every array in self.arrays has the ticker axis last
+    """
+
+    def __init__(self, tickers: List[str], arrays: Dict[str, np.ndarray]):
+        self.tickers = list(tickers)
+        self.arrays = arrays
+
+    @classmethod
+    def empty(cls, tickers: List[str]) -> 'IndicatorState':
+        n = len(tickers)
+        arrays = {
+            'count': np.zeros(n, dtype=np.int64),
+            'last_date': np.full(n, np.datetime64('NaT'), dtype='datetime64[ns]'),
+            'prev_close': np.full(n, np.nan),
+        }
+        for field in FIELDS:
+            arrays[f'last_{field}'] = np.full(n, np.nan)
+        for name in RING_INPUTS:
+            arrays[f'ring_{name}'] = np.full((WINDOW, n), np.nan)
+        for name in MEANS:
+            for field, dtype in _MEAN_FIELDS.items():
+                arrays[f'{name}:{field}'] = np.zeros(n, dtype=dtype)
+            arrays[f'{name}:prev'][:] = np.nan
+        for period in EMA_PERIODS:
+            arrays[f'ema_{period}:weighted'] = np.full(n, np.nan)
+            arrays[f'ema_{period}:old_wt'] = np.ones(n)
+        for period in MINMAX_PERIODS:
+            for kind in ('min', 'max'):
+                arrays[f'{kind}_{period}:value'] = np.full(n, np.nan)
+                arrays[f'{kind}_{period}:age'] = np.zeros(n, dtype=np.int64)
+        return cls(tickers, arrays)
+
+    def take(self, positions: np.ndarray) -> 'IndicatorState':
+        """State for a subset of tickers (by position)"""
+        tickers = [self.tickers[i] for i in positions]
+        return IndicatorState(tickers, {k: v[..., positions].copy() for k, v in self.arrays.items()})
+
+    @classmethod
+    def concat(cls, states: List['IndicatorState']) -> 'IndicatorState':
+        tickers = [t for state in states for t in state.tickers]
+        arrays = {k: np.concatenate([s.arrays[k] for s in states], axis=-1) for k in states[0].arrays}
+        return cls(tickers, arrays)
+
+    # ------------------------------------------------------------------
+    # Updates
+    # ------------------------------------------------------------------
+
+    def _mean_step(self, name: str, idx: np.ndarray, count: np.ndarray, new: np.ndarray, ring: np.ndarray):
+        """
+        Slide a rolling mean by one bar using the same compensated
+        (Kahan) summation as pandas' rolling mean kernel
+        """
+        a = self.arrays
+        period = MEANS[name][1]
+        total = a[f'{name}:sum'][idx]
+        nobs = a[f'{name}:nobs'][idx]
+        neg_ct = a[f'{name}:neg_ct'][idx]
+
+        # Drop the bar leaving the window
+        leaving = np.where(count >= period, ring[(count - period) % WINDOW, idx], np.nan)
+        remove = leaving == leaving
+        comp = a[f'{name}:comp_remove'][idx]
+        y = -leaving - comp
+        t = total + y
+        a[f'{name}:comp_remove'][idx] = np.where(remove, t - total - y, comp)
+        total = np.where(remove, t, total)
+        nobs = nobs - remove
+        neg_ct = neg_ct - (remove & np.signbit(leaving))
+
+        # Add the new bar
+        add = new == new
+        comp = a[f'{name}:comp_add'][idx]
+        y = new - comp
+        t = total + y
+        a[f'{name}:comp_add'][idx] = np.where(add, t - total - y, comp)
+        total = np.where(add, t, total)
+        nobs = nobs + add
+        neg_ct = neg_ct + (add & np.signbit(new))
+
+        prev = a[f'{name}:prev'][idx]
+        same_ct = a[f'{name}:same_ct'][idx]
+        a[f'{name}:same_ct'][idx] = np.where(add, np.where(new == prev, same_ct + 1, 1), same_ct)
+        a[f'{name}:prev'][idx] = np.where(add, new, prev)
+
+        a[f'{name}:sum'][idx] = total
+        a[f'{name}:nobs'][idx] = nobs
+        a[f'{name}:neg_ct'][idx] = neg_ct
+
+    def _ema_step(self, period: int, idx: np.ndarray, cur: np.ndarray):
+        """Advance an adjust=False EMA by one bar (same arithmetic as indicators.calc_ema)"""
+        a = self.arrays
+        alpha = 1.0 / (1.0 + (period - 1) / 2.0)
+        weighted = a[f'ema_{period}:weighted'][idx]
+        old_wt = a[f'ema_{period}:old_wt'][idx]
+
+        started = weighted == weighted
+        old_wt = np.where(started, old_wt * (1.0 - alpha), old_wt)
+        blended = (old_wt * weighted + alpha * cur) / (old_wt + alpha)
+        weighted = np.where(started, np.where(weighted != cur, blended, weighted), cur)
+
+        a[f'ema_{period}:weighted'][idx] = weighted
+        a[f'ema_{period}:old_wt'][idx] = np.where(started, 1.0, old_wt)
+
+    def _extreme_step(self, kind: str, period: int, idx: np.ndarray, count: np.ndarray, cur: np.ndarray):
+        """
+        Track the window min/max and how many bars ago it was set (the head
+        of a monotonic deque). Only when it ages out of the window is the
+        extreme rescanned from the ring buffer.
+        """
+        a = self.arrays
+        value = a[f'{kind}_{period}:value'][idx]
+        age = a[f'{kind}_{period}:age'][idx]
+
+        better = (cur >= value) if kind == 'max' else (cur <= value)
+        replace = (count == 0) | better
+        value = np.where(replace, cur, value)
+        age = np.where(replace, 0, age + 1)
+
+        expired = np.flatnonzero(age >= period)
+        if len(expired):
+            # Column k of the window is the bar k days ago
+            new_count = count[expired] + 1
+            offsets = np.arange(1, period + 1)[:, None]
+            window = a['ring_close'][(new_count - offsets) % WINDOW, idx[expired]]
+            pick = np.argmax(window, axis=0) if kind == 'max' else np.argmin(window, axis=0)
+            value[expired] = window[pick, np.arange(len(expired))]
+            age[expired] = pick
+
+        a[f'{kind}_{period}:value'][idx] = value
+        a[f'{kind}_{period}:age'][idx] = age
+
+    def step(self, idx: np.ndarray, date: np.ndarray, bars: Dict[str, np.ndarray]):
+        """Fold one new bar into the state of the tickers at positions idx"""
+        if len(idx) == 0:
+            return
+
+        a = self.arrays
+        close = bars['close']
+        inputs = {
+            'close': close,
+            'volume': bars['volume'],
+            'range': ((bars['high'] - bars['low']) / close) * 100,
+            'dollar_volume': bars['volume'] * close,
+        }
+        count = a['count'][idx]
+
+        for name, (source, _) in MEANS.items():
+            self._mean_step(name, idx, count, inputs[source], a[f'ring_{source}'])
+
+        # Ring buffers are written after the means have read the leaving bars
+        for name in RING_INPUTS:
+            a[f'ring_{name}'][count % WINDOW, idx] = inputs[name]
+
+        for period in EMA_PERIODS:
+            self._ema_step(period, idx, close)
+
+        for period in MINMAX_PERIODS:
+            self._extreme_step('min', period, idx, count, close)
+            self._extreme_step('max', period, idx, count, close)
+
+        a['prev_close'][idx] = np.where(count > 0, a['last_close'][idx], np.nan)
+        for field in FIELDS:
+            a[f'last_{field}'][idx] = bars[field]
+        a['last_date'][idx] = date
+        a['count'][idx] = count + 1
+
+    def replay(self, aligned: Dict[str, pd.DataFrame], start_rows: np.ndarray):
+        """
+        Feed bottom-aligned panel rows into the state, ticker by ticker
+        starting after start_rows (-1 = from the first row)
+        """
+        values = {field: aligned[field].to_numpy(dtype='float64') for field in FIELDS}
+        dates = aligned['date'].to_numpy(dtype='datetime64[ns]')
+        first = int(start_rows.min()) + 1 if len(start_rows) else len(dates)
+
+        for row in range(max(first, 0), len(dates)):
+            idx = np.flatnonzero((row > start_rows) & (values['close'][row] == values['close'][row]))
+            self.step(idx, dates[row, idx], {field: values[field][row, idx] for field in FIELDS})
+
+    # ------------------------------------------------------------------
+    # Output
+    # ------------------------------------------------------------------
+
+    def _mean_value(self, name: str) -> np.ndarray:
+        """Current value of a rolling mean (pandas' calc_mean)"""
+        a = self.arrays
+        period = MEANS[name][1]
+        nobs = a[f'{name}:nobs']
+        neg_ct = a[f'{name}:neg_ct']
+        with np.errstate(invalid='ignore', divide='ignore'):
+            result = a[f'{name}:sum'] / nobs
+        result = np.where(a[f'{name}:same_ct'] >= nobs, a[f'{name}:prev'], result)
+        result = np.where((neg_ct == 0) & (result < 0), 0.0, result)
+        result = np.where((neg_ct == nobs) & (result > 0), 0.0, result)
+        return np.where((nobs >= period) & (nobs > 0), result, np.nan)
+
+    def rows(self) -> pd.DataFrame:
+        """Latest bar and indicator values, in scan dataset column order"""
+        a = self.arrays
+        count = a['count']
+        close = a['last_close']
+        volume = a['last_volume']
+
+        out = {'date': a['last_date']}
+        for field in FIELDS:
+            out[field] = a[f'last_{field}']
+
+        with np.errstate(invalid='ignore', divide='ignore'):
+            for period in SMA_PERIODS:
+                out[f'sma_{period}'] = self._mean_value(f'sma_{period}')
+            for period in EMA_PERIODS:
+                out[f'ema_{period}'] = np.where(count >= period, a[f'ema_{period}:weighted'], np.nan)
+            out['sma_50_volume'] = self._mean_value('sma_50_volume')
+            out['volume_ratio'] = volume / out['sma_50_volume']
+            out['roc'] = ((close / a['prev_close']) - 1) * 100
+            out['close_prev'] = a['prev_close']
+            out['daily_change'] = (close / out['close_prev'] - 1) * 100
+            out['adr_20'] = self._mean_value('adr_20')
+            out['trend_intensity'] = close / out['sma_20']
+            for period in MINMAX_PERIODS:
+                out[f'min_{period}'] = np.where(count >= period, a[f'min_{period}:value'], np.nan)
+                out[f'max_{period}'] = np.where(count >= period, a[f'max_{period}:value'], np.nan)
+            out['dollar_volume'] = volume * close
+            out['avg_dollar_volume_50'] = self._mean_value('avg_dollar_volume_50')
+
+        df = pd.DataFrame(out)
+        df['ticker'] = self.tickers
+        return df
+
+
+class IndicatorStateStore:
+    """Loads, updates and saves IndicatorState between runs"""
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+
+    def load(self) -> Optional[IndicatorState]:
+        if not self.path.exists():
+            return None
+        try:
+            with np.load(self.path, allow_pickle=False) as data:
+                if int(data['version']) != STATE_VERSION:
+                    return None
+                tickers = data['tickers'].tolist()
+                arrays = {k: data[k] for k in data.files if k not in ('version', 'tickers')}
+            return IndicatorState(tickers, arrays)
+        except Exception as e:
+            print(f"Indicator state unreadable, recomputing ({e})")
+            return None
+
+    def save(self, state: IndicatorState):
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = self.path.with_name(self.path.stem + '.tmp.npz')
+        np.savez(tmp, version=STATE_VERSION, tickers=np.array(state.tickers, dtype=str), **state.arrays)
+        os.replace(tmp, self.path)
+
+    def _resumable(self, panel: Dict[str, pd.DataFrame],
+                   previous: Optional[IndicatorState]) -> Dict[str, int]:
+        """
+        Tickers of the panel whose stored state ends on a bar that is still
+        in the panel with the same close, by position in the stored state
+        """
+        if previous is None:
+            return {}
+        close = panel['close']
+        dates = close.index.to_numpy(dtype='datetime64[ns]')
+        positions = {t: i for i, t in enumerate(previous.tickers)}
+        resumable = {}
+        for ticker in close.columns:
+            pos = positions.get(ticker)
+            if pos is None:
+                continue
+            row = np.searchsorted(dates, previous.arrays['last_date'][pos])
+            if (row < len(dates) and dates[row] == previous.arrays['last_date'][pos]
+                    and close[ticker].iat[row] == previous.arrays['last_close'][pos]):
+                resumable[ticker] = pos
+        return resumable
+
+    def resumable(self, panel: Dict[str, pd.DataFrame]) -> List[str]:
+        """Tickers of the panel latest_rows would update from their stored state"""
+        if panel['close'].empty:
+            return []
+        return list(self._resumable(panel, self.load()))
+
+    def bars_since(self, tickers: List[str], date: Optional[str] = None) -> Dict[str, int]:
+        """
+        Weekdays from the last bar of each ticker's stored state through
+        date (default today), that bar included: enough bars for the state
+        to resume. Tickers without state are left out.
+        """
+        previous = self.load()
+        if previous is None:
+            return {}
+        end = np.datetime64(date or pd.Timestamp.now().strftime('%Y-%m-%d'), 'D') + 1
+        positions = {t: i for i, t in enumerate(previous.tickers)}
+        known = [t for t in tickers if t in positions]
+        last = previous.arrays['last_date'][[positions[t] for t in known]].astype('datetime64[D]')
+        return dict(zip(known, np.busday_count(last, end).tolist()))
+
+    def latest_rows(self, panel: Dict[str, pd.DataFrame], min_bars: int = 50) -> pd.DataFrame:
+        """
+        Latest indicator rows for the tickers in the panel
+
+        Tickers whose stored state ends on a bar that is still in the panel
+        with the same close only have the newer bars read and folded in, so
+        for them the panel need only reach back to that bar. The rest (new
+        tickers, gaps longer than the panel, restated histories) are rebuilt
+        from their full history when it has at least min_bars bars.
+        """
+        if panel['close'].empty:
+            return pd.DataFrame()
+
+        previous = self.load()
+        resume = self._resumable(panel, previous)
+        counts = panel['close'].notna().sum()
+        rebuild = [t for t in counts.index[counts >= min_bars] if t not in resume]
+        if not resume and not rebuild:
+            # Nothing to update; the stored state is left as it is
+            return pd.DataFrame()
+
+        parts = []
+        if resume:
+            tickers = list(resume)
+            positions = np.array([resume[t] for t in tickers], dtype=np.int64)
+            state = previous.take(positions)
+            # Only the rows from the oldest stored bar on are read
+            last_dates = state.arrays['last_date']
+            dates = panel['close'].index
+            aligned = align_panel({field: frame.loc[dates >= last_dates.min(), tickers]
+                                   for field, frame in panel.items()})
+            stored = aligned['date'].to_numpy(dtype='datetime64[ns]') == last_dates
+            state.replay(aligned, stored.argmax(axis=0))
+            parts.append(state)
+        if rebuild:
+            aligned = align_panel({field: frame[rebuild] for field, frame in panel.items()})
+            state = IndicatorState.empty(rebuild)
+            state.replay(aligned, np.full(len(rebuild), -1, dtype=np.int64))
+            parts.append(state)
+
+        print(f"Indicator state: {len(resume)} tickers updated incrementally, {len(rebuild)} rebuilt")
+
+        current = IndicatorState.concat(parts)
+        order = {t: i for i, t in enumerate(current.tickers)}
+        current = current.take(np.array([order[t] for t in panel['close'].columns if t in order], dtype=np.int64))
+
+        # Keep state for tickers not updated here so they can resume later,
+        # until their last bar is further back than the indicators look
+        if previous is not None:
+            latest = panel['close'].index[-1].to_datetime64().astype('datetime64[D]')
+            age = np.busday_count(previous.arrays['last_date'].astype('datetime64[D]'), latest)
+            outside = ~np.isin(previous.tickers, current.tickers)
+            others = np.flatnonzero(outside & (age <= WINDOW))
+            if len(others):
+                self.save(IndicatorState.concat([current, previous.take(others)]))
+            else:
+                self.save(current)
+        else:
+            self.save(current)
+
+        return current.rows()
@@ -0,0 +1,537 @@
+"""
+Technical indicators for EOD scans
+The same definitions run on a single ticker (Series per field) or on a
+whole date x ticker panel (DataFrame per field), where each rolling
+window or EMA is computed for every ticker column in one vectorized pass
+"""
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+from typing import Callable, Dict, Iterable, List, NamedTuple, Optional, Tuple, Union
+import numpy as np
+import pandas as pd
+from pandas.api.indexers import BaseIndexer
+
+from panel import FIELDS
+
+Frame = Union[pd.Series, pd.DataFrame]
+
+SMA_PERIODS = [20, 50, 100, 150, 200]
+EMA_PERIODS = [9, 10, 21, 50, 200]
+MINMAX_PERIODS = [5, 21, 63, 126, 252]
+
+# Tickers per block when computing full indicator time series
+CHUNK_TICKERS = 1000
+
+# An EMA is given EMA_WARMUP x period bars for its starting value to fade
+# out (its weight falls to about e^-8)
+EMA_WARMUP = 4
+
+# Most history the indicators read, one year as before lookbacks were derived
+MAX_HISTORY_DAYS = 252
+
+
+class _ColumnWindowIndexer(BaseIndexer):
+    """
+    Fixed-size windows over column-major stacked data that never cross
+    from one column (ticker) into the next. Each column's first window
+    starts fresh, exactly as a separate per-ticker rolling call would.
+    """
+
+    def get_window_bounds(self, num_values=0, min_periods=None, center=None, closed=None, step=None):
+        end = np.arange(1, num_values + 1, dtype=np.int64)
+        position = np.arange(num_values, dtype=np.int64) % self.column_size
+        start = end - np.minimum(position + 1, self.window_size)
+        return start, end
+
+
+def _values_2d(series: Frame) -> np.ndarray:
+    return series.to_numpy(dtype='float64').reshape(len(series), -1)
+
+
+def _like(values: np.ndarray, series: Frame) -> Frame:
+    if isinstance(series, pd.Series):
+        return pd.Series(values[:, 0], index=series.index)
+    return pd.DataFrame(values, index=series.index, columns=series.columns)
+
+
+def _rolling(series: Frame, period: int, how: str) -> Frame:
+    """
+    Rolling mean/min/max of every column in a single pandas kernel call
+    by stacking the columns end to end
+    """
+    values = _values_2d(series)
+    if values.size == 0:
+        return _like(values, series)
+
+    stacked = pd.Series(values.ravel(order='F'))
+    indexer = _ColumnWindowIndexer(window_size=period, column_size=values.shape[0])
+    result = getattr(stacked.rolling(indexer, min_periods=period), how)()
+    return _like(result.to_numpy().reshape(values.shape, order='F'), series)
+
+
+def calc_sma(series: Frame, period: int) -> Frame:
+    return _rolling(series, period, 'mean')
+
+
+def calc_min(series: Frame, period: int) -> Frame:
+    return _rolling(series, period, 'min')
+
+
+def calc_max(series: Frame, period: int) -> Frame:
+    return _rolling(series, period, 'max')
+
+
+def calc_ema(series: Frame, period: int) -> Frame:
+    """
+    Exponential moving average, equivalent to
+    series.ewm(span=period, adjust=False, min_periods=period).mean()
+    The recursion steps through dates with every ticker updated at once
+    and follows the same floating point operations as pandas
+    """
+    values = _values_2d(series)
+    alpha = 1.0 / (1.0 + (period - 1) / 2.0)
+    old_wt_factor = 1.0 - alpha
+
+    out = np.full(values.shape, np.nan)
+    if values.size == 0:
+        return _like(out, series)
+
+    weighted = np.full(values.shape[1], np.nan)
+    old_wt = np.ones(values.shape[1])
+    nobs = np.zeros(values.shape[1], dtype=np.int64)
+
+    for i, cur in enumerate(values):
+        is_observation = cur == cur
+        nobs += is_observation
+        started = weighted == weighted
+
+        # Missing values still decay the previous weight (ignore_na=False)
+        old_wt = np.where(started, old_wt * old_wt_factor, old_wt)
+        update = started & is_observation
+        blended = (old_wt * weighted + alpha * cur) / (old_wt + alpha)
+        weighted = np.where(update & (weighted != cur), blended, weighted)
+        old_wt = np.where(update, 1.0, old_wt)
+        weighted = np.where(~started & is_observation, cur, weighted)
+
+        out[i] = np.where(nobs >= period, weighted, np.nan)
+
+    return _like(out, series)
+
+
+def calc_roc(series: Frame, period: int = 1) -> Frame:
+    """Rate of Change as percentage"""
+    return ((series / series.shift(period)) - 1) * 100
+
+
+def calc_adr(high: Frame, low: Frame, close: Frame, period: int = 20) -> Frame:
+    """Average Daily Range as percentage"""
+    daily_range = ((high - low) / close) * 100
+    return calc_sma(daily_range, period)
+
+
+def calc_trend_intensity(series: Frame, period: int = 20) -> Frame:
+    """
+    Trend Intensity indicator
+    Measures consistency of trend direction
+    """
+    # Simplified TI: ratio of close to period average
+    sma = calc_sma(series, period)
+    return series / sma
+
+
+def _window(values: np.ndarray, period: int) -> np.ndarray:
+    """Last `period` rows of a bottom-aligned array, NaN-padded if shorter"""
+    if len(values) >= period:
+        return values[-period:]
+    pad = np.full((period - len(values),) + values.shape[1:], np.nan)
+    return np.vstack([pad, values])
+
+
+def _tail_mean(values: np.ndarray, period: int) -> np.ndarray:
+    """Mean of the last `period` values per column, NaN unless all are present"""
+    window = _window(values, period)
+    full = ~np.isnan(window).any(axis=0)
+    with np.errstate(invalid='ignore'):
+        return np.where(full, window.sum(axis=0) / period, np.nan)
+
+
+def _tail_extreme(values: np.ndarray, period: int, how: str) -> np.ndarray:
+    window = _window(values, period)
+    full = ~np.isnan(window).any(axis=0)
+    reduce = np.max if how == 'max' else np.min
+    return np.where(full, reduce(np.where(full, window, 0.0), axis=0), np.nan)
+
+
+def _tail_ema(values: np.ndarray, period: int) -> np.ndarray:
+    """
+    adjust=False EMA at the last bar as a single weighted sum:
+    a*(1-a)^j for the bar j days back, plus (1-a)^n on the first bar
+    """
+    alpha = 1.0 / (1.0 + (period - 1) / 2.0)
+    valid = ~np.isnan(values)
+    nobs = valid.sum(axis=0)
+
+    lags = np.arange(len(values))[::-1, None]
+    weights = alpha * (1.0 - alpha) ** lags
+    total = np.where(valid, values, 0.0) * weights
+
+    first_row = len(values) - nobs
+    first = values[np.minimum(first_row, len(values) - 1), np.arange(values.shape[1])]
+    ema = total.sum(axis=0) + (1.0 - alpha) ** nobs * first
+    return np.where(nobs >= period, ema, np.nan)
+
+
+class Indicator(NamedTuple):
+    """
+    A scan dataset column and how to compute it
+
+    inputs: OHLCV fields and indicators it is computed from
+    window: bars of its inputs it reads at each bar (1: the same bar only)
+    series: full time series, from {name: series} of its inputs
+    latest: value at the last row, from bottom-aligned OHLCV arrays and
+            the latest values of the indicators computed before it
+    """
+    inputs: Tuple[str, ...]
+    window: int
+    series: Callable[[Dict[str, Frame]], Frame]
+    latest: Callable[[Dict[str, np.ndarray], Dict[str, np.ndarray]], np.ndarray]
+
+
+def _previous(values: np.ndarray) -> np.ndarray:
+    return values[-2] if len(values) > 1 else np.full(values.shape[1], np.nan)
+
+
+def _daily_range(bars: Dict) -> Frame:
+    return ((bars['high'] - bars['low']) / bars['close']) * 100
+
+
+def _registry() -> Dict[str, Indicator]:
+    """Every indicator in scan dataset column order, inputs before the indicators using them"""
+    reg = {}
+    for period in SMA_PERIODS:
+        reg[f'sma_{period}'] = Indicator(
+            ('close',), period,
+            lambda x, p=period: calc_sma(x['close'], p),
+            lambda b, o, p=period: _tail_mean(b['close'], p))
+    for period in EMA_PERIODS:
+        reg[f'ema_{period}'] = Indicator(
+            ('close',), EMA_WARMUP * period,
+            lambda x, p=period: calc_ema(x['close'], p),
+            lambda b, o, p=period: _tail_ema(b['close'], p))
+
+    # Volume indicators
+    reg['sma_50_volume'] = Indicator(
+        ('volume',), 50,
+        lambda x: calc_sma(x['volume'], 50),
+        lambda b, o: _tail_mean(b['volume'], 50))
+    reg['volume_ratio'] = Indicator(
+        ('volume', 'sma_50_volume'), 1,
+        lambda x: x['volume'] / x['sma_50_volume'],
+        lambda b, o: b['volume'][-1] / o['sma_50_volume'])
+
+    # Price changes
+    reg['roc'] = Indicator(
+        ('close',), 2,
+        lambda x: calc_roc(x['close']),
+        lambda b, o: ((b['close'][-1] / _previous(b['close'])) - 1) * 100)
+    reg['close_prev'] = Indicator(
+        ('close',), 2,
+        lambda x: x['close'].shift(1),
+        lambda b, o: _previous(b['close']))
+    reg['daily_change'] = Indicator(
+        ('close', 'close_prev'), 1,
+        lambda x: (x['close'] / x['close_prev'] - 1) * 100,
+        lambda b, o: (b['close'][-1] / o['close_prev'] - 1) * 100)
+
+    # Range indicators
+    reg['adr_20'] = Indicator(
+        ('high', 'low', 'close'), 20,
+        lambda x: calc_adr(x['high'], x['low'], x['close'], 20),
+        lambda b, o: _tail_mean(_daily_range({f: b[f][-20:] for f in ('high', 'low', 'close')}), 20))
+    # Close over its 20-day average (calc_trend_intensity), reusing sma_20
+    reg['trend_intensity'] = Indicator(
+        ('close', 'sma_20'), 1,
+        lambda x: x['close'] / x['sma_20'],
+        lambda b, o: b['close'][-1] / o['sma_20'])
+
+    # Min/Max over periods
+    for period in MINMAX_PERIODS:
+        for how, calc in (('min', calc_min), ('max', calc_max)):
+            reg[f'{how}_{period}'] = Indicator(
+                ('close',), period,
+                lambda x, p=period, calc=calc: calc(x['close'], p),
+                lambda b, o, p=period, how=how: _tail_extreme(b['close'], p, how))
+
+    # Dollar volume
+    reg['dollar_volume'] = Indicator(
+        ('volume', 'close'), 1,
+        lambda x: x['volume'] * x['close'],
+        lambda b, o: b['volume'][-1] * b['close'][-1])
+    reg['avg_dollar_volume_50'] = Indicator(
+        ('dollar_volume',), 50,
+        lambda x: calc_sma(x['dollar_volume'], 50),
+        lambda b, o: _tail_mean(b['volume'][-50:] * b['close'][-50:], 50))
+    return reg
+
+
+INDICATORS = _registry()
+
+
+def required_indicators(columns: Optional[Iterable[str]] = None) -> List[str]:
+    """
+    Indicators needed to provide `columns`, with everything they are
+    computed from, in registry order. None means every indicator; names
+    that are not indicators (OHLCV fields, ticker, ...) need nothing.
+    """
+    if columns is None:
+        return list(INDICATORS)
+    needed = set()
+    pending = [name for name in columns if name in INDICATORS]
+    while pending:
+        name = pending.pop()
+        if name not in needed:
+            needed.add(name)
+            pending.extend(inp for inp in INDICATORS[name].inputs if inp in INDICATORS)
+    return [name for name in INDICATORS if name in needed]
+
+
+def lookback(name: str) -> int:
+    """Bars of history a column needs at the latest bar"""
+    if name not in INDICATORS:
+        return 1
+    indicator = INDICATORS[name]
+    return indicator.window - 1 + max(lookback(inp) for inp in indicator.inputs)
+
+
+def history_days(columns: Optional[Iterable[str]] = None, min_bars: int = 50) -> int:
+    """
+    Bars of history to fetch for `columns` (None: every indicator): the
+    longest lookback in their closure, at least min_bars and at most
+    MAX_HISTORY_DAYS
+    """
+    names = required_indicators(columns)
+    longest = max([lookback(name) for name in names] + [min_bars])
+    return min(longest, MAX_HISTORY_DAYS)
+
+
+def compute_indicators(bars: Dict[str, Frame], columns: Optional[Iterable[str]] = None) -> Dict[str, Frame]:
+    """
+    Calculate scan indicators from OHLCV fields
+    Returns {column: values} in the column order used by the scan dataset,
+    for every indicator or only those `columns` need (see required_indicators)
+    """
+    values = dict(bars)
+    out = {}
+    for name in required_indicators(columns):
+        values[name] = out[name] = INDICATORS[name].series(values)
+    return out
+
+
+def compute_latest_indicators(bars: Dict[str, np.ndarray], columns: Optional[Iterable[str]] = None) -> Dict[str, np.ndarray]:
+    """
+    Indicator values at the last row only, from bottom-aligned date x ticker
+    arrays. Each value is reduced directly from the window it needs instead
+    of computing the full time series; results match compute_indicators'
+    last row to floating point rounding.
+    """
+    out = {}
+    with np.errstate(invalid='ignore', divide='ignore'):
+        for name in required_indicators(columns):
+            out[name] = INDICATORS[name].latest(bars, out)
+    return out
+
+
+def align_panel(panel: Dict[str, pd.DataFrame]) -> Dict[str, pd.DataFrame]:
+    """
+    Bottom-align each ticker's bars so its latest bar sits in the last row
+
+    Missing dates (halts, late listings, stale tickers) are moved to the
+    top of the column as NaN, so rolling windows see exactly the bars a
+    per-ticker history would. Adds a 'date' frame with each cell's date.
+    """
+    close = panel['close']
+    dates = np.broadcast_to(close.index.values[:, None], close.shape)
+    valid = close.notna().to_numpy()
+
+    if valid.all():
+        aligned = dict(panel)
+        aligned['date'] = pd.DataFrame(dates, index=close.index, columns=close.columns)
+        return aligned
+
+    # Stable sort puts missing rows first while keeping bar order
+    order = np.argsort(valid, axis=0, kind='stable')
+    index = pd.RangeIndex(len(close))
+    aligned = {}
+    # Extra frames (relative strength, see relative_strength.py) move with the bars
+    for field in [name for name in panel if name != 'date']:
+        values = panel[field].to_numpy(dtype='float64')
+        values = np.where(valid, values, np.nan)
+        aligned[field] = pd.DataFrame(np.take_along_axis(values, order, axis=0), index=index, columns=close.columns)
+
+    date_values = np.where(valid, dates, np.datetime64('NaT'))
+    aligned['date'] = pd.DataFrame(np.take_along_axis(date_values, order, axis=0), index=index, columns=close.columns)
+    return aligned
+
+
+def unalign(values: np.ndarray, valid: np.ndarray) -> np.ndarray:
+    """
+    Inverse of align_panel for one array: move each ticker's bottom-aligned
+    rows back to the dates it has bars on (`valid`, the dated panel's
+    close.notna()). Dates without a bar get NaN, or False for masks.
+    """
+    order = np.argsort(valid, axis=0, kind='stable')
+    values = np.broadcast_to(values, valid.shape)
+    out = np.empty(valid.shape, dtype=values.dtype)
+    np.put_along_axis(out, order, values, axis=0)
+    return np.where(valid, out, False if out.dtype == bool else np.nan)
+
+
+def compute_panel_indicators(panel: Dict[str, pd.DataFrame]) -> Dict[str, pd.DataFrame]:
+    """Calculate every indicator for all tickers at once on a bottom-aligned panel"""
+    aligned = align_panel(panel)
+    out = {'date': aligned['date']}
+    out.update({field: aligned[field] for field in FIELDS})
+    out.update(compute_indicators(aligned))
+    return out
+
+
+def _latest_indicators(bars: Dict[str, np.ndarray], tail_only: bool,
+                       columns: Optional[List[str]] = None) -> Dict[str, np.ndarray]:
+    """Indicator values at the last row of bottom-aligned date x ticker arrays"""
+    if tail_only:
+        return compute_latest_indicators(bars, columns)
+    frames = {field: pd.DataFrame(values) for field, values in bars.items()}
+    return {name: frame.to_numpy()[-1] for name, frame in compute_indicators(frames, columns).items()}
+
+
+def _chunked_latest_indicators(bars: Dict[str, np.ndarray], chunk_size: int = CHUNK_TICKERS,
+                               columns: Optional[List[str]] = None) -> Dict[str, np.ndarray]:
+    """
+    Last row of the full indicator time series, computed chunk_size tickers
+    at a time so peak memory does not grow with the number of tickers
+    """
+    n_tickers = bars['close'].shape[1]
+    chunks = [
+        _latest_indicators({field: values[:, lo:lo + chunk_size] for field, values in bars.items()}, False, columns)
+        for lo in range(0, n_tickers, chunk_size)
+    ]
+    return {name: np.concatenate([chunk[name] for chunk in chunks]) for name in chunks[0]}
+
+
+def indicator_names(columns: Optional[Iterable[str]] = None) -> List[str]:
+    """Indicator columns in the order compute_indicators returns them"""
+    return required_indicators(columns)
+
+
+def _attach(spec: Tuple[str, tuple]) -> Tuple[shared_memory.SharedMemory, np.ndarray]:
+    name, shape = spec
+    shm = shared_memory.SharedMemory(name=name)
+    return shm, np.ndarray(shape, dtype=np.float64, buffer=shm.buf)
+
+
+def _compute_shard(bars_spec: Tuple[str, tuple], out_spec: Tuple[str, tuple], lo: int, hi: int, tail_only: bool,
+                   columns: Optional[List[str]] = None):
+    """Worker: latest indicators for ticker columns lo:hi, written into shared memory"""
+    bars_shm, bars = _attach(bars_spec)
+    out_shm, out = _attach(out_spec)
+    # Column-major copies, like the arrays pandas hands the single process path,
+    # so NumPy reductions sum in the same order
+    shard = {field: np.asfortranarray(bars[i, :, lo:hi]) for i, field in enumerate(FIELDS)}
+    for k, values in enumerate(_latest_indicators(shard, tail_only, columns).values()):
+        out[k, lo:hi] = values
+
+    # Views must be released before the blocks can be closed
+    del shard, bars, out
+    bars_shm.close()
+    out_shm.close()
+
+
+def sharded_latest_indicators(bars: Dict[str, np.ndarray], workers: int, tail_only: bool = False,
+                              columns: Optional[List[str]] = None) -> Dict[str, np.ndarray]:
+    """
+    _latest_indicators split across worker processes
+
+    Tickers are cut into one contiguous shard per worker. Bars go to the
+    workers through a shared memory block and each worker writes its own
+    columns of a shared result block, so nothing is pickled and the merged
+    result is in input column order regardless of which shard ends first.
+    Every indicator is computed per column, so results equal the single
+    process ones exactly.
+    """
+    names = indicator_names(columns)
+    n_rows, n_tickers = bars['close'].shape
+    bars_shape = (len(FIELDS), n_rows, n_tickers)
+    out_shape = (len(names), n_tickers)
+
+    bars_shm = shared_memory.SharedMemory(create=True, size=max(1, 8 * int(np.prod(bars_shape))))
+    out_shm = shared_memory.SharedMemory(create=True, size=max(1, 8 * int(np.prod(out_shape))))
+    try:
+        stacked = np.ndarray(bars_shape, dtype=np.float64, buffer=bars_shm.buf)
+        for i, field in enumerate(FIELDS):
+            stacked[i] = bars[field]
+        del stacked
+
+        bounds = np.linspace(0, n_tickers, workers + 1).astype(int)
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            futures = [
+                pool.submit(_compute_shard, (bars_shm.name, bars_shape), (out_shm.name, out_shape), lo, hi, tail_only, columns)
+                for lo, hi in zip(bounds[:-1], bounds[1:]) if hi > lo
+            ]
+            for future in futures:
+                future.result()
+
+        out = np.ndarray(out_shape, dtype=np.float64, buffer=out_shm.buf)
+        latest = {name: out[k].copy() for k, name in enumerate(names)}
+        del out
+        return latest
+    finally:
+        for shm in (bars_shm, out_shm):
+            try:
+                shm.close()
+            except BufferError:
+                # A view is still alive in a propagating traceback; unlink anyway
+                pass
+            shm.unlink()
+
+
+def latest_indicator_rows(panel: Dict[str, pd.DataFrame], min_bars: int = 50, tail_only: bool = False,
+                          workers: int = 1, columns: Optional[Iterable[str]] = None) -> pd.DataFrame:
+    """
+    One row per ticker with OHLCV and indicator values at its latest bar
+    Tickers with fewer than min_bars bars are dropped
+
+    tail_only computes each indicator only at the latest bar by reducing
+    its window directly (see compute_latest_indicators) instead of taking
+    the last row of full indicator time series.
+    workers > 1 shards tickers across that many processes
+    (see sharded_latest_indicators).
+    columns limits the indicators to those the given columns need
+    (see required_indicators); None computes all of them.
+    """
+    if panel['close'].empty:
+        return pd.DataFrame()
+
+    counts = panel['close'].notna().sum()
+    keep = counts.index[counts >= min_bars]
+    if keep.empty:
+        return pd.DataFrame()
+    panel = {field: frame[keep] for field, frame in panel.items()}
+
+    aligned = align_panel(panel)
+    arrays = {field: aligned[field].to_numpy(dtype='float64') for field in FIELDS}
+    latest = {'date': aligned['date'].iloc[-1].to_numpy()}
+    latest.update({field: arrays[field][-1] for field in FIELDS})
+
+    columns = list(columns) if columns is not None else None
+    workers = min(workers, len(keep))
+    if workers > 1:
+        latest.update(sharded_latest_indicators(arrays, workers, tail_only, columns))
+    elif tail_only:
+        latest.update(compute_latest_indicators(arrays, columns))
+    else:
+        latest.update(_chunked_latest_indicators(arrays, columns=columns))
+    latest = pd.DataFrame(latest, index=keep)
+
+    latest['date'] = pd.to_datetime(latest['date'])
+    latest['ticker'] = latest.index
+    return latest.reset_index(drop=True)
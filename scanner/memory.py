@@ -0,0 +1,49 @@
+"""
+Compact in-memory layout for scan datasets and memory reporting
+"""
+from typing import Dict, Union
+import pandas as pd
+
+# Identifier columns, stored as Arrow-backed strings (one shared buffer
+# instead of one Python object per value)
+STRING_COLUMNS = ['ticker', 'name']
+
+
+def compact_dataset(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Store a scan dataset's identifier columns compactly, in place
+    Numeric columns stay float64: scans compare them against thresholds,
+    where float32 rounding could flip a result.
+    """
+    for col in STRING_COLUMNS:
+        if col in df.columns:
+            df[col] = df[col].astype('string[pyarrow]')
+    return df
+
+
+def nbytes(obj: Union[pd.DataFrame, pd.Series, Dict]) -> int:
+    """Deep memory usage of a frame, series or dict of them"""
+    if isinstance(obj, dict):
+        return sum(nbytes(value) for value in obj.values())
+    if isinstance(obj, pd.DataFrame):
+        return int(obj.memory_usage(deep=True).sum())
+    if isinstance(obj, pd.Series):
+        return int(obj.memory_usage(deep=True))
+    return 0
+
+
+def memory_report(n_tickers: int, **parts) -> str:
+    """
+    One line per named part with its size and bytes per ticker, e.g.
+    memory_report(3000, dataset=df, panel=panel)
+    """
+    lines = [f"Memory ({n_tickers} tickers):"]
+    total = 0
+    for name, obj in parts.items():
+        size = obj if isinstance(obj, int) else nbytes(obj)
+        total += size
+        per_ticker = size / n_tickers if n_tickers else 0
+        lines.append(f"  {name:<16} {size / 2**20:9.1f} MB  {per_ticker:10,.0f} B/ticker")
+    per_ticker = total / n_tickers if n_tickers else 0
+    lines.append(f"  {'total':<16} {total / 2**20:9.1f} MB  {per_ticker:10,.0f} B/ticker")
+    return "\n".join(lines)
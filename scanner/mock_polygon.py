@@ -0,0 +1,363 @@
+"""
+Offline stand-in for the Polygon.io REST endpoints used by the scanner
+
+Serves synthetic (see synthetic.py) or recorded (history store) data with
+configurable latency, jitter, 429 throttling and error injection, so fetch
+concurrency, retries and caching can be measured without an API key or
+network access. Point the fetcher at it with POLYGON_BASE_URL:
+
+    python mock_polygon.py --port 8765 --tickers 3000 --latency-ms 40 --rate-limit 600
+    POLYGON_BASE_URL=http://127.0.0.1:8765 POLYGON_API_KEY=test python generate_site.py
+"""
+import argparse
+import json
+import random
+import re
+import threading
+import time
+from collections import Counter, deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Dict, Optional
+from urllib.parse import parse_qs, urlencode, urlparse
+import numpy as np
+import pandas as pd
+
+from history_store import HistoryStore
+from panel import FIELDS, bars_to_panel
+from synthetic import synthetic_panel, synthetic_universe
+from universe_store import UniverseStore
+
+RATE_LIMIT_MESSAGE = (
+    "You've exceeded the maximum requests per minute, please wait or upgrade "
+    "your subscription to continue. https://polygon.io/pricing"
+)
+
+# SIC codes handed out to synthetic listings, so sector and industry
+# groups (see relative_strength.py) have members
+SIC_CODES = [
+    ('3674', 'SEMICONDUCTORS & RELATED DEVICES'),
+    ('7372', 'SERVICES-PREPACKAGED SOFTWARE'),
+    ('2834', 'PHARMACEUTICAL PREPARATIONS'),
+    ('6022', 'STATE COMMERCIAL BANKS'),
+    ('1311', 'CRUDE PETROLEUM & NATURAL GAS'),
+    ('5961', 'RETAIL-CATALOG & MAIL-ORDER HOUSES'),
+    ('4911', 'ELECTRIC SERVICES'),
+    ('3711', 'MOTOR VEHICLES & PASSENGER CAR BODIES'),
+    ('7370', 'SERVICES-COMPUTER PROGRAMMING, DATA PROCESSING, ETC.'),
+    ('6798', 'REAL ESTATE INVESTMENT TRUSTS'),
+]
+
+# Polygon field names for each OHLCV field
+SHORT_NAMES = {'open': 'o', 'high': 'h', 'low': 'l', 'close': 'c', 'volume': 'v'}
+
+
+class MarketData:
+    """Daily bars and reference data behind the stand-in endpoints"""
+
+    def __init__(self, panel: Dict[str, pd.DataFrame], universe: pd.DataFrame):
+        self.dates = panel['close'].index
+        self.tickers = panel['close'].columns
+        self.columns = {ticker: i for i, ticker in enumerate(self.tickers)}
+        self.values = {field: panel[field].to_numpy(dtype='float64') for field in FIELDS}
+        # Daily bars are stamped at midnight New York time, like Polygon's
+        self.timestamps = self.dates.tz_localize('America/New_York').as_unit('ms').asi8.tolist()
+        self.universe = universe[universe['ticker'].isin(self.tickers)].reset_index(drop=True)
+
+    @classmethod
+    def synthetic(cls, n_tickers: int = 3000, n_days: int = 504, seed: int = 0) -> 'MarketData':
+        panel = synthetic_panel(n_tickers, n_days, seed=seed)
+        return cls(panel, synthetic_universe(panel['close'].columns.tolist(), seed=seed))
+
+    @classmethod
+    def recorded(cls, store_root: Path, universe_path: Optional[Path] = None) -> 'MarketData':
+        """Bars from a history store, with its cached universe when available"""
+        panel = bars_to_panel(HistoryStore(store_root).bars())
+        universe = UniverseStore(universe_path).load() if universe_path else None
+        if universe is None:
+            universe = synthetic_universe(panel['close'].columns.tolist())
+        return cls(panel, universe)
+
+    def _bar(self, row: int, col: int) -> Optional[dict]:
+        if np.isnan(self.values['close'][row, col]):
+            return None
+        bar = {SHORT_NAMES[field]: float(self.values[field][row, col]) for field in FIELDS}
+        bar['t'] = self.timestamps[row]
+        return bar
+
+    def aggs(self, ticker: str, start: pd.Timestamp, end: pd.Timestamp) -> list:
+        col = self.columns.get(ticker)
+        if col is None:
+            return []
+        lo, hi = self.dates.searchsorted(start), self.dates.searchsorted(end, side='right')
+        return [bar for bar in (self._bar(row, col) for row in range(lo, hi)) if bar]
+
+    def grouped(self, date: pd.Timestamp) -> list:
+        row = self.dates.searchsorted(date)
+        if row >= len(self.dates) or self.dates[row] != date:
+            return []
+        results = []
+        for ticker, col in self.columns.items():
+            bar = self._bar(row, col)
+            if bar:
+                bar['T'] = ticker
+                results.append(bar)
+        return results
+
+    def snapshot(self) -> list:
+        """Latest bar as `day` and the one before as `prevDay` for every ticker"""
+        updated = int(pd.Timestamp(self.dates[-1]).tz_localize('America/New_York').value) + 16 * 3600 * 10**9
+        results = []
+        for ticker, col in self.columns.items():
+            valid = np.flatnonzero(~np.isnan(self.values['close'][:, col]))
+            if len(valid) == 0:
+                continue
+            day = self._bar(valid[-1], col) if valid[-1] == len(self.dates) - 1 else None
+            prev = self._bar(valid[-2], col) if len(valid) > 1 else None
+            empty = {key: 0 for key in SHORT_NAMES.values()}
+            results.append({'ticker': ticker, 'day': day or empty, 'prevDay': prev or empty, 'updated': updated})
+        return results
+
+    def details(self, ticker: str) -> Optional[dict]:
+        rows = self.universe[self.universe['ticker'] == ticker]
+        if rows.empty:
+            return None
+        row = rows.iloc[0]
+        col = self.columns[ticker]
+        close = self.values['close'][:, col]
+        last_close = float(close[~np.isnan(close)][-1])
+        shares = 10**6 * (1 + col % 500)
+        sic_code, sic_description = SIC_CODES[col % len(SIC_CODES)]
+        return {
+            'ticker': ticker,
+            'name': str(row['name']),
+            'market': str(row['market']),
+            'locale': str(row['locale']),
+            'type': str(row['type']),
+            'primary_exchange': str(row['primary_exchange']),
+            'active': True,
+            'market_cap': last_close * shares,
+            'share_class_shares_outstanding': shares,
+            'description': f"Synthetic listing {ticker}",
+            'sic_code': sic_code,
+            'sic_description': sic_description,
+            'homepage_url': '',
+        }
+
+    def list_tickers(self, params: Dict[str, str]) -> pd.DataFrame:
+        """Universe rows matching list_tickers filters, sorted as requested"""
+        df = self.universe
+        active = params.get('active', 'true') == 'true'
+        df = df[df['active'] == active]
+        if 'ticker' in params:
+            df = df[df['ticker'] == params['ticker']]
+        for op, compare in (('lt', '__lt__'), ('lte', '__le__'), ('gt', '__gt__'), ('gte', '__ge__')):
+            if f'ticker.{op}' in params:
+                df = df[getattr(df['ticker'], compare)(params[f'ticker.{op}'])]
+        for field in ('market', 'type'):
+            if field in params:
+                df = df[df[field] == params[field]]
+        sort = params.get('sort', 'ticker')
+        if sort in df.columns:
+            df = df.sort_values([sort, 'ticker'], ascending=params.get('order', 'asc') != 'desc', kind='stable')
+        return df
+
+
+class MockPolygonServer:
+    """
+    Threaded HTTP server answering Polygon REST requests from MarketData
+
+    Faults are applied to every request in order: latency (+/- jitter),
+    HTTP 429 once more than rate_limit requests arrived in the last minute,
+    then HTTP 500 with probability error_rate.
+    """
+
+    def __init__(self, market: MarketData, host: str = "127.0.0.1", port: int = 0,
+                 latency_ms: float = 0.0, jitter_ms: float = 0.0, rate_limit: Optional[int] = None,
+                 error_rate: float = 0.0, page_size: int = 1000, seed: int = 0):
+        self.market = market
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.rate_limit = rate_limit
+        self.error_rate = error_rate
+        self.page_size = page_size
+
+        self.stats = Counter()
+        self._random = random.Random(seed)
+        self._recent = deque()
+        self._lock = threading.Lock()
+        self._thread = None
+
+        handler = type('Handler', (_Handler,), {'mock': self})
+        self.httpd = ThreadingHTTPServer((host, port), handler)
+        self.httpd.daemon_threads = True
+
+    @property
+    def url(self) -> str:
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self) -> 'MockPolygonServer':
+        """Serve on a background thread"""
+        self._thread = threading.Thread(target=self.httpd.serve_forever, name="mock-polygon", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def count(self, *keys: str):
+        with self._lock:
+            self.stats.update(keys)
+
+    def fault(self) -> Optional[int]:
+        """Apply latency and pick an injected status code, if any"""
+        with self._lock:
+            delay = self.latency_ms + self._random.uniform(-self.jitter_ms, self.jitter_ms)
+            fail = self._random.random() < self.error_rate
+            throttled = False
+            if self.rate_limit is not None:
+                now = time.monotonic()
+                while self._recent and now - self._recent[0] > 60:
+                    self._recent.popleft()
+                throttled = len(self._recent) >= self.rate_limit
+                if not throttled:
+                    self._recent.append(now)
+
+        if delay > 0:
+            time.sleep(delay / 1000)
+        if throttled:
+            return 429
+        if fail:
+            return 500
+        return None
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    mock: MockPolygonServer = None
+
+    ROUTES = [
+        ('tickers', re.compile(r'^/v3/reference/tickers$')),
+        ('details', re.compile(r'^/v3/reference/tickers/(?P<ticker>[^/]+)$')),
+        ('aggs', re.compile(r'^/v2/aggs/ticker/(?P<ticker>[^/]+)/range/1/day/(?P<start>[^/]+)/(?P<end>[^/]+)$')),
+        ('grouped', re.compile(r'^/v2/aggs/grouped/locale/us/market/stocks/(?P<date>[^/]+)$')),
+        ('snapshot', re.compile(r'^/v2/snapshot/locale/us/markets/stocks/tickers$')),
+    ]
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send(self, status: int, body: dict):
+        data = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        mock = self.mock
+        url = urlparse(self.path)
+        params = {key: values[-1] for key, values in parse_qs(url.query).items()}
+
+        for endpoint, pattern in self.ROUTES:
+            match = pattern.match(url.path)
+            if match:
+                break
+        else:
+            mock.count('not_found')
+            return self._send(404, {'status': 'NOT_FOUND', 'message': f'Unknown path {url.path}'})
+
+        mock.count('requests', endpoint)
+        status = mock.fault()
+        if status == 429:
+            mock.count('throttled')
+            return self._send(429, {'status': 'ERROR', 'error': RATE_LIMIT_MESSAGE})
+        if status == 500:
+            mock.count('errors')
+            return self._send(500, {'status': 'ERROR', 'error': 'Internal server error (injected)'})
+
+        args = match.groupdict()
+        if endpoint == 'tickers':
+            self._send(200, self._list_tickers(params))
+        elif endpoint == 'details':
+            details = mock.market.details(args['ticker'])
+            if details is None:
+                return self._send(404, {'status': 'NOT_FOUND', 'message': 'Ticker not found.'})
+            self._send(200, {'status': 'OK', 'results': details})
+        elif endpoint == 'aggs':
+            results = mock.market.aggs(args['ticker'], _to_date(args['start']), _to_date(args['end']))
+            self._send(200, {'ticker': args['ticker'], 'status': 'OK', 'adjusted': True,
+                             'resultsCount': len(results), 'results': results})
+        elif endpoint == 'grouped':
+            results = mock.market.grouped(_to_date(args['date']))
+            self._send(200, {'status': 'OK', 'adjusted': True, 'resultsCount': len(results), 'results': results})
+        else:
+            self._send(200, {'status': 'OK', 'tickers': mock.market.snapshot()})
+
+    def _list_tickers(self, params: Dict[str, str]) -> dict:
+        mock = self.mock
+        offset = int(params.pop('cursor', 0))
+        limit = min(int(params.get('limit', 100)), mock.page_size)
+        rows = mock.market.list_tickers(params)
+        page = rows.iloc[offset:offset + limit]
+
+        results = []
+        for row in page.itertuples(index=False):
+            result = {
+                'ticker': row.ticker, 'name': row.name, 'market': row.market, 'locale': row.locale,
+                'type': row.type, 'primary_exchange': row.primary_exchange, 'active': bool(row.active),
+                'currency_name': 'usd',
+            }
+            if pd.notna(row.last_updated_utc):
+                result['last_updated_utc'] = pd.Timestamp(row.last_updated_utc).strftime('%Y-%m-%dT%H:%M:%SZ')
+            results.append(result)
+
+        body = {'status': 'OK', 'count': len(results), 'results': results}
+        if offset + limit < len(rows):
+            query = urlencode({**params, 'cursor': offset + limit})
+            body['next_url'] = f"{mock.url}/v3/reference/tickers?{query}"
+        return body
+
+
+def _to_date(value: str) -> pd.Timestamp:
+    """Path dates are YYYY-MM-DD or millisecond timestamps"""
+    if value.isdigit():
+        return pd.to_datetime(int(value), unit='ms').normalize()
+    return pd.Timestamp(value)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Offline stand-in for the Polygon.io REST API")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--tickers", type=int, default=3000, help="synthetic tickers")
+    parser.add_argument("--days", type=int, default=504, help="synthetic trading days")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--store", help="serve bars recorded in this history store instead")
+    parser.add_argument("--latency-ms", type=float, default=0.0)
+    parser.add_argument("--jitter-ms", type=float, default=0.0)
+    parser.add_argument("--rate-limit", type=int, help="requests per minute before HTTP 429")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of requests failing with HTTP 500")
+    args = parser.parse_args()
+
+    if args.store:
+        market = MarketData.recorded(Path(args.store), Path(args.store).parent / "ticker_universe.parquet")
+    else:
+        market = MarketData.synthetic(args.tickers, args.days, seed=args.seed)
+
+    server = MockPolygonServer(
+        market, args.host, args.port,
+        latency_ms=args.latency_ms, jitter_ms=args.jitter_ms,
+        rate_limit=args.rate_limit, error_rate=args.error_rate, seed=args.seed,
+    )
+    print(f"Serving {len(market.tickers)} tickers x {len(market.dates)} days on {server.url}")
+    try:
+        server.httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.stop()
+        print(dict(server.stats))
@@ -0,0 +1,69 @@
+"""
+Date x ticker price panels for whole-market processing
+A panel is a dict of {field: DataFrame} with dates as the index and
+tickers as the columns, one frame per OHLCV field
+"""
+from typing import Dict, Iterable, Optional
+import pandas as pd
+
+FIELDS = ['open', 'high', 'low', 'close', 'volume']
+
+
+def bars_to_panel(bars: pd.DataFrame) -> Dict[str, pd.DataFrame]:
+    """
+    Pivot long-format bars (date, ticker, open, high, low, close, volume)
+    into a date x ticker panel
+    """
+    if bars.empty:
+        return {field: pd.DataFrame() for field in FIELDS}
+
+    bars = bars.drop_duplicates(subset=['date', 'ticker'], keep='last')
+    panel = {}
+    for field in FIELDS:
+        frame = bars.pivot(index='date', columns='ticker', values=field).sort_index()
+        frame.index.name = 'date'
+        frame.columns.name = None
+        panel[field] = frame
+    return panel
+
+
+def histories_to_panel(histories: Dict[str, pd.DataFrame]) -> Dict[str, pd.DataFrame]:
+    """Combine per-ticker histories (fetch_aggregates format) into a panel"""
+    frames = [hist.assign(ticker=ticker) for ticker, hist in histories.items() if not hist.empty]
+    if not frames:
+        return bars_to_panel(pd.DataFrame())
+    return bars_to_panel(pd.concat(frames, ignore_index=True))
+
+
+def panel_tickers(panel: Dict[str, pd.DataFrame]) -> list:
+    """Tickers present in the panel"""
+    return panel['close'].columns.tolist()
+
+
+def ticker_history(panel: Dict[str, pd.DataFrame], ticker: str, days: Optional[int] = None) -> pd.DataFrame:
+    """
+    Extract one ticker's history from a panel in the same shape as
+    PolygonDataFetcher.fetch_aggregates (date, open, high, low, close, volume)
+    """
+    if ticker not in panel['close'].columns:
+        return pd.DataFrame()
+
+    df = pd.DataFrame({field: panel[field][ticker] for field in FIELDS})
+    df = df.dropna(subset=['close']).rename_axis('date').reset_index()
+    if days is not None:
+        df = df.tail(days).reset_index(drop=True)
+    return df
+
+
+def select_tickers(panel: Dict[str, pd.DataFrame], tickers: Iterable[str]) -> Dict[str, pd.DataFrame]:
+    """Restrict a panel to the given tickers, keeping their order"""
+    columns = [t for t in tickers if t in panel['close'].columns]
+    return {field: frame[columns] for field, frame in panel.items()}
+
+
+def tail_bars(panel: Dict[str, pd.DataFrame], bars: int) -> Dict[str, pd.DataFrame]:
+    """Keep each ticker's last `bars` bars, like tail(bars) on its history"""
+    valid = panel['close'].notna()
+    keep = valid & (valid[::-1].cumsum()[::-1] <= bars)
+    rows = keep.any(axis=1)
+    return {field: frame.where(keep)[rows] for field, frame in panel.items()}
@@ -0,0 +1,182 @@
+"""
+Rate limiting and throughput control for Polygon.io API calls
+"""
+import random
+import re
+import threading
+import time
+from collections import Counter, defaultdict
+from contextvars import ContextVar
+from typing import Callable, Dict, List, Optional
+
+# Requests per second (None = no limit), burst size, default in-flight
+# requests, how many tickers a run scans and how many ticker details
+# (sector/industry for relative strength) a run may fetch on each plan
+PLAN_PROFILES = {
+    "free": {"rate": 5 / 60, "burst": 5, "max_workers": 1, "max_tickers": 500, "details_per_run": 5},
+    "paid": {"rate": None, "burst": None, "max_workers": 10, "max_tickers": 3000, "details_per_run": 250},
+}
+
+
+# Run report stage API calls are attributed to (see RunReport.stage). It is
+# per context rather than global, so calls on a background thread or in an
+# overlapping stage are not counted in whichever stage happens to be open;
+# worker threads get their caller's stage by running in a copy of its context.
+api_stage: ContextVar[Optional[str]] = ContextVar('api_stage', default=None)
+
+# How a 429 shows up in error messages: Polygon's error body, urllib3's
+# retry error and "status 429" style messages. A bare "429" is not enough,
+# since tickers, dates and URLs can contain it.
+RATE_LIMIT_PATTERN = re.compile(
+    r"too many requests|exceeded the maximum requests|too many 429 error responses|\bstatus(?: code)?[ :=]*429\b",
+    re.IGNORECASE,
+)
+
+
+def is_rate_limited(error: Exception) -> bool:
+    """True if an API error was an HTTP 429 / too-many-requests response"""
+    status = getattr(error, 'status', None)
+    if status is None:
+        status = getattr(getattr(error, 'response', None), 'status', None)
+    if status is not None:
+        return status == 429
+    return RATE_LIMIT_PATTERN.search(str(error)) is not None
+
+
+class TokenBucket:
+    """Token bucket allowing `rate` requests per second with bursts of `capacity`"""
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """Block until a token is available and take it"""
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+class AdaptiveConcurrency:
+    """
+    Additive-increase / multiplicative-decrease cap on in-flight requests
+    Halves the limit on every throttled response and raises it by one
+    after `limit` consecutive successes, up to max_limit
+    """
+
+    def __init__(self, max_limit: int, min_limit: int = 1):
+        self.max_limit = max(1, max_limit)
+        self.min_limit = max(1, min(min_limit, self.max_limit))
+        self.limit = self.max_limit
+        self.in_flight = 0
+        self._successes = 0
+        self._cond = threading.Condition()
+
+    def __enter__(self):
+        with self._cond:
+            while self.in_flight >= self.limit:
+                self._cond.wait()
+            self.in_flight += 1
+        return self
+
+    def __exit__(self, *exc):
+        with self._cond:
+            self.in_flight -= 1
+            self._cond.notify_all()
+
+    def record_success(self):
+        with self._cond:
+            self._successes += 1
+            if self._successes >= self.limit and self.limit < self.max_limit:
+                self.limit += 1
+                self._successes = 0
+                self._cond.notify_all()
+
+    def record_throttle(self):
+        with self._cond:
+            self.limit = max(self.min_limit, self.limit // 2)
+            self._successes = 0
+
+
+class RateController:
+    """
+    Throughput controller wrapping every Polygon API call
+    Combines a plan-level token bucket, an adaptive concurrency cap and
+    exponential backoff with jitter on 429 responses
+    """
+
+    def __init__(self, plan: str = "paid", max_workers: Optional[int] = None,
+                 max_retries: int = 6, base_delay: float = 1.0, max_delay: float = 60.0):
+        if plan not in PLAN_PROFILES:
+            raise ValueError(f"Unknown Polygon plan: {plan} (expected one of {', '.join(PLAN_PROFILES)})")
+
+        self.plan = plan
+        self.profile = PLAN_PROFILES[plan]
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+        rate = self.profile['rate']
+        self.bucket = TokenBucket(rate, self.profile['burst']) if rate else None
+        self.concurrency = AdaptiveConcurrency(max_workers or self.profile['max_workers'])
+
+        self.calls = 0
+        self.throttled = 0
+        # Duration of every attempt in seconds, in completion order
+        self.latencies: List[float] = []
+        # The same per api_stage, and throttled responses per stage
+        self.stage_latencies: Dict[Optional[str], List[float]] = defaultdict(list)
+        self.stage_throttled: Counter = Counter()
+        self._stats_lock = threading.Lock()
+
+    def call(self, func: Callable, *args, **kwargs):
+        """Call func(*args, **kwargs), retrying with backoff while rate limited"""
+        for attempt in range(self.max_retries + 1):
+            with self.concurrency:
+                if self.bucket is not None:
+                    self.bucket.acquire()
+                with self._stats_lock:
+                    self.calls += 1
+                start = time.perf_counter()
+                try:
+                    result = func(*args, **kwargs)
+                except Exception as e:
+                    self._record_latency(start)
+                    if not is_rate_limited(e) or attempt == self.max_retries:
+                        raise
+                    with self._stats_lock:
+                        self.throttled += 1
+                        self.stage_throttled[api_stage.get()] += 1
+                    self.concurrency.record_throttle()
+                else:
+                    self._record_latency(start)
+                    self.concurrency.record_success()
+                    return result
+
+            # Back off outside the concurrency slot so other calls can proceed
+            delay = min(self.max_delay, self.base_delay * 2 ** attempt)
+            time.sleep(delay * random.uniform(0.5, 1.0))
+
+    def stage_stats(self) -> Dict[Optional[str], Dict]:
+        """Latencies and throttled count of the calls made under each api_stage so far"""
+        with self._stats_lock:
+            return {
+                stage: {'latencies': list(latencies), 'throttled': self.stage_throttled[stage]}
+                for stage, latencies in self.stage_latencies.items()
+            }
+
+    def _record_latency(self, start: float):
+        latency = time.perf_counter() - start
+        with self._stats_lock:
+            self.latencies.append(latency)
+            self.stage_latencies[api_stage.get()].append(latency)
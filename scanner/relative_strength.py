@@ -0,0 +1,203 @@
+"""
+Cross-sectional relative strength
+Ranks every ticker against the rest of the universe at every date, as
+batch operations on the price panel: IBD-style weighted quarterly returns
+and their percentile ranks, sector and industry group ranks, StockCharts'
+SCTR, and the RS line against a benchmark. The results are date x ticker
+frames added to the panel, so string queries read them like OHLCV fields
+(ibd_rs_rank>70, rs=max(5,rs)) and the dataset gets their latest values.
+"""
+from typing import Dict, Optional
+import numpy as np
+import pandas as pd
+
+from indicators import align_panel, calc_ema, unalign
+
+# Return horizons in bars and their weights in the IBD RS score: the latest
+# quarter counts double
+RS_WEIGHTS = {63: 0.4, 126: 0.2, 189: 0.2, 252: 0.2}
+
+# Bars the full score needs (a return over 252 bars reads 253 closes)
+RS_LOOKBACK = max(RS_WEIGHTS) + 1
+
+# Group kinds ranked, by the prefix of their fields
+GROUPS = {'sect': 'sector', 'industry': 'industry'}
+
+# SIC divisions used as sectors, by the first two digits of the SIC code
+# they start at (industries are the SIC descriptions themselves)
+SIC_DIVISIONS = [
+    (1, 'Agriculture, Forestry and Fishing'),
+    (10, 'Mining'),
+    (15, 'Construction'),
+    (20, 'Manufacturing'),
+    (40, 'Transportation and Public Utilities'),
+    (50, 'Wholesale Trade'),
+    (52, 'Retail Trade'),
+    (60, 'Finance, Insurance and Real Estate'),
+    (70, 'Services'),
+    (91, 'Public Administration'),
+]
+
+# Fields that need sector/industry labels
+GROUP_FIELDS = [f'ibd_{prefix}_rs{horizon}_rank' for prefix in GROUPS for horizon in ('', '_3m')]
+
+# Panel fields computed here
+RS_FIELDS = ['ibd_rs', 'ibd_rs_rank', 'ibd_rs_3m', 'ibd_rs_3m_rank', 'rs', 'sctr'] + GROUP_FIELDS
+
+
+def sic_sector(sic_code) -> Optional[str]:
+    """SIC division of a SIC code ('3674' -> 'Manufacturing'), None if unknown"""
+    try:
+        major = int(str(sic_code)[:2])
+    except (TypeError, ValueError):
+        return None
+    sector = None
+    for start, name in SIC_DIVISIONS:
+        if major >= start:
+            sector = name
+    return sector
+
+
+def _lag(values: np.ndarray, bars: int) -> np.ndarray:
+    out = np.full(values.shape, np.nan)
+    out[bars:] = values[:-bars]
+    return out
+
+
+def _returns(close: np.ndarray, bars: int) -> np.ndarray:
+    """Percent change over `bars` bars of bottom-aligned closes"""
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return (close / _lag(close, bars) - 1) * 100
+
+
+def _rank_fraction(values: np.ndarray) -> np.ndarray:
+    """Rank of each value in its row (one date) over the row's count, NaN not counted"""
+    return pd.DataFrame(values).rank(axis=1, pct=True).to_numpy()
+
+
+def percentile_rank(values: np.ndarray) -> np.ndarray:
+    """
+    Percentile of each value among the values in its row, 1 to 99 with
+    the best value at 99 (IBD's scale); NaN stays NaN
+    """
+    ranks = _rank_fraction(values)
+    return np.where(np.isnan(ranks), np.nan, np.maximum(np.ceil(ranks * 99), 1))
+
+
+def group_rank(values: np.ndarray, groups: pd.Series) -> np.ndarray:
+    """
+    Percentile rank (1-99) of each ticker's group among all groups at each
+    date, groups scored by the mean value of their members. `groups` holds
+    one label per column; tickers without a label get NaN.
+    """
+    codes, labels = pd.factorize(groups)
+    out = np.full(values.shape, np.nan)
+    if len(labels) == 0:
+        return out
+
+    # Sort columns by group so each group's members are one contiguous block
+    order = np.argsort(codes, kind='stable')
+    sorted_codes = codes[order]
+    known = sorted_codes >= 0
+    order, sorted_codes = order[known], sorted_codes[known]
+    starts = np.flatnonzero(np.r_[True, np.diff(sorted_codes) != 0])
+
+    members = values[:, order]
+    present = ~np.isnan(members)
+    sums = np.add.reduceat(np.where(present, members, 0.0), starts, axis=1)
+    counts = np.add.reduceat(present, starts, axis=1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        means = np.where(counts > 0, sums / counts, np.nan)
+
+    ranks = percentile_rank(means)
+    out[:, codes >= 0] = ranks[:, np.searchsorted(sorted_codes[starts], codes[codes >= 0])]
+    return out
+
+
+def ibd_rs_score(close: np.ndarray) -> np.ndarray:
+    """
+    Weighted return over the last four quarters of bottom-aligned closes
+    Quarters without enough history are left out and the other weights
+    scaled up, as IBD does for recent listings; NaN until the first quarter.
+    """
+    total = np.zeros(close.shape)
+    weights = np.zeros(close.shape)
+    for bars, weight in RS_WEIGHTS.items():
+        change = _returns(close, bars)
+        known = ~np.isnan(change)
+        total += np.where(known, change * weight, 0.0)
+        weights += np.where(known, weight, 0.0)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.where(weights > 0, total / weights, np.nan)
+
+
+def sctr_score(close: pd.DataFrame) -> np.ndarray:
+    """
+    StockCharts Technical Rank score of bottom-aligned closes, before ranking
+
+    Long term (60%): percent above the 200-day EMA and the 125-day ROC.
+    Medium term (30%): percent above the 50-day EMA and the 20-day ROC.
+    Short term (10%): 3-day slope of the PPO(12,26,9) histogram, clamped to
+    +/-1 and mapped to 0-100, and the 14-day RSI.
+    """
+    values = close.to_numpy(dtype='float64')
+    ema = {period: calc_ema(close, period).to_numpy() for period in (12, 26, 50, 200)}
+    with np.errstate(divide='ignore', invalid='ignore'):
+        above_200 = (values / ema[200] - 1) * 100
+        above_50 = (values / ema[50] - 1) * 100
+        ppo = (ema[12] - ema[26]) / ema[26] * 100
+        histogram = ppo - calc_ema(pd.DataFrame(ppo), 9).to_numpy()
+        slope = (histogram - _lag(histogram, 3)) / 3
+
+        # Wilder's smoothing over 14 bars is an EMA with span 27
+        change = close.diff()
+        gain = calc_ema(change.clip(lower=0), 27).to_numpy()
+        loss = calc_ema(-change.clip(upper=0), 27).to_numpy()
+        rsi = 100 - 100 / (1 + gain / loss)
+
+        return (0.3 * above_200 + 0.3 * _returns(values, 125)
+                + 0.15 * above_50 + 0.15 * _returns(values, 20)
+                + 0.05 * (np.clip(slope, -1, 1) + 1) * 50 + 0.05 * rsi)
+
+
+def relative_strength(panel: Dict[str, pd.DataFrame], benchmark: Optional[pd.Series] = None,
+                      groups: Optional[pd.DataFrame] = None) -> Dict[str, pd.DataFrame]:
+    """
+    Relative strength fields (RS_FIELDS) of a dated price panel
+
+    Returns are measured over each ticker's own bars, then ranked across
+    the tickers that have a bar on each date. benchmark (closes by date)
+    gives the RS line, rs = 100 * close / benchmark close. groups has a
+    'sector' and an 'industry' label per ticker. Fields that cannot be
+    computed without them are all NaN.
+    """
+    close = panel['close']
+    valid = close.notna().to_numpy()
+    aligned = align_panel({'close': close})['close']
+
+    score = unalign(ibd_rs_score(aligned.to_numpy(dtype='float64')), valid)
+    quarter = unalign(_returns(aligned.to_numpy(dtype='float64'), 63), valid)
+    fields = {
+        'ibd_rs': score,
+        'ibd_rs_rank': percentile_rank(score),
+        'ibd_rs_3m': quarter,
+        'ibd_rs_3m_rank': percentile_rank(quarter),
+        # StockCharts ranks from 0 to 99.9
+        'sctr': np.round(_rank_fraction(unalign(sctr_score(aligned), valid)) * 99.9, 1),
+    }
+
+    if benchmark is not None:
+        base = benchmark.reindex(close.index).ffill().to_numpy(dtype='float64')
+        with np.errstate(divide='ignore', invalid='ignore'):
+            fields['rs'] = close.to_numpy(dtype='float64') / base[:, None] * 100
+    else:
+        fields['rs'] = np.full(valid.shape, np.nan)
+
+    for prefix, kind in GROUPS.items():
+        labels = groups[kind].reindex(close.columns) if groups is not None and kind in groups else None
+        for suffix, values in (('', score), ('_3m', quarter)):
+            fields[f'ibd_{prefix}_rs{suffix}_rank'] = (
+                group_rank(values, labels) if labels is not None else np.full(valid.shape, np.nan)
+            )
+
+    return {name: pd.DataFrame(fields[name], index=close.index, columns=close.columns) for name in RS_FIELDS}
@@ -0,0 +1,144 @@
+"""
+Stored scan results by trading date
+Each date's hits are kept as integer ids plus rank in one small Parquet
+file, so comparing today with the previous trading day reads two files
+however many years of results have accumulated.
+"""
+import json
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+# (guru, scan) -> tickers in result order
+Hits = Dict[Tuple[str, str], List[str]]
+
+
+def scan_key(guru_name: str, scan_name: str) -> str:
+    return f"{guru_name}|{scan_name}"
+
+
+class ResultStore:
+    """
+    Per-date scan hits
+
+    Layout:
+        root/ids.json                   ticker and scan ids (append-only)
+        root/date=YYYY-MM-DD.parquet    scan, ticker, rank (int32, int32, int16)
+
+    Each date file also lists the scans that ran that day in its schema
+    metadata, so a scan with no hits is told apart from one that did not run.
+    """
+
+    def __init__(self, root: Path):
+        self.root = Path(root)
+        self._ids: Optional[Dict[str, List[str]]] = None
+
+    @property
+    def ids_path(self) -> Path:
+        return self.root / "ids.json"
+
+    def _load_ids(self) -> Dict[str, List[str]]:
+        if self._ids is None:
+            self._ids = {'tickers': [], 'scans': []}
+            if self.ids_path.exists():
+                with open(self.ids_path) as f:
+                    self._ids.update(json.load(f))
+        return self._ids
+
+    def _encode(self, kind: str, names: List[str]) -> np.ndarray:
+        """Ids of names, assigning new ids to names not seen before"""
+        known = self._load_ids()[kind]
+        index = {name: i for i, name in enumerate(known)}
+        for name in names:
+            if name not in index:
+                index[name] = len(known)
+                known.append(name)
+        return np.array([index[name] for name in names], dtype=np.int32)
+
+    def _path(self, date: str) -> Path:
+        return self.root / f"date={date}.parquet"
+
+    def dates(self) -> List[str]:
+        """Stored dates, oldest first"""
+        return sorted(path.stem[len("date="):] for path in self.root.glob("date=*.parquet"))
+
+    def previous_date(self, date: str) -> Optional[str]:
+        earlier = [d for d in self.dates() if d < date]
+        return earlier[-1] if earlier else None
+
+    def put(self, date: str, hits: Hits) -> pd.DataFrame:
+        """Store a date's hits, replacing any stored for that date; returns them as ids"""
+        self.root.mkdir(parents=True, exist_ok=True)
+        scan_ids = self._encode('scans', [scan_key(*key) for key in hits])
+        sizes = [len(ranked) for ranked in hits.values()]
+
+        table = pa.table({
+            'scan': np.repeat(scan_ids, sizes).astype(np.int32),
+            'ticker': self._encode('tickers', [ticker for ranked in hits.values() for ticker in ranked]),
+            'rank': np.concatenate([np.arange(1, size + 1) for size in sizes] or [[]]).astype(np.int16),
+        })
+        table = table.replace_schema_metadata({'scans': json.dumps(scan_ids.tolist())})
+
+        # ids first: a date file never refers to ids that were not saved
+        tmp = self.ids_path.with_suffix('.tmp')
+        with open(tmp, 'w') as f:
+            json.dump(self._ids, f)
+        tmp.replace(self.ids_path)
+        pq.write_table(table, self._path(date))
+        return table.to_pandas()
+
+    def get(self, date: str) -> Tuple[pd.DataFrame, set]:
+        """A date's hits (scan, ticker, rank as ids) and the ids of the scans that ran"""
+        table = pq.read_table(self._path(date))
+        ran = set(json.loads(table.schema.metadata[b'scans']))
+        return table.to_pandas(), ran
+
+    def changes(self, date: str, hits: Hits) -> Dict[Tuple[str, str], Dict]:
+        """
+        Store a date's hits and compare them with the previous stored date
+
+        Returns {(guru, scan): {'previous_date', 'new', 'dropped', 'rank_change'}}
+        for scans that also ran on the previous date: new and dropped tickers
+        in rank order and {ticker: rank change} for tickers on both lists.
+        """
+        today = self.put(date, hits)
+        previous_date = self.previous_date(date)
+        if previous_date is None:
+            return {}
+
+        previous, ran_previous = self.get(previous_date)
+        changes = diff_hits(today, previous)
+        changes['ticker'] = np.array(self._ids['tickers'], dtype=object)[changes['ticker'].to_numpy()]
+        by_scan = dict(tuple(changes.groupby('scan')))
+
+        out = {}
+        for key, scan_id in zip(hits, self._encode('scans', [scan_key(*key) for key in hits])):
+            if scan_id not in ran_previous:
+                continue
+            rows = by_scan.get(scan_id, changes.iloc[:0])
+            held = rows[rows['status'] == 'held']
+            out[key] = {
+                'previous_date': previous_date,
+                'new': rows[rows['status'] == 'new'].sort_values('rank_today')['ticker'].tolist(),
+                'dropped': rows[rows['status'] == 'dropped'].sort_values('rank_previous')['ticker'].tolist(),
+                'rank_change': dict(zip(held['ticker'], held['rank_change'].astype(int).tolist())),
+            }
+        return out
+
+
+def diff_hits(today: pd.DataFrame, previous: pd.DataFrame) -> pd.DataFrame:
+    """
+    Entries, exits and rank changes between two days of hits (as ids)
+
+    Returns one row per (scan, ticker) in either day with rank_today,
+    rank_previous and status: 'new', 'dropped' or 'held'. rank_change is
+    positive when a ticker moved up the list.
+    """
+    merged = today.merge(previous, on=['scan', 'ticker'], how='outer',
+                         suffixes=('_today', '_previous'), indicator=True)
+    merged['status'] = merged['_merge'].map({'left_only': 'new', 'right_only': 'dropped', 'both': 'held'}).astype(str)
+    merged['rank_change'] = merged['rank_previous'] - merged['rank_today']
+    return merged.drop(columns='_merge')
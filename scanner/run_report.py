@@ -0,0 +1,159 @@
+"""
+Per-stage run instrumentation
+Records wall and CPU time, peak RSS, Polygon API calls with a latency
+histogram and bytes written for each stage of a run
+"""
+import json
+import sys
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Dict, List, Optional
+import numpy as np
+
+from rate_limit import api_stage
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+# Stage name for API calls made outside any stage
+UNSTAGED = "unstaged"
+
+# Upper bounds (ms) of the API latency histogram buckets
+LATENCY_BUCKETS_MS = [25, 50, 100, 250, 500, 1000, 2500, 5000, 10000]
+
+
+def latency_histogram(latencies: List[float]) -> Dict[str, int]:
+    """Counts of latencies (seconds) per bucket, labelled by upper bound in ms"""
+    labels = [f"<{bound}" for bound in LATENCY_BUCKETS_MS] + [f">={LATENCY_BUCKETS_MS[-1]}"]
+    counts = [0] * len(labels)
+    for latency in latencies:
+        counts[bisect_left(LATENCY_BUCKETS_MS, latency * 1000)] += 1
+    return dict(zip(labels, counts))
+
+
+def peak_rss_mb() -> Optional[float]:
+    """High-water mark of this process's resident memory"""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # KiB on Linux, bytes on macOS
+    return peak / 2**20 if sys.platform == "darwin" else peak / 2**10
+
+
+def child_cpu_seconds() -> float:
+    """CPU time of finished child processes (indicator workers)"""
+    if resource is None:
+        return 0.0
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return usage.ru_utime + usage.ru_stime
+
+
+def bytes_written() -> Optional[int]:
+    """Bytes this process has passed to write calls so far (Linux only)"""
+    try:
+        with open("/proc/self/io", "r") as f:
+            for line in f:
+                if line.startswith("wchar:"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return None
+
+
+class RunReport:
+    """
+    Stage timings and resource use for one run
+    Stages are entered with `with report.stage(name):`; entering a stage
+    again adds to its totals, so per-item stages can wrap each item.
+    """
+
+    def __init__(self, rate=None):
+        # RateController whose calls and latencies are attributed to stages
+        self.rate = rate
+        self.started_at = datetime.now(timezone.utc)
+        self.stages: Dict[str, Dict] = {}
+        self.info: Dict = {}
+
+    @contextmanager
+    def stage(self, name: str):
+        # API calls are counted by the RateController under the stage set here
+        token = api_stage.set(name)
+        wall = time.perf_counter()
+        cpu = time.process_time() + child_cpu_seconds()
+        written = bytes_written()
+        try:
+            yield
+        finally:
+            api_stage.reset(token)
+            record = self._record(name)
+            record['wall_s'] += time.perf_counter() - wall
+            record['cpu_s'] += time.process_time() + child_cpu_seconds() - cpu
+            record['peak_rss_mb'] = peak_rss_mb()
+            if written is not None:
+                record['bytes_written'] = (record['bytes_written'] or 0) + bytes_written() - written
+
+    def _record(self, name: str) -> Dict:
+        return self.stages.setdefault(name, {'wall_s': 0.0, 'cpu_s': 0.0, 'peak_rss_mb': None, 'bytes_written': None})
+
+    def to_dict(self) -> Dict:
+        # Calls made outside any timed stage (e.g. the background universe
+        # refresh) are listed as stages of their own with no timings
+        api = self.rate.stage_stats() if self.rate is not None else {}
+        for name in api:
+            self._record(name or UNSTAGED)
+
+        stages = []
+        for name, record in self.stages.items():
+            calls = api.get(None if name == UNSTAGED else name, {'latencies': [], 'throttled': 0})
+            latencies = calls['latencies']
+            stages.append({
+                'name': name,
+                'wall_s': round(record['wall_s'], 4),
+                'cpu_s': round(record['cpu_s'], 4),
+                'peak_rss_mb': round(record['peak_rss_mb'], 1) if record['peak_rss_mb'] is not None else None,
+                'api_calls': len(latencies),
+                'api_throttled': calls['throttled'],
+                'api_latency_ms': {
+                    'p50': round(float(np.percentile(latencies, 50)) * 1000, 1) if latencies else None,
+                    'p95': round(float(np.percentile(latencies, 95)) * 1000, 1) if latencies else None,
+                    'histogram': latency_histogram(latencies),
+                },
+                'bytes_written': record['bytes_written'],
+            })
+
+        return {
+            'started_at': self.started_at.isoformat(timespec='seconds'),
+            'finished_at': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+            **self.info,
+            'stages': stages,
+            'total': {
+                'wall_s': round(sum(stage['wall_s'] for stage in stages), 4),
+                'cpu_s': round(sum(stage['cpu_s'] for stage in stages), 4),
+                'peak_rss_mb': round(peak_rss_mb(), 1) if resource is not None else None,
+                'api_calls': sum(stage['api_calls'] for stage in stages),
+                'api_throttled': sum(stage['api_throttled'] for stage in stages),
+                'bytes_written': sum(stage['bytes_written'] or 0 for stage in stages),
+            },
+        }
+
+    def summary(self) -> str:
+        """Plain-text table of the stages"""
+        report = self.to_dict()
+        lines = [f"{'Stage':<12} {'Wall s':>8} {'CPU s':>8} {'Peak MB':>8} {'API calls':>10} {'p95 ms':>8} {'Written':>10}"]
+        for stage in report['stages'] + [{'name': 'total', 'api_latency_ms': {}, **report['total']}]:
+            p95 = stage['api_latency_ms'].get('p95')
+            lines.append(
+                f"{stage['name']:<12} {stage['wall_s']:>8.2f} {stage['cpu_s']:>8.2f} "
+                f"{stage['peak_rss_mb'] or 0:>8.0f} {stage['api_calls']:>10} "
+                f"{p95 if p95 is not None else '-':>8} {(stage['bytes_written'] or 0) / 2**20:>8.2f}MB"
+            )
+        return "\n".join(lines)
+
+    def write(self, path: Path):
+        with open(path, 'w') as f:
+            json.dump(self.to_dict(), f, indent=2)
@@ -0,0 +1,433 @@
+"""
+Compiler for the string scan language used by src/scans.py
+    close/close(1)>1.04 AND sma(50,volume)>200000 AND slope(10,sma(200))>0
+
+Queries are parsed into hashable expression tuples and evaluated over a
+date x ticker price panel with NumPy, one array operation per node for
+all tickers and dates at once. Subexpressions shared between queries are
+computed once per panel.
+
+Language:
+    fields        open high low close volume, plus any extra panel frame
+    lags          close(1) is yesterday's close, sma(200,close(22)) ...
+    functions     sma(n[,x]) ema(n[,x]) min(n[,x]) max(n[,x]) slope(n,x)
+                  roc([n[,x]]) adr([n]) atr([n]) natr([n]) ti([n])
+                  cw(n[,x]) pp([n]); x defaults to close, bare names
+                  use default periods
+    operators     + - * / and comparisons > >= < <= = != ; AND binds
+                  tighter than OR. A bare value used as a condition is
+                  true when it is non-zero.
+"""
+import importlib.util
+import re
+from functools import reduce
+from pathlib import Path
+from typing import Dict, List, Optional, Set, Tuple
+import numpy as np
+import pandas as pd
+
+from indicators import EMA_WARMUP, calc_adr, calc_ema, calc_max, calc_min, calc_roc, calc_sma, calc_trend_intensity
+from panel import FIELDS
+from relative_strength import RS_FIELDS
+
+# Default arguments per function; the first is the period in bars,
+# later ones are series (None = required)
+FUNCTIONS = {
+    'sma': (None, 'close'),
+    'ema': (None, 'close'),
+    'min': (None, 'close'),
+    'max': (None, 'close'),
+    'slope': (None, None),
+    'roc': (1, 'close'),
+    'adr': (20,),
+    'atr': (14,),
+    'natr': (14,),
+    'ti': (20,),
+    'cw': (None, 'close'),
+    'pp': (10,),
+}
+
+COMPARISONS = {'>', '>=', '<', '<=', '=', '==', '!='}
+
+TOKEN = re.compile(r"\s*(?:(\d+\.\d*|\.\d+|\d+)|([A-Za-z_][A-Za-z0-9_]*)|(>=|<=|!=|==|[-+*/(),=<>]))")
+
+
+class DSLError(ValueError):
+    """Query text that cannot be parsed or evaluated"""
+
+
+def tokenize(text: str) -> List[Tuple[str, str]]:
+    tokens = []
+    pos = 0
+    text = text.rstrip()
+    while pos < len(text):
+        match = TOKEN.match(text, pos)
+        if not match:
+            raise DSLError(f"Unexpected character at {pos}: {text[pos:pos + 10]!r}")
+        number, name, op = match.groups()
+        if number is not None:
+            tokens.append(('num', number))
+        elif name in ('AND', 'OR'):
+            tokens.append((name, name))
+        elif name is not None:
+            tokens.append(('name', name))
+        else:
+            tokens.append(('op', op))
+        pos = match.end()
+    return tokens
+
+
+class Parser:
+    """Recursive descent parser producing expression tuples"""
+
+    def __init__(self, text: str, fields: Set[str]):
+        self.text = text
+        self.tokens = tokenize(text)
+        self.pos = 0
+        self.fields = fields
+
+    def parse(self) -> Tuple:
+        if not self.tokens:
+            raise DSLError("Empty query")
+        node = self.disjunction()
+        if self.pos != len(self.tokens):
+            raise DSLError(f"Unexpected {self.tokens[self.pos][1]!r} in {self.text!r}")
+        return node
+
+    def peek(self) -> Optional[Tuple[str, str]]:
+        return self.tokens[self.pos] if self.pos < len(self.tokens) else None
+
+    def accept(self, kind: str, value: Optional[str] = None) -> Optional[str]:
+        token = self.peek()
+        if token and token[0] == kind and (value is None or token[1] == value):
+            self.pos += 1
+            return token[1]
+        return None
+
+    def expect(self, kind: str, value: str):
+        if self.accept(kind, value) is None:
+            found = self.peek()[1] if self.peek() else 'end of query'
+            raise DSLError(f"Expected {value!r} but found {found!r} in {self.text!r}")
+
+    def disjunction(self) -> Tuple:
+        terms = [self.conjunction()]
+        while self.accept('OR'):
+            terms.append(self.conjunction())
+        return terms[0] if len(terms) == 1 else ('or',) + tuple(terms)
+
+    def conjunction(self) -> Tuple:
+        terms = [self.condition()]
+        while self.accept('AND'):
+            terms.append(self.condition())
+        return terms[0] if len(terms) == 1 else ('and',) + tuple(terms)
+
+    def condition(self) -> Tuple:
+        left = self.sum()
+        token = self.peek()
+        if token and token[0] == 'op' and token[1] in COMPARISONS:
+            self.pos += 1
+            op = '==' if token[1] == '=' else token[1]
+            return (op, left, self.sum())
+        return left
+
+    def sum(self) -> Tuple:
+        node = self.product()
+        while True:
+            op = self.accept('op', '+') or self.accept('op', '-')
+            if op is None:
+                return node
+            node = (op, node, self.product())
+
+    def product(self) -> Tuple:
+        node = self.unary()
+        while True:
+            op = self.accept('op', '*') or self.accept('op', '/')
+            if op is None:
+                return node
+            node = (op, node, self.unary())
+
+    def unary(self) -> Tuple:
+        if self.accept('op', '-'):
+            operand = self.unary()
+            return ('num', -operand[1]) if operand[0] == 'num' else ('neg', operand)
+        return self.primary()
+
+    def primary(self) -> Tuple:
+        number = self.accept('num')
+        if number is not None:
+            return ('num', float(number))
+        if self.accept('op', '('):
+            node = self.disjunction()
+            self.expect('op', ')')
+            return node
+
+        name = self.accept('name')
+        if name is None:
+            found = self.peek()[1] if self.peek() else 'end of query'
+            raise DSLError(f"Unexpected {found!r} in {self.text!r}")
+
+        args = []
+        if self.accept('op', '('):
+            args.append(self.disjunction())
+            while self.accept('op', ','):
+                args.append(self.disjunction())
+            self.expect('op', ')')
+        return self.reference(name, args)
+
+    def reference(self, name: str, args: List[Tuple]) -> Tuple:
+        if name in self.fields:
+            if not args:
+                return ('field', name)
+            if len(args) == 1:
+                return ('lag', self.period(name, args[0], allow_zero=True), ('field', name))
+            raise DSLError(f"{name}(n) takes one lag argument")
+
+        if name not in FUNCTIONS:
+            raise DSLError(f"Unknown field or function: {name}")
+
+        defaults = FUNCTIONS[name]
+        if len(args) > len(defaults):
+            raise DSLError(f"{name} takes at most {len(defaults)} arguments")
+        values = []
+        for i, default in enumerate(defaults):
+            if i < len(args):
+                values.append(self.period(name, args[i]) if i == 0 else args[i])
+            elif default is None:
+                raise DSLError(f"{name} needs at least {i + 1} arguments")
+            else:
+                values.append(default if i == 0 else ('field', default))
+        return ('fn', name) + tuple(values)
+
+    def period(self, name: str, node: Tuple, allow_zero: bool = False) -> int:
+        if node[0] != 'num' or node[1] != int(node[1]) or node[1] < (0 if allow_zero else 1):
+            raise DSLError(f"{name} needs a whole number of bars, got {node}")
+        return int(node[1])
+
+
+def parse(text: str, fields: Optional[Set[str]] = None) -> Tuple:
+    """Expression tuple for a query or value expression"""
+    return Parser(text, set(fields or FIELDS)).parse()
+
+
+def referenced_fields(node: Tuple) -> Set[str]:
+    """Panel fields an expression reads"""
+    if node[0] == 'field':
+        return {node[1]}
+    if node[0] == 'fn' and node[1] in ('adr', 'atr', 'natr'):
+        return {'high', 'low', 'close'}
+    if node[0] == 'fn' and node[1] == 'ti':
+        return {'close'}
+    if node[0] == 'fn' and node[1] == 'pp':
+        return {'close', 'volume'}
+    return set().union(set(), *(referenced_fields(arg) for arg in node[1:] if isinstance(arg, tuple)))
+
+
+def history_bars(node: Tuple) -> int:
+    """Bars of history an expression needs at the latest bar, as indicators.lookback"""
+    kind = node[0]
+    if kind == 'num':
+        return 0
+    if kind == 'field':
+        return 1
+    if kind == 'lag':
+        return node[1] + history_bars(node[2])
+    if kind != 'fn':
+        return max(history_bars(arg) for arg in node[1:])
+
+    name, period, args = node[1], node[2], node[3:]
+    if name in ('sma', 'min', 'max', 'cw'):
+        return period - 1 + history_bars(args[0])
+    if name == 'ema':
+        return EMA_WARMUP * period - 1 + history_bars(args[0])
+    if name in ('slope', 'roc'):
+        return period + history_bars(args[0])
+    if name in ('atr', 'natr', 'pp'):
+        # True range and down days read the previous close
+        return period + 1
+    return period
+
+
+def lag(values: np.ndarray, periods: int) -> np.ndarray:
+    """Shift rows down by `periods`, NaN-filling the top"""
+    if periods == 0:
+        return values
+    out = np.full(values.shape, np.nan)
+    if periods < len(values):
+        out[periods:] = values[:-periods]
+    return out
+
+
+def true_range(high: np.ndarray, low: np.ndarray, close: np.ndarray) -> np.ndarray:
+    prev_close = lag(close, 1)
+    # fmax ignores the missing previous close on the first bar
+    return np.fmax(high - low, np.fmax(np.abs(high - prev_close), np.abs(low - prev_close)))
+
+
+def as_condition(values: np.ndarray) -> np.ndarray:
+    values = np.asarray(values)
+    if values.dtype == bool:
+        return values
+    return (values != 0) & ~np.isnan(values)
+
+
+class PanelEvaluator:
+    """
+    Evaluates parsed expressions over one panel, caching every node
+    Pass a bottom-aligned panel (indicators.align_panel) to evaluate at
+    each ticker's own bars, or a dated panel to evaluate by calendar row.
+    """
+
+    def __init__(self, panel: Dict[str, pd.DataFrame]):
+        self.panel = panel
+        self.tickers = panel['close'].columns
+        self.fields = {name for name, frame in panel.items() if name != 'date'}
+        self.values: Dict[Tuple, np.ndarray] = {}
+
+    def parse(self, text: str) -> Tuple:
+        return parse(text, self.fields)
+
+    def evaluate(self, node: Tuple) -> np.ndarray:
+        """date x ticker array of an expression"""
+        if node in self.values:
+            return self.values[node]
+        with np.errstate(invalid='ignore', divide='ignore'):
+            value = self._compute(node)
+        self.values[node] = value
+        return value
+
+    def array(self, text: str) -> np.ndarray:
+        """date x ticker array of a query or value expression"""
+        return np.broadcast_to(self.evaluate(self.parse(text)), self.panel['close'].shape)
+
+    def frame(self, text: str) -> pd.DataFrame:
+        close = self.panel['close']
+        return pd.DataFrame(self.array(text), index=close.index, columns=close.columns)
+
+    def latest(self, text: str) -> pd.Series:
+        """Value of an expression at the last row, by ticker"""
+        return pd.Series(self.array(text)[-1], index=self.tickers)
+
+    def _compute(self, node: Tuple) -> np.ndarray:
+        kind = node[0]
+        if kind == 'num':
+            # Scalars broadcast against the panel arrays
+            return np.float64(node[1])
+        if kind == 'field':
+            return self.panel[node[1]].to_numpy(dtype='float64')
+        if kind == 'lag':
+            return lag(self.evaluate(node[2]), node[1])
+        if kind == 'neg':
+            return -self.evaluate(node[1])
+        if kind == 'and':
+            return reduce(np.logical_and, [as_condition(self.evaluate(arg)) for arg in node[1:]])
+        if kind == 'or':
+            return reduce(np.logical_or, [as_condition(self.evaluate(arg)) for arg in node[1:]])
+        if kind == 'fn':
+            return self._function(node[1], node[2], node[3:])
+
+        left, right = self.evaluate(node[1]), self.evaluate(node[2])
+        if kind == '+':
+            return left + right
+        if kind == '-':
+            return left - right
+        if kind == '*':
+            return left * right
+        if kind == '/':
+            return left / right
+        if kind == '>':
+            return left > right
+        if kind == '>=':
+            return left >= right
+        if kind == '<':
+            return left < right
+        if kind == '<=':
+            return left <= right
+        if kind == '==':
+            return left == right
+        if kind == '!=':
+            return (left != right) & ~np.isnan(left) & ~np.isnan(right)
+        raise DSLError(f"Unknown operator {kind}")
+
+    def _function(self, name: str, period: int, args: Tuple) -> np.ndarray:
+        if name in ('sma', 'ema', 'min', 'max'):
+            kernel = {'sma': calc_sma, 'ema': calc_ema, 'min': calc_min, 'max': calc_max}[name]
+            return kernel(pd.DataFrame(self.evaluate(args[0])), period).to_numpy()
+        if name == 'slope':
+            # Average change per bar over the last `period` bars
+            values = self.evaluate(args[0])
+            return (values - lag(values, period)) / period
+        if name == 'roc':
+            return calc_roc(pd.DataFrame(self.evaluate(args[0])), period).to_numpy()
+        if name == 'cw':
+            # Width of the range over the last `period` bars, percent of its low
+            low = self.evaluate(('fn', 'min', period, args[0]))
+            return (self.evaluate(('fn', 'max', period, args[0])) - low) / low * 100
+        if name == 'pp':
+            return self._pocket_pivot(period)
+
+        high, low, close = (self.evaluate(('field', field)) for field in ('high', 'low', 'close'))
+        if name == 'adr':
+            return calc_adr(pd.DataFrame(high), pd.DataFrame(low), pd.DataFrame(close), period).to_numpy()
+        if name == 'ti':
+            return calc_trend_intensity(pd.DataFrame(close), period).to_numpy()
+        if name == 'atr':
+            return calc_sma(pd.DataFrame(true_range(high, low, close)), period).to_numpy()
+        # natr: ATR as a percentage of close
+        return self.evaluate(('fn', 'atr', period)) / close * 100
+
+
+    def _pocket_pivot(self, period: int) -> np.ndarray:
+        """
+        Pocket pivot: volume above the highest volume of the down days
+        (close below the previous close) among the last `period` bars
+        """
+        close, volume = self.evaluate(('field', 'close')), self.evaluate(('field', 'volume'))
+        down_volume = np.where(close < lag(close, 1), volume, 0.0)
+        # Needs `period` earlier bars, each with a previous close
+        known = ~np.isnan(lag(close, period + 1))
+        highest = np.max([lag(down_volume, bars) for bars in range(1, period + 1)], axis=0)
+        return known & (volume > highest)
+
+
+def missing_names(text: str, fields: Set[str]) -> List[str]:
+    """Names a query uses that are neither fields nor functions"""
+    return sorted({
+        value for kind, value in tokenize(text)
+        if kind == 'name' and value not in fields and value not in FUNCTIONS
+    })
+
+
+# EOD scans already reported as left out, so each is reported once per run
+_skipped_eod_scans: Set[str] = set()
+
+
+def load_eod_scans(scale: Optional[Dict] = None) -> Dict:
+    """The EOD() scan set from src/scans.py, in get_all_scans() format"""
+    path = Path(__file__).resolve().parents[2] / "src" / "scans.py"
+    spec = importlib.util.spec_from_file_location("eod_scans", path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    eod = module.EOD(scale=scale or {"volume": 1, "price": 1})
+
+    # Fundamentals (market cap, float, growth estimates, insider holdings)
+    # are not in the price panel, so scans reading them are disabled rather
+    # than failed on every run
+    fields = set(FIELDS) | set(RS_FIELDS)
+    all_scans = {}
+    for group_name, group in eod.items():
+        scans = {}
+        for scan_name, scan in group['scans'].items():
+            missing = missing_names(scan['query'], fields) + missing_names(scan['order'], fields)
+            scans[scan_name] = {
+                'description': scan['query'],
+                'query': scan['query'],
+                'order_by': scan['order'],
+                'limit': scan['limit'],
+                'enabled': not missing,
+            }
+            if missing and scan_name not in _skipped_eod_scans:
+                _skipped_eod_scans.add(scan_name)
+                print(f"Skipping EOD scan {scan_name}: needs {', '.join(sorted(set(missing)))}, "
+                      f"which the price panel does not have")
+        all_scans[group_name] = {'link': group['link'], 'scans': scans}
+    return all_scans
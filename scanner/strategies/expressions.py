@@ -0,0 +1,206 @@
+"""
+Scan query expressions
+Scan queries are written as lambdas over the dataset (df['close'] > 4 & ...).
+Calling one on a ColumnSource instead of a DataFrame records the expression
+it builds, so identical predicates and filters can be recognized across scans
+and each evaluated once per dataset.
+"""
+import threading
+from typing import Callable, Dict, FrozenSet, Optional, Set, Tuple, Union
+import numpy as np
+import pandas as pd
+
+COMPARISONS = {
+    '>': lambda a, b: a > b,
+    '>=': lambda a, b: a >= b,
+    '<': lambda a, b: a < b,
+    '<=': lambda a, b: a <= b,
+    '==': lambda a, b: a == b,
+    '!=': lambda a, b: a != b,
+}
+ARITHMETIC = {
+    '+': lambda a, b: a + b,
+    '-': lambda a, b: a - b,
+    '*': lambda a, b: a * b,
+    '/': lambda a, b: a / b,
+}
+LOGICAL = {
+    '|': lambda a, b: a | b,
+}
+
+
+class Expr:
+    """
+    Node of a traced query expression
+    `key` identifies the expression structurally, so two scans that build
+    the same predicate get equal keys.
+    """
+    # Make NumPy defer to our reflected operators (np.float64(4) < expr)
+    __array_ufunc__ = None
+
+    def __init__(self, op: str, args: Tuple, key: Tuple):
+        self.op = op
+        self.args = args
+        self.key = key
+
+    def _binary(self, op: str, other, reflected: bool = False) -> 'Expr':
+        other = other if isinstance(other, Expr) else Const(other)
+        left, right = (other, self) if reflected else (self, other)
+        return Expr(op, (left, right), (op, left.key, right.key))
+
+    def __gt__(self, other): return self._binary('>', other)
+    def __ge__(self, other): return self._binary('>=', other)
+    def __lt__(self, other): return self._binary('<', other)
+    def __le__(self, other): return self._binary('<=', other)
+    def __eq__(self, other): return self._binary('==', other)
+    def __ne__(self, other): return self._binary('!=', other)
+
+    def __add__(self, other): return self._binary('+', other)
+    def __sub__(self, other): return self._binary('-', other)
+    def __mul__(self, other): return self._binary('*', other)
+    def __truediv__(self, other): return self._binary('/', other)
+    def __radd__(self, other): return self._binary('+', other, reflected=True)
+    def __rsub__(self, other): return self._binary('-', other, reflected=True)
+    def __rmul__(self, other): return self._binary('*', other, reflected=True)
+    def __rtruediv__(self, other): return self._binary('/', other, reflected=True)
+
+    def __or__(self, other): return self._binary('|', other)
+
+    def __and__(self, other):
+        # Flatten chains of & into one conjunction of terms
+        other = other if isinstance(other, Expr) else Const(other)
+        terms = tuple(self.args if self.op == '&' else (self,)) + tuple(other.args if other.op == '&' else (other,))
+        return And(terms)
+
+    def __invert__(self):
+        return Expr('~', (self,), ('~', self.key))
+
+    def __hash__(self):
+        return hash(self.key)
+
+    def __bool__(self):
+        raise TypeError("Scan expressions cannot be used as booleans")
+
+
+def Column(name: str) -> Expr:
+    return Expr('column', (name,), ('column', name))
+
+
+def Const(value) -> Expr:
+    # Keep the type in the key: x * 2 and x * 2.0 can differ in dtype
+    return Expr('const', (value,), ('const', type(value).__name__, value))
+
+
+def And(terms: Tuple[Expr, ...]) -> Expr:
+    # Order of terms does not change a conjunction's result
+    return Expr('&', terms, ('&', frozenset(term.key for term in terms)))
+
+
+class ColumnSource:
+    """Stands in for the dataset while tracing a query"""
+
+    def __getitem__(self, name: str) -> Expr:
+        return Column(name)
+
+
+def trace(query_func: Callable) -> Optional[Expr]:
+    """
+    Expression built by query_func, or None if it does something that
+    cannot be traced (methods like .between, Python and/or, ...)
+    """
+    try:
+        expr = query_func(ColumnSource())
+    except (TypeError, AttributeError, ValueError, KeyError):
+        return None
+    return expr if isinstance(expr, Expr) else None
+
+
+def referenced_columns(expr: Expr) -> Set[str]:
+    """Dataset columns an expression reads"""
+    if expr.op == 'column':
+        return {expr.args[0]}
+    if expr.op == 'const':
+        return set()
+    return set().union(*(referenced_columns(arg) for arg in expr.args))
+
+
+class MaskCache:
+    """
+    Evaluates traced expressions over one dataset, caching every
+    subexpression by key. Scans sharing predicates or whole filters
+    reuse the arrays computed for earlier scans.
+
+    Scans running on several threads can share one cache: two threads
+    reaching the same uncached key both compute it, to the same value.
+    """
+
+    def __init__(self, data: Union[pd.DataFrame, Dict[str, np.ndarray]]):
+        self.data = data
+        self.values: Dict[Tuple, object] = {}
+        self.evaluated = 0
+        self.reused = 0
+        self._lock = threading.Lock()
+
+    def _count(self, reused: bool):
+        with self._lock:
+            if reused:
+                self.reused += 1
+            else:
+                self.evaluated += 1
+
+    def mask(self, expr: Expr) -> np.ndarray:
+        """Boolean row mask of a filter expression"""
+        mask = self.evaluate(expr)
+        if isinstance(mask, pd.Series):
+            # Nullable dtypes give NA for missing values; filtering treats them as False
+            return mask.to_numpy(dtype=bool, na_value=False)
+        return np.asarray(mask, dtype=bool)
+
+    def evaluate(self, expr: Expr):
+        value = self.values.get(expr.key)
+        if value is not None:
+            self._count(reused=True)
+            return value
+
+        if expr.op == '&':
+            value = self._conjunction(expr.args)
+        else:
+            value = self._compute(expr)
+            self._count(reused=False)
+        self.values[expr.key] = value
+        return value
+
+    def _conjunction(self, terms: Tuple[Expr, ...]):
+        # Cache each prefix too, so scans that start with the same filters
+        # (the usual liquidity conditions) share the combined mask
+        value = self.evaluate(terms[0])
+        prefix: FrozenSet = frozenset([terms[0].key])
+        for term in terms[1:]:
+            prefix = prefix | {term.key}
+            key = ('&', prefix)
+            cached = self.values.get(key)
+            if cached is not None:
+                self._count(reused=True)
+                value = cached
+            else:
+                value = value & self.evaluate(term)
+                self._count(reused=False)
+                self.values[key] = value
+        return value
+
+    def _compute(self, expr: Expr):
+        if expr.op == 'column':
+            column = self.data[expr.args[0]]
+            if isinstance(column, np.ndarray):
+                # Replayed panels (backtest.py) hold date x ticker arrays
+                return column
+            # Plain NumPy dtypes are evaluated as arrays; others keep pandas semantics
+            return column.to_numpy() if isinstance(column.dtype, np.dtype) else column
+        if expr.op == 'const':
+            return expr.args[0]
+        if expr.op == '~':
+            return ~self.evaluate(expr.args[0])
+
+        op = COMPARISONS.get(expr.op) or ARITHMETIC.get(expr.op) or LOGICAL[expr.op]
+        left, right = (self.evaluate(arg) for arg in expr.args)
+        return op(left, right)
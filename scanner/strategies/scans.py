@@ -2,41 +2,119 @@
 Stock scanning strategies from various trading gurus
 Adapted for pandas DataFrame filtering
 """
+from typing import Dict, List, Optional, Set, Tuple
 import pandas as pd
 import numpy as np
 
+from indicators import INDICATORS, MAX_HISTORY_DAYS, align_panel
+from panel import FIELDS
+from relative_strength import RS_FIELDS
+from strategies.dsl import DSLError, PanelEvaluator, history_bars, load_eod_scans, parse, referenced_fields
+from strategies.expressions import Column, MaskCache, referenced_columns, trace
+
+# Scan sets selectable with SCAN_SET: the guru scans below, or the string
+# queries of src/scans.py's EOD() compiled against the price panel
+SCAN_SETS = ("guru", "eod")
+
+# Periods of the close_to_min_N / close_to_max_N ratio columns
+DERIVED_PERIODS = [21, 63, 126, 252]
+
 
 class ScanEngine:
     """Execute scans on market data"""
 
-    def __init__(self, data: pd.DataFrame):
+    def __init__(self, data: pd.DataFrame, panel: Optional[Dict[str, pd.DataFrame]] = None):
         """
         Initialize with market data containing OHLCV + indicators
 
         Args:
             data: DataFrame with columns: ticker, close, volume, sma_50, etc.
+                  Scans only read it, so it is used as is rather than copied
+            panel: Price panel the dataset was built from, needed for
+                   string (DSL) queries and order expressions
         """
-        self.data = data.copy()
+        self.data = data
+        # Predicate masks shared by all scans run on this dataset
+        self.masks = MaskCache(data)
+        # Evaluated at each ticker's latest bar, like the dataset rows
+        self.panel = PanelEvaluator(align_panel(panel)) if panel is not None else None
 
     def run_scan(self, query_func, order_by: str, limit: int = 100, ascending: bool = False) -> pd.DataFrame:
         """
         Execute a scan query
 
         Args:
-            query_func: Function that takes DataFrame and returns boolean mask
-            order_by: Column name to sort by
+            query_func: Function that takes DataFrame and returns boolean mask,
+                        or a query string (see strategies/dsl.py)
+            order_by: Column name or expression string to sort by
             limit: Maximum results to return
             ascending: Sort order
         """
-        # Apply filter
-        filtered = self.data[query_func(self.data)].copy()
+        # Only the result rows are copied out of the dataset
+        return self.data.iloc[self.select(query_func, order_by, limit, ascending)]
 
-        # Sort
-        if order_by in filtered.columns:
-            filtered = filtered.sort_values(order_by, ascending=ascending)
+    def select(self, query_func, order_by: str, limit: int = 100, ascending: bool = False) -> np.ndarray:
+        """
+        Row positions of a scan's results in result order
+        Same rows and order as filtering, sorting by order_by (missing
+        values last, ties in dataset order) and keeping the first `limit`,
+        but only the top `limit` rows are ever sorted.
+        """
+        # Traceable queries reuse predicates evaluated by earlier scans
+        if isinstance(query_func, str):
+            mask = self._panel_values(query_func).fillna(False).to_numpy(dtype=bool)
+        else:
+            expr = trace(query_func)
+            mask = self.masks.mask(expr) if expr is not None else query_func(self.data)
+            if isinstance(mask, pd.Series):
+                mask = mask.to_numpy(dtype=bool, na_value=False)
+        rows = np.flatnonzero(mask)
 
-        # Limit
-        return filtered.head(limit)
+        if order_by in self.data.columns:
+            column = self.data[order_by]
+            if not pd.api.types.is_numeric_dtype(column.dtype):
+                order = column.iloc[rows].reset_index(drop=True).sort_values(ascending=ascending, kind='stable')
+                return rows[order.index[:limit]]
+            values = self.masks.evaluate(Column(order_by))
+            values = np.asarray(values, dtype='float64') if isinstance(values, np.ndarray) \
+                else values.to_numpy(dtype='float64', na_value=np.nan)
+        elif self.panel is not None:
+            values = self._panel_values(order_by).to_numpy(dtype='float64')
+        else:
+            return rows[:limit]
+
+        return rows[top_k(values[rows], limit, ascending)]
+
+    def _panel_values(self, text: str) -> pd.Series:
+        """Latest value of a DSL expression for each dataset row"""
+        if self.panel is None:
+            raise ValueError("String queries need the price panel (ScanEngine(data, panel=...))")
+        return self.data['ticker'].map(self.panel.latest(text))
+
+
+def top_k(values: np.ndarray, k: int, ascending: bool = False) -> np.ndarray:
+    """
+    Positions of the first k values in sorted order, NaN last and ties
+    in their original order (as a stable sort_values(...).head(k))
+    Partitioning first means only about k values are sorted.
+    """
+    if k <= 0:
+        return np.empty(0, dtype=np.intp)
+
+    missing = np.isnan(values)
+    valid = np.flatnonzero(~missing)
+    keys = values[valid] if ascending else -values[valid]
+
+    if k < len(valid):
+        # Keep everything tied with the k-th key so tie order is decided below
+        kth = np.partition(keys, k - 1)[k - 1]
+        keep = keys <= kth
+        valid, keys = valid[keep], keys[keep]
+
+    ranked = valid[np.argsort(keys, kind='stable')][:k]
+    if len(ranked) < k:
+        ranked = np.concatenate([ranked, np.flatnonzero(missing)[:k - len(ranked)]])
+    return ranked
 
 
 def get_all_scans():
@@ -258,22 +336,118 @@ def get_all_scans():
     return scans
 
 
+def get_scan_set(name: str = "guru") -> Dict:
+    """
+    Scan definitions of a scan set, in get_all_scans() format
+    Scans with "enabled": False are left out
+    """
+    if name == "guru":
+        all_scans = get_all_scans()
+    elif name == "eod":
+        all_scans = load_eod_scans()
+    else:
+        raise ValueError(f"Unknown scan set: {name} (expected one of {', '.join(SCAN_SETS)})")
+
+    for guru_info in all_scans.values():
+        guru_info['scans'] = {
+            scan_name: scan_config for scan_name, scan_config in guru_info['scans'].items()
+            if scan_config.get('enabled', True)
+        }
+    return {guru_name: guru_info for guru_name, guru_info in all_scans.items() if guru_info['scans']}
+
+
+def _derived_inputs(column: str) -> List[str]:
+    """Columns prepare_derived_columns computes a column from"""
+    for kind in ('min', 'max'):
+        prefix = f'close_to_{kind}_'
+        if column.startswith(prefix):
+            return ['close', f'{kind}_{column[len(prefix):]}']
+    return [column]
+
+
+def is_dataset_column(name: str) -> bool:
+    """Whether an order_by names a scan dataset column rather than an expression"""
+    if name in FIELDS or name in RS_FIELDS:
+        return True
+    return all(column in INDICATORS or column in FIELDS for column in _derived_inputs(name))
+
+
+def scan_columns(scan_config: Dict) -> Optional[Set[str]]:
+    """
+    Dataset columns a scan reads: its "columns" entry if it declares one,
+    else inferred from the traced query and order_by. None if the query
+    cannot be traced. String queries read the price panel instead.
+    """
+    query = scan_config['query']
+    if 'columns' in scan_config:
+        columns = set(scan_config['columns'])
+    elif isinstance(query, str):
+        columns = set()
+    else:
+        expr = trace(query)
+        if expr is None:
+            return None
+        columns = referenced_columns(expr)
+
+    if is_dataset_column(scan_config['order_by']):
+        columns.add(scan_config['order_by'])
+    return {inp for column in columns for inp in _derived_inputs(column)}
+
+
+def scan_requirements(all_scans: Dict) -> Tuple[Optional[Set[str]], Set[str], int]:
+    """
+    Indicator columns the scans in a set read (None: some scan cannot say,
+    so every indicator is needed), the relative strength fields they read
+    (see relative_strength.py) and bars of price history their string
+    queries and order expressions need (the ranks' own history is added
+    by build_scan_dataset). A scan whose query cannot be traced only gets
+    ranks it lists in a "columns" entry.
+    """
+    columns: Optional[Set[str]] = set()
+    ranks: Set[str] = set()
+    history = 0
+    for guru_info in all_scans.values():
+        for scan_config in guru_info['scans'].values():
+            needed = scan_columns(scan_config)
+            if needed is not None:
+                ranks |= needed & set(RS_FIELDS)
+            columns = columns | needed if columns is not None and needed is not None else None
+
+            texts = [scan_config['query'], scan_config['order_by']]
+            for text in texts:
+                if isinstance(text, str) and not is_dataset_column(text):
+                    try:
+                        node = parse(text, set(FIELDS) | set(RS_FIELDS))
+                    except DSLError:
+                        # Fails when the scan runs, and reports its error there
+                        continue
+                    history = max(history, history_bars(node))
+                    ranks |= referenced_fields(node) & set(RS_FIELDS)
+
+    if columns is not None:
+        columns -= set(RS_FIELDS)
+    return columns, ranks, min(history, MAX_HISTORY_DAYS)
+
+
 def prepare_derived_columns(df: pd.DataFrame) -> pd.DataFrame:
     """
     Calculate derived columns needed for scans
     (ratio columns, etc.)
+    Also works on a dict of date x ticker arrays (see backtest.py)
     """
-    df = df.copy()
+    # Shallow copy: the new columns are added to the copy only, without
+    # duplicating the dataset's existing columns
+    df = df.copy(deep=False) if isinstance(df, pd.DataFrame) else dict(df)
 
     # Price to min/max ratios
-    for period in [21, 63, 126, 252]:
+    for period in DERIVED_PERIODS:
         min_col = f'min_{period}'
         max_col = f'max_{period}'
 
-        if min_col in df.columns:
+        if min_col in df:
             df[f'close_to_min_{period}'] = df['close'] / df[min_col]
 
-        if max_col in df.columns:
+        if max_col in df:
             df[f'close_to_max_{period}'] = df['close'] / df[max_col]
 
     return df
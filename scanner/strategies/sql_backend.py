@@ -0,0 +1,311 @@
+"""
+DuckDB scan backend
+Registers the scan dataset, and optionally the price history as long-format
+bars, as Arrow tables and runs every translatable scan in one SQL statement
+that DuckDB plans and executes across all cores.
+
+Dataset scans (traced lambdas, see strategies/expressions.py) become WHERE
+clauses over the dataset. String queries (strategies/dsl.py) are evaluated at
+each ticker's latest bar as filtered aggregates over its bars numbered by a
+window function. Scans that cannot be translated (untraceable lambdas, ema,
+windows over windows) are left to ScanEngine.
+"""
+from typing import Dict, Hashable, List, Optional, Tuple
+import numpy as np
+import pandas as pd
+
+from strategies.dsl import DSLError, parse
+from strategies.expressions import Expr, trace
+
+try:
+    import duckdb
+    import pyarrow as pa
+except ImportError:  # optional dependency
+    duckdb = None
+    pa = None
+
+# (query, order_by, limit, ascending)
+Scan = Tuple[object, str, int, bool]
+
+SQL_COMPARISONS = {'>': '>', '>=': '>=', '<': '<', '<=': '<=', '==': '=', '!=': '<>'}
+SQL_ARITHMETIC = {'+', '-', '*', '/'}
+
+
+class NotTranslatable(Exception):
+    """A scan that has no SQL form; it runs on the pandas engine instead"""
+
+
+def quote(name: str) -> str:
+    return '"' + name.replace('"', '""') + '"'
+
+
+def literal(value) -> str:
+    if isinstance(value, (bool, np.bool_)):
+        return 'TRUE' if value else 'FALSE'
+    if isinstance(value, (int, float, np.integer, np.floating)):
+        return repr(float(value)) if isinstance(value, (float, np.floating)) else str(int(value))
+    if isinstance(value, str):
+        return "'" + value.replace("'", "''") + "'"
+    raise NotTranslatable(f"Unsupported constant {value!r}")
+
+
+def dataset_sql(expr: Expr, table: str = 'd') -> str:
+    """SQL for a traced dataset expression, with pandas' missing-value semantics"""
+    op = expr.op
+    if op == 'column':
+        return f"{table}.{quote(expr.args[0])}"
+    if op == 'const':
+        return literal(expr.args[0])
+    if op == '~':
+        return f"(NOT {dataset_sql(expr.args[0], table)})"
+    if op == '&':
+        return '(' + ' AND '.join(dataset_sql(term, table) for term in expr.args) + ')'
+
+    left, right = (dataset_sql(arg, table) for arg in expr.args)
+    if op == '|':
+        return f"({left} OR {right})"
+    if op in SQL_ARITHMETIC:
+        return f"({left} {op} {right})"
+    if op in SQL_COMPARISONS:
+        # Comparisons with NaN are False in pandas, except != which is True
+        missing = 'TRUE' if op == '!=' else 'FALSE'
+        return f"COALESCE({left} {SQL_COMPARISONS[op]} {right}, {missing})"
+    raise NotTranslatable(f"Unsupported operator {op}")
+
+
+def desugar(node: Tuple) -> Tuple:
+    """
+    Rewrite DSL functions into lag, rolling sma/min/max and arithmetic,
+    following the definitions in indicators.py
+    """
+    kind = node[0]
+    if kind in ('num', 'field'):
+        return node
+    if kind == 'lag':
+        return ('lag', node[1], desugar(node[2]))
+    if kind != 'fn':
+        return (kind,) + tuple(desugar(arg) for arg in node[1:])
+
+    name, period, args = node[1], node[2], [desugar(arg) for arg in node[3:]]
+    close = ('field', 'close')
+    if name in ('sma', 'min', 'max'):
+        return (name, period, args[0])
+    if name == 'roc':
+        return ('*', ('-', ('/', args[0], ('lag', period, args[0])), ('num', 1.0)), ('num', 100.0))
+    if name == 'slope':
+        return ('/', ('-', args[0], ('lag', period, args[0])), ('num', float(period)))
+    if name == 'ti':
+        return ('/', close, ('sma', period, close))
+    if name == 'adr':
+        daily_range = ('*', ('/', ('-', ('field', 'high'), ('field', 'low')), close), ('num', 100.0))
+        return ('sma', period, daily_range)
+    if name in ('atr', 'natr'):
+        atr = ('sma', period, ('true_range',))
+        return atr if name == 'atr' else ('*', ('/', atr, close), ('num', 100.0))
+    raise NotTranslatable(f"{name} has no SQL translation")
+
+
+class LatestBarPlan:
+    """
+    DSL expressions at each ticker's latest bar, as aggregates over its
+    last bars. Bars are numbered from the end (rn = 1 is the latest), so a
+    value `offset` bars back is a FILTER on rn and sma(n) is an AVG over n
+    of them: one window sort and one GROUP BY for every expression.
+    """
+
+    def __init__(self):
+        self.aggregates: Dict[str, str] = {}
+        self.lookback = 1
+        self.prev_close = False
+
+    def _aggregate(self, sql: str, table: str) -> str:
+        alias = self.aggregates.setdefault(sql, f"a{len(self.aggregates)}")
+        return f"{table}.{alias}"
+
+    def rowwise(self, node: Tuple) -> str:
+        """Expression within one bar (no lags or windows)"""
+        kind = node[0]
+        if kind == 'num':
+            return literal(node[1])
+        if kind == 'field':
+            return quote(node[1])
+        if kind == 'true_range':
+            self.prev_close = True
+            # GREATEST skips NULLs, so the first bar's range is high - low
+            return "GREATEST(high - low, ABS(high - prev_close), ABS(low - prev_close))"
+        if kind == 'neg':
+            return f"(-{self.rowwise(node[1])})"
+        if kind in SQL_ARITHMETIC:
+            return f"({self.rowwise(node[1])} {kind} {self.rowwise(node[2])})"
+        raise NotTranslatable(f"{kind} inside a rolling window has no SQL translation")
+
+    def value(self, node: Tuple, table: str, offset: int = 0) -> str:
+        """SQL for a node's value `offset` bars before the latest bar"""
+        kind = node[0]
+        if kind == 'num':
+            return literal(node[1])
+        if kind in ('field', 'true_range'):
+            self.lookback = max(self.lookback, offset + 1)
+            return self._aggregate(f"ANY_VALUE({self.rowwise(node)}) FILTER (WHERE rn = {offset + 1})", table)
+        if kind == 'lag':
+            return self.value(node[2], table, offset + node[1])
+        if kind in ('sma', 'min', 'max'):
+            period, inner = node[1], node[2]
+            if inner[0] == 'lag':
+                # A lagged input shifts the whole window
+                return self.value((kind, period, inner[2]), table, offset + inner[1])
+            value = self.rowwise(inner)
+            self.lookback = max(self.lookback, offset + period)
+            window = f"FILTER (WHERE rn BETWEEN {offset + 1} AND {offset + period})"
+            agg = {'sma': 'AVG', 'min': 'MIN', 'max': 'MAX'}[kind]
+            # Like pandas rolling(min_periods=period): NULL unless the window is full
+            return self._aggregate(f"CASE WHEN COUNT({value}) {window} = {period} THEN {agg}({value}) {window} END", table)
+        if kind == 'neg':
+            return f"(-{self.value(node[1], table, offset)})"
+        if kind in ('and', 'or'):
+            if offset:
+                raise NotTranslatable("Lagged conditions have no SQL translation")
+            joiner = ' AND ' if kind == 'and' else ' OR '
+            return '(' + joiner.join(self.condition(arg, table) for arg in node[1:]) + ')'
+
+        left, right = self.value(node[1], table, offset), self.value(node[2], table, offset)
+        if kind in SQL_ARITHMETIC:
+            return f"({left} {kind} {right})"
+        if kind in SQL_COMPARISONS:
+            return f"COALESCE({left} {SQL_COMPARISONS[kind]} {right}, FALSE)"
+        raise NotTranslatable(f"Unsupported operator {kind}")
+
+    def condition(self, node: Tuple, table: str) -> str:
+        sql = self.value(node, table)
+        if node[0] in SQL_COMPARISONS or node[0] in ('and', 'or'):
+            return sql
+        # A bare value is true when non-zero
+        return f"COALESCE({sql} <> 0, FALSE)"
+
+    def ctes(self, source: str) -> List[str]:
+        """CTEs numbering each ticker's bars and reducing them to one row per ticker"""
+        order = "OVER (PARTITION BY ticker ORDER BY date DESC)"
+        prev_close = f", LEAD(close, 1) {order} AS prev_close" if self.prev_close else ""
+        columns = ''.join(f", {sql} AS {alias}" for sql, alias in self.aggregates.items())
+        return [
+            f"ranked AS (SELECT *, ROW_NUMBER() {order} AS rn{prev_close} FROM {source})",
+            f"latest AS (SELECT ticker{columns} FROM ranked WHERE rn <= {self.lookback} GROUP BY ticker)",
+        ]
+
+
+class SQLScanBackend:
+    """Runs scans over the dataset (and price history) as one DuckDB query"""
+
+    def __init__(self, data: pd.DataFrame, panel: Optional[Dict[str, pd.DataFrame]] = None,
+                 threads: Optional[int] = None):
+        if duckdb is None:
+            raise ImportError("The SQL scan backend needs duckdb and pyarrow (pip install duckdb pyarrow)")
+
+        self.data = data
+        self.panel = panel
+        self.fields = {name for name in panel if name != 'date'} if panel is not None else set()
+        self.con = duckdb.connect()
+        if threads:
+            self.con.execute(f"SET threads TO {int(threads)}")
+
+        dataset = pa.Table.from_pandas(data.reset_index(drop=True), preserve_index=False)
+        self.con.register('dataset', dataset.append_column('row_id', pa.array(np.arange(len(data)))))
+        self._bars_registered = False
+
+    def _register_bars(self):
+        """Long-format bars (ticker, date, OHLCV) for every ticker's traded dates"""
+        if self._bars_registered:
+            return
+        close = self.panel['close']
+        stacked = {field: self.panel[field].to_numpy(dtype='float64').ravel(order='F') for field in self.fields}
+        bars = pd.DataFrame({
+            'ticker': np.repeat(close.columns.to_numpy(dtype=object), len(close)),
+            'date': np.tile(close.index.to_numpy(), len(close.columns)),
+            **stacked,
+        })
+        bars = bars[~np.isnan(bars['close'].to_numpy())]
+        self.con.register('bars', pa.Table.from_pandas(bars, preserve_index=False))
+        self._bars_registered = True
+
+    def _dsl(self, text: str) -> Tuple:
+        if self.panel is None:
+            raise NotTranslatable("String queries need the price panel")
+        try:
+            return desugar(parse(text, self.fields))
+        except DSLError as e:
+            raise NotTranslatable(str(e))
+
+    def select_all(self, scans: Dict[Hashable, Scan]) -> Dict[Hashable, np.ndarray]:
+        """
+        Row positions (in result order) of every scan that translates to SQL,
+        matching ScanEngine.select. Scans missing from the result could not
+        be translated.
+        """
+        plan = LatestBarPlan()
+        branches = []
+        keys = []
+        uses_history = False
+
+        for key, (query, order_by, limit, ascending) in scans.items():
+            aggregates = dict(plan.aggregates)
+            try:
+                if isinstance(query, str):
+                    condition = plan.condition(self._dsl(query), 'l')
+                else:
+                    expr = trace(query)
+                    if expr is None:
+                        raise NotTranslatable("Query cannot be traced")
+                    condition = dataset_sql(expr)
+
+                if order_by in self.data.columns:
+                    order = f"d.{quote(order_by)}"
+                elif self.panel is not None:
+                    order = plan.value(self._dsl(order_by), 'l')
+                else:
+                    order = None
+            except NotTranslatable:
+                # Drop aggregates added for a scan that is not translated
+                plan.aggregates = aggregates
+                continue
+
+            uses_history = uses_history or bool(plan.aggregates)
+            direction = 'ASC' if ascending else 'DESC'
+            ranking = f"{order} {direction} NULLS LAST, d.row_id" if order else "d.row_id"
+            branches.append(
+                f"SELECT {len(keys)} AS scan, row_id, rank FROM ("
+                f"SELECT d.row_id, ROW_NUMBER() OVER (ORDER BY {ranking}) AS rank "
+                f"FROM dataset d LEFT JOIN latest l ON l.ticker = d.ticker WHERE {condition}"
+                f") WHERE rank <= {int(limit)}"
+            )
+            keys.append(key)
+
+        if not branches:
+            return {}
+
+        if uses_history:
+            self._register_bars()
+            ctes = plan.ctes('bars')
+        else:
+            # No history needed: an empty stand-in keeps the join valid
+            ctes = ["latest AS (SELECT NULL::VARCHAR AS ticker WHERE FALSE)"]
+
+        sql = "WITH " + ",\n".join(ctes) + "\n" + "\nUNION ALL\n".join(branches)
+        result = self.con.execute(sql).fetchnumpy()
+
+        order = np.lexsort((result['rank'], result['scan']))
+        scan_ids, row_ids = result['scan'][order], result['row_id'][order]
+        selections = {key: np.empty(0, dtype=np.intp) for key in keys}
+        for scan_id, start, stop in _runs(scan_ids):
+            selections[keys[scan_id]] = row_ids[start:stop].astype(np.intp)
+        return selections
+
+
+def _runs(values: np.ndarray):
+    """(value, start, stop) for each run of equal values in a sorted array"""
+    if len(values) == 0:
+        return
+    boundaries = np.flatnonzero(np.diff(values)) + 1
+    starts = np.concatenate([[0], boundaries])
+    stops = np.concatenate([boundaries, [len(values)]])
+    for start, stop in zip(starts, stops):
+        yield int(values[start]), int(start), int(stop)
@@ -0,0 +1,87 @@
+"""
+Seeded synthetic market data
+Generates a reproducible ticker universe and daily OHLCV panel for offline
+runs, load tests and benchmarks
+"""
+from datetime import datetime
+from string import ascii_uppercase
+from typing import Dict, List, Optional
+import numpy as np
+import pandas as pd
+
+from panel import FIELDS
+
+
+def synthetic_tickers(n_tickers: int) -> List[str]:
+    """n distinct, sorted ticker symbols (A, B, ..., Z, AA, AB, ...)"""
+    tickers = []
+    i = 0
+    while len(tickers) < n_tickers:
+        symbol, k = "", i
+        while True:
+            symbol = ascii_uppercase[k % 26] + symbol
+            k = k // 26 - 1
+            if k < 0:
+                break
+        tickers.append(symbol)
+        i += 1
+    return sorted(tickers)
+
+
+def synthetic_panel(n_tickers: int = 3000, n_days: int = 504, seed: int = 0,
+                    end: Optional[str] = None, late_listing_rate: float = 0.05,
+                    gap_rate: float = 0.001) -> Dict[str, pd.DataFrame]:
+    """
+    Date x ticker OHLCV panel of geometric random walks
+
+    Business days end at `end` (default: the latest weekday). A fraction of
+    tickers list part-way through the period (NaN before their first bar)
+    and single bars are dropped at `gap_rate` to mimic halts.
+    """
+    rng = np.random.default_rng(seed)
+    end = pd.Timestamp(end or datetime.now().date())
+    dates = pd.bdate_range(end=end, periods=n_days, name='date')
+    tickers = synthetic_tickers(n_tickers)
+
+    drift = rng.normal(0.0003, 0.0005, n_tickers)
+    vol = rng.uniform(0.01, 0.05, n_tickers)
+    returns = rng.normal(drift, vol, (n_days, n_tickers))
+    start_price = np.exp(rng.uniform(np.log(2), np.log(300), n_tickers))
+    close = start_price * np.exp(np.cumsum(returns, axis=0))
+
+    wick = lambda: np.abs(rng.normal(0, vol / 2, (n_days, n_tickers)))
+    open_ = close * np.exp(rng.normal(0, vol / 2, (n_days, n_tickers)))
+    high = np.maximum(open_, close) * np.exp(wick())
+    low = np.minimum(open_, close) * np.exp(-wick())
+
+    base_volume = np.exp(rng.uniform(np.log(5e4), np.log(5e7), n_tickers))
+    volume = np.round(base_volume * rng.lognormal(0, 0.5, (n_days, n_tickers)))
+
+    missing = rng.random((n_days, n_tickers)) < gap_rate
+    listed = rng.random(n_tickers) < late_listing_rate
+    first_bar = np.where(listed, rng.integers(0, n_days, n_tickers), 0)
+    missing |= np.arange(n_days)[:, None] < first_bar[None, :]
+    missing[-1] = False  # every ticker trades on the last day
+
+    panel = {}
+    for field, values in zip(FIELDS, [open_, high, low, close, volume]):
+        values = np.where(missing, np.nan, np.round(values, 4) if field != 'volume' else values)
+        panel[field] = pd.DataFrame(values, index=dates, columns=tickers)
+    return panel
+
+
+def synthetic_universe(tickers: List[str], seed: int = 0) -> pd.DataFrame:
+    """Reference data for tickers, mostly common stocks with some ETFs and warrants"""
+    rng = np.random.default_rng(seed + 1)
+    types = rng.choice(['CS', 'ETF', 'WARRANT'], size=len(tickers), p=[0.85, 0.1, 0.05])
+    exchanges = rng.choice(['XNAS', 'XNYS', 'ARCX'], size=len(tickers))
+    return pd.DataFrame({
+        'ticker': tickers,
+        'name': [f"{ticker} Holdings Inc." for ticker in tickers],
+        'market': 'stocks',
+        'locale': 'us',
+        'type': types,
+        'primary_exchange': exchanges,
+        'active': True,
+        'last_updated_utc': pd.Timestamp('2024-01-02', tz='UTC'),
+    })
@@ -0,0 +1,8 @@
+"""
+Test setup: modules under scanner/ import each other flat (from panel
+import FIELDS), as when run from scanner/
+"""
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
@@ -0,0 +1,61 @@
+"""Scan replay against the scan engine run on one day's dataset"""
+import pandas as pd
+import pytest
+
+from backtest import ScanReplay
+from indicators import latest_indicator_rows
+from relative_strength import relative_strength
+from strategies.scans import ScanEngine, get_scan_set, prepare_derived_columns
+from synthetic import synthetic_panel
+
+
+@pytest.fixture(scope='module')
+def panel():
+    return synthetic_panel(300, 300, seed=3)
+
+
+@pytest.fixture(scope='module')
+def benchmark(panel):
+    return panel['close'].iloc[:, 0]
+
+
+@pytest.fixture(scope='module')
+def replay(panel, benchmark):
+    return ScanReplay(panel, benchmark=benchmark)
+
+
+def day_engine(panel, benchmark) -> ScanEngine:
+    """ScanEngine over the dataset build_scan_dataset makes from the panel's last date"""
+    dataset = latest_indicator_rows(panel)
+    ranked = relative_strength(panel, benchmark)
+    for name, frame in ranked.items():
+        dataset[name] = dataset['ticker'].map(frame.ffill().iloc[-1])
+    return ScanEngine(prepare_derived_columns(dataset), panel={**panel, **ranked})
+
+
+@pytest.mark.parametrize('scan_set', ['guru', 'eod'])
+def test_last_date_matches_scan_engine(panel, benchmark, replay, scan_set):
+    all_scans = get_scan_set(scan_set)
+    results, errors = replay.run(all_scans)
+    assert errors == {}
+
+    engine = day_engine(panel, benchmark)
+    for (guru_name, scan_name), hits in results.items():
+        scan = all_scans[guru_name]['scans'][scan_name]
+        expected = engine.run_scan(scan['query'], scan['order_by'], scan['limit'])['ticker']
+        assert sorted(replay.tickers[hits[-1]]) == sorted(expected), scan_name
+
+
+def test_replay_hits_limit_and_eligibility(replay):
+    hits = replay.hits("close>0", order_by='volume', limit=10)
+    assert (hits.sum(axis=1) <= 10).all()
+    assert not (hits & ~replay.eligible).any()
+    # The first rows are before any ticker has 50 bars
+    assert not hits[:49].any()
+
+
+def test_replay_orders_by_order_by(replay):
+    hits = replay.hits("close>0", order_by='volume', limit=5)
+    volume = pd.Series(replay.columns['volume'][-1], index=replay.tickers)
+    eligible = volume[replay.eligible[-1]]
+    assert sorted(replay.tickers[hits[-1]]) == sorted(eligible.nlargest(5).index)
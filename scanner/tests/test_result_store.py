@@ -0,0 +1,51 @@
+"""Day-over-day scan result changes"""
+import pandas as pd
+
+from result_store import ResultStore, diff_hits
+
+
+def hits_frame(rows):
+    return pd.DataFrame(rows, columns=['scan', 'ticker', 'rank'])
+
+
+def by_ticker(diff: pd.DataFrame, scan: int) -> pd.DataFrame:
+    return diff[diff['scan'] == scan].set_index('ticker')
+
+
+def test_diff_hits_statuses_and_rank_changes():
+    previous = hits_frame([(0, 10, 1), (0, 11, 2), (0, 12, 3), (1, 10, 1)])
+    today = hits_frame([(0, 12, 1), (0, 10, 2), (0, 13, 3), (1, 10, 1)])
+
+    diff = diff_hits(today, previous)
+    scan = by_ticker(diff, 0)
+
+    assert scan.loc[13, 'status'] == 'new'
+    assert pd.isna(scan.loc[13, 'rank_previous'])
+    assert scan.loc[11, 'status'] == 'dropped'
+    assert pd.isna(scan.loc[11, 'rank_today'])
+    assert scan.loc[12, 'status'] == 'held'
+    assert scan.loc[12, 'rank_change'] == 2
+    assert scan.loc[10, 'status'] == 'held'
+    assert scan.loc[10, 'rank_change'] == -1
+    assert by_ticker(diff, 1).loc[10, 'rank_change'] == 0
+    assert len(diff) == 5
+
+
+def test_diff_hits_against_empty_day():
+    today = hits_frame([(0, 1, 1), (0, 2, 2)])
+    diff = diff_hits(today, hits_frame([]))
+    assert set(diff['status']) == {'new'}
+    diff = diff_hits(hits_frame([]), today)
+    assert set(diff['status']) == {'dropped'}
+
+
+def test_changes_between_stored_days(tmp_path):
+    store = ResultStore(tmp_path)
+    store.put('2026-10-15', {('Guru', 'Scan'): ['AAA', 'BBB', 'CCC'], ('Guru', 'Empty'): []})
+    changes = store.changes('2026-10-16', {('Guru', 'Scan'): ['CCC', 'AAA', 'DDD'], ('Guru', 'Empty'): ['AAA']})
+
+    scan = changes[('Guru', 'Scan')]
+    assert scan['new'] == ['DDD']
+    assert scan['dropped'] == ['BBB']
+    assert scan['rank_change'] == {'CCC': 2, 'AAA': -1}
+    assert changes[('Guru', 'Empty')]['new'] == ['AAA']
@@ -0,0 +1,87 @@
+"""
+Local ticker universe cache
+The universe is kept as a typed Parquet file so it loads in milliseconds,
+and is kept current by merging in only the tickers that changed
+"""
+import os
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Optional
+import pandas as pd
+
+# Column dtypes of the cached universe; low-cardinality fields are categorical
+DTYPES = {
+    'ticker': 'string',
+    'name': 'string',
+    'market': 'category',
+    'locale': 'category',
+    'type': 'category',
+    'primary_exchange': 'category',
+    'active': 'bool',
+    'last_updated_utc': 'datetime64[ns, UTC]',
+}
+COLUMNS = list(DTYPES)
+
+
+def to_universe_frame(records: list) -> pd.DataFrame:
+    """Build a typed universe frame from a list of ticker dicts"""
+    df = pd.DataFrame(records, columns=COLUMNS)
+    df['last_updated_utc'] = pd.to_datetime(df['last_updated_utc'], utc=True, errors='coerce')
+    df['active'] = df['active'].fillna(True)
+    return df.astype(DTYPES)
+
+
+class UniverseStore:
+    """
+    Parquet cache of the ticker universe
+
+    A cache younger than `refresh_after` is used as is. An older one is
+    brought up to date with a delta (tickers updated since the newest
+    last_updated_utc in the cache), and one older than `full_refresh_after`
+    is rebuilt from a full listing in case deltas missed anything.
+    """
+
+    def __init__(self, path: Path, refresh_after: timedelta = timedelta(days=1),
+                 full_refresh_after: timedelta = timedelta(days=30)):
+        self.path = Path(path)
+        self.refresh_after = refresh_after
+        self.full_refresh_after = full_refresh_after
+
+    def age(self) -> Optional[timedelta]:
+        """Time since the cache was last written, None if there is no cache"""
+        if not self.path.exists():
+            return None
+        return datetime.now() - datetime.fromtimestamp(self.path.stat().st_mtime)
+
+    def load(self) -> Optional[pd.DataFrame]:
+        """Cached universe, or None if missing or unreadable"""
+        if not self.path.exists():
+            return None
+        try:
+            return pd.read_parquet(self.path)
+        except Exception as e:
+            print(f"Universe cache unreadable ({e}), refetching")
+            return None
+
+    def watermark(self, universe: pd.DataFrame) -> Optional[pd.Timestamp]:
+        """Newest last_updated_utc in the universe, where the next delta starts"""
+        latest = universe['last_updated_utc'].max() if not universe.empty else pd.NaT
+        return None if pd.isna(latest) else latest
+
+    @staticmethod
+    def merge(universe: pd.DataFrame, changes: pd.DataFrame) -> pd.DataFrame:
+        """Apply changed tickers: upsert active ones, drop delisted ones"""
+        if changes.empty:
+            return universe
+        changes = changes.sort_values('last_updated_utc').drop_duplicates('ticker', keep='last')
+        kept = universe[~universe['ticker'].isin(changes['ticker'])]
+        active = changes[changes['active']]
+        merged = pd.concat([kept.astype(object), active.astype(object)], ignore_index=True)
+        return merged.sort_values('ticker', kind='stable').reset_index(drop=True).astype(DTYPES)
+
+    def save(self, universe: pd.DataFrame):
+        """Atomically write the universe"""
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = self.path.with_suffix('.tmp')
+        universe[COLUMNS].astype(DTYPES).to_parquet(tmp, index=False)
+        os.replace(tmp, self.path)